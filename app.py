@@ -2,6 +2,8 @@ from app import create_app, db
 from app.utils import init_scheduler
 from app.models import User, StudyRoom, Seat, Booking
 import click
+import os
+from sqlalchemy import insert
 from flask.cli import with_appcontext
 
 app = create_app()
@@ -39,6 +41,19 @@ def init_db_command():
 
 app.cli.add_command(init_db_command)
 
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """将已有数据库升级到当前版本：创建新表，补建已有表上新增的列、索引和预约的时间槽"""
+    from app.utils.schema import upgrade_schema
+    
+    changes = upgrade_schema()
+    for change in changes:
+        click.echo(change)
+    click.echo('数据库已是最新版本' if not changes else f'数据库升级完成，共 {len(changes)} 项修改')
+
+app.cli.add_command(upgrade_db_command)
+
 @click.command('create-demo-data')
 @with_appcontext
 def create_demo_data():
@@ -71,32 +86,13 @@ def create_demo_data():
     db.session.commit()
     
     # 添加座位
-    for i in range(1, 51):
-        has_power = i % 5 == 0  # 每5个座位有1个电源插座
-        seat = Seat(
-            room_id=room1.id,
-            seat_number=f"{i}",
-            has_power_outlet=has_power
-        )
-        db.session.add(seat)
-        
-    for i in range(1, 41):
-        has_power = i % 4 == 0  # 每4个座位有1个电源插座
-        seat = Seat(
-            room_id=room2.id,
-            seat_number=f"{i}",
-            has_power_outlet=has_power
-        )
-        db.session.add(seat)
-        
-    for i in range(1, 61):
-        has_power = i % 3 == 0  # 每3个座位有1个电源插座
-        seat = Seat(
-            room_id=room3.id,
-            seat_number=f"{i}",
-            has_power_outlet=has_power
-        )
-        db.session.add(seat)
+    seats = [(room1, 50, 5), (room2, 40, 4), (room3, 60, 3)]  # (自习室, 座位数, 每几个座位有1个电源插座)
+    db.session.execute(insert(Seat), [{
+        'room_id': room.id,
+        'seat_number': f"{i}",
+        'has_power_outlet': i % power_every == 0,
+        'is_active': True
+    } for room, count, power_every in seats for i in range(1, count + 1)])
     
     db.session.commit()
     
@@ -120,5 +116,257 @@ def create_demo_data():
 
 app.cli.add_command(create_demo_data)
 
+@click.command('backfill-booking-slots')
+@with_appcontext
+def backfill_booking_slots_command():
+    """为已有的有效预约补建防重叠时间槽"""
+    from app.utils.booking_service import backfill_slots
+    
+    db.create_all()
+    created, conflicts = backfill_slots()
+    click.echo(f'已为 {created} 个预约补建时间槽')
+    if conflicts:
+        click.echo(f'以下预约与已有预约时间重叠，未补建: {", ".join(map(str, conflicts))}')
+
+app.cli.add_command(backfill_booking_slots_command)
+
+@click.command('rebuild-usage-rollups')
+@with_appcontext
+def rebuild_usage_rollups_command():
+    """根据历史预约重建使用统计汇总表"""
+    from app.utils.rollups import rebuild_usage_rollups
+    from app.utils.schema import upgrade_schema
+    
+    upgrade_schema()
+    rows = rebuild_usage_rollups()
+    click.echo(f'已重建 {rows} 条使用统计汇总记录')
+
+app.cli.add_command(rebuild_usage_rollups_command)
+
+@click.command('export-bookings')
+@click.option('--format', 'export_format', type=click.Choice(['csv', 'parquet']), default='csv', help='导出格式')
+@click.option('--status', default=None, help='按预约状态筛选')
+@click.option('--room-id', type=int, default=None, help='按自习室筛选')
+@click.option('--date', 'date_str', default=None, help='按日期筛选，格式 YYYY-MM-DD')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), required=True, help='输出文件路径')
+@with_appcontext
+def export_bookings_command(export_format, status, room_id, date_str, output):
+    """分批流式导出预约数据"""
+    from flask import current_app
+    from app.utils.export import iter_booking_batches, iter_csv, iter_parquet
+    
+    batches = iter_booking_batches(status, room_id, date_str, current_app.config.get('EXPORT_BATCH_SIZE', 1000))
+    if export_format == 'parquet':
+        try:
+            import pyarrow
+        except ImportError:
+            raise click.ClickException('未安装 pyarrow，无法导出 Parquet 格式')
+        chunks = iter_parquet(batches)
+        mode, encoding = 'wb', None
+    else:
+        chunks = iter_csv(batches)
+        mode, encoding = 'w', 'utf-8'
+    
+    with open(output, mode, encoding=encoding, newline='' if encoding else None) as f:
+        for chunk in chunks:
+            f.write(chunk)
+    click.echo(f'预约数据已导出到 {output}')
+
+app.cli.add_command(export_bookings_command)
+
+@click.command('import-seats')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--room-id', type=int, default=None, help='导入到指定自习室；不指定时按文件中的 room 列匹配或新建自习室')
+@with_appcontext
+def import_seats_command(path, room_id):
+    """从 CSV/JSON 平面图文件批量导入座位"""
+    from app.utils.seat_import import import_seat_rows
+    from app.utils.file_rows import read_rows
+    from app.utils.schema import upgrade_schema
+    
+    upgrade_schema()
+    with open(path, encoding='utf-8-sig') as f:
+        rows = read_rows(f, path)
+    created, errors = import_seat_rows(rows, room_id=room_id)
+    for line, message in errors:
+        click.echo(f'第 {line} 行: {message}', err=True)
+    if errors:
+        raise click.ClickException(f'共 {len(errors)} 处错误，未导入任何座位')
+    click.echo(f'成功导入 {created} 个座位')
+
+app.cli.add_command(import_seats_command)
+
+@click.command('import-roster')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--credentials', type=click.Path(dir_okay=False), default=None,
+              help='生成的初始密码追加写入的 CSV 文件，花名册没有 password 列时必填')
+@click.option('--workers', type=int, default=None, help='哈希密码的进程数，默认为CPU核数')
+@click.option('--batch-size', type=int, default=1000, help='每批插入并提交的账号数')
+@click.option('--hash-method', default=None, help='初始密码的哈希算法，默认使用 PASSWORD_HASH_METHOD，首次登录时自动升级')
+@with_appcontext
+def import_roster_command(path, credentials, workers, batch_size, hash_method):
+    """从教务花名册（CSV/JSON）批量创建学生账号，中断后可重新执行继续导入"""
+    from app.utils.roster_import import import_roster
+    from app.utils.file_rows import read_rows
+    
+    with open(path, encoding='utf-8-sig') as f:
+        rows = read_rows(f, path)
+    output = open(credentials, 'a', newline='', encoding='utf-8') if credentials else None
+    try:
+        created, skipped, errors = import_roster(rows, workers=workers, batch_size=batch_size,
+                                                 method=hash_method, credentials=output)
+    finally:
+        if output is not None:
+            output.close()
+    for line, message in errors:
+        click.echo(f'第 {line} 行: {message}', err=True)
+    if errors:
+        raise click.ClickException(f'共 {len(errors)} 处错误，未导入任何账号')
+    click.echo(f'成功创建 {created} 个账号，跳过已存在的 {skipped} 个')
+    if credentials and created:
+        click.echo(f'初始密码已写入 {credentials}')
+
+app.cli.add_command(import_roster_command)
+
+@click.command('archive-bookings')
+@click.option('--days', type=int, default=None, help='归档结束超过多少天的预约，默认使用 ARCHIVE_AFTER_DAYS')
+@with_appcontext
+def archive_bookings_command(days):
+    """将旧的已结束预约分批移入归档表"""
+    from app.utils.archive import archive_bookings
+    from app.utils.schema import upgrade_schema
+    
+    upgrade_schema()
+    archived = archive_bookings(after_days=days)
+    click.echo(f'已归档 {archived} 个预约')
+
+app.cli.add_command(archive_bookings_command)
+
+@click.command('run-lottery')
+@click.option('--date', 'date_str', default=None, help='放号日期（YYYY-MM-DD），默认为明天')
+@with_appcontext
+def run_lottery_command(date_str):
+    """立即为放号日的抽签志愿分配座位"""
+    from datetime import date
+    from app.utils.lottery import lottery_day, allocate_lottery
+    
+    db.create_all()
+    day = date.fromisoformat(date_str) if date_str else lottery_day()
+    allocated, unallocated = allocate_lottery(day)
+    click.echo(f'{day} 抽签完成：分配 {allocated} 人，未分配 {unallocated} 人')
+
+app.cli.add_command(run_lottery_command)
+
+@click.command('benchmark-passwords')
+@click.option('--seconds', type=float, default=5.0, help='测试时长（秒）')
+@click.option('--clients', type=int, default=None, help='并发登录数，默认为哈希线程数的两倍')
+@with_appcontext
+def benchmark_passwords_command(seconds, clients):
+    """按当前密码哈希配置测试登录校验吞吐量（次/秒/核）"""
+    import threading
+    import time
+    from werkzeug.security import generate_password_hash
+    from app.utils.passwords import password_hasher
+    
+    password_hash = generate_password_hash('benchmark', password_hasher.method)
+    clients = clients or password_hasher.workers * 2
+    counts = [0] * clients
+    deadline = time.perf_counter() + seconds
+    
+    def client(index):
+        while time.perf_counter() < deadline:
+            password_hasher.verify(password_hash, 'benchmark')
+            counts[index] += 1
+    
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    
+    cores = min(password_hasher.workers, os.cpu_count() or 1)
+    rate = sum(counts) / elapsed
+    click.echo(f'算法: {password_hasher.method}，哈希线程: {password_hasher.workers}，并发登录: {clients}')
+    click.echo(f'共校验 {sum(counts)} 次，耗时 {elapsed:.2f} 秒')
+    click.echo(f'吞吐量: {rate:.1f} 次/秒，{rate / cores:.1f} 次/秒/核')
+
+app.cli.add_command(benchmark_passwords_command)
+
+@click.command('benchmark-booking')
+@click.option('--requests', 'total', type=int, default=2000, help='预约请求数，每个请求来自不同的学生')
+@click.option('--clients', type=int, default=32, help='并发请求线程数')
+@click.option('--seats', type=int, default=500, help='座位数，请求随机选择座位和时段，部分请求会冲突')
+def benchmark_booking_command(total, clients, seats):
+    """在临时数据库上比较直接创建预约与准入队列批量创建预约的吞吐量"""
+    import random
+    import tempfile
+    import threading
+    import time
+    from datetime import datetime, timedelta
+    from app.utils.booking_service import create_booking
+    from app.utils.admission import booking_admission
+    
+    rng = random.Random(0)
+    requests = [(i, rng.randrange(seats), rng.randrange(12)) for i in range(total)]
+    tomorrow = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+    
+    for mode in ('direct', 'queue'):
+        path = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite')
+        bench_app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+            'BOOKING_ADMISSION_ENABLED': mode == 'queue'
+        })
+        with bench_app.app_context():
+            db.create_all()
+            room = StudyRoom(name='压测自习室', building='压测楼', floor=1, capacity=seats)
+            db.session.add(room)
+            db.session.flush()
+            db.session.execute(insert(Seat), [{'room_id': room.id, 'seat_number': str(i), 'has_power_outlet': False,
+                                               'is_active': True} for i in range(seats)])
+            db.session.execute(insert(User), [{'student_id': f'bench{i}', 'username': f'压测{i}',
+                                               'email': f'bench{i}@fudan.edu.cn', 'password_hash': '!',
+                                               'is_admin': False, 'violation_count': 0} for i in range(total)])
+            db.session.commit()
+            user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+            seat_ids = [seat_id for (seat_id,) in db.session.query(Seat.id).order_by(Seat.id)]
+        
+        pending = iter(requests)
+        lock = threading.Lock()
+        confirmed = []
+        
+        def client():
+            with bench_app.app_context():
+                while True:
+                    with lock:
+                        item = next(pending, None)
+                    if item is None:
+                        return
+                    user_index, seat_index, hour = item
+                    start_time = tomorrow + timedelta(hours=8 + hour)
+                    end_time = start_time + timedelta(hours=1)
+                    if mode == 'queue':
+                        ticket = booking_admission.submit(user_ids[user_index], seat_ids[seat_index], start_time, end_time)
+                        ok = ticket is not None and ticket.wait(60) and ticket.status == 'confirmed'
+                    else:
+                        seat = db.session.get(Seat, seat_ids[seat_index])
+                        ok = seat.is_available(start_time, end_time) and \
+                            create_booking(user_ids[user_index], seat.id, start_time, end_time)[0] is not None
+                    if ok:
+                        confirmed.append(1)
+        
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        click.echo(f'{mode}: {total} 个请求，成功 {len(confirmed)} 个，耗时 {elapsed:.2f} 秒，{total / elapsed:.1f} 请求/秒')
+    click.echo(f'准入队列: {booking_admission.stats()}')
+
+app.cli.add_command(benchmark_booking_command)
+
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
@@ -11,7 +11,7 @@ login_manager = LoginManager()
 mail = Mail()
 scheduler = APScheduler()
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__, template_folder='../templates', static_folder='../static')
     
     # 配置应用
@@ -25,8 +25,46 @@ def create_app():
         MAIL_USERNAME='example@fudan.edu.cn',
         MAIL_PASSWORD='password',
         MAIL_DEFAULT_SENDER=('复旦自习室系统', 'example@fudan.edu.cn'),
-        MAX_BOOKING_HOURS=4  # 最大预约时长（小时）
+        MAX_BOOKING_HOURS=4,  # 最大预约时长（小时）
+        BOOKING_SLOT_MINUTES=60,  # 预约防重叠时间槽的粒度（分钟），预约以整点为单位
+        OCCUPANCY_INDEX_ENABLED=True,  # 是否使用内存中的座位占用索引
+        OCCUPANCY_SLOT_MINUTES=15,  # 座位占用索引的时间槽粒度（分钟）
+        OCCUPANCY_REFRESH_SECONDS=5,  # 占用索引与数据库同步的间隔（秒）
+        SEAT_COUNTER_REFRESH_SECONDS=30,  # 首页空闲座位计数器的刷新间隔（秒）
+        DEADLINE_POLL_SECONDS=5,  # 截止事件调度器加载其他进程新预约的间隔（秒）
+        OUTBOX_BATCH_SIZE=50,  # 每个SMTP连接发送的邮件数
+        OUTBOX_MAX_ATTEMPTS=5,  # 邮件最大发送次数
+        OUTBOX_RETRY_SECONDS=60,  # 邮件重试的初始退避时间（秒），之后每次翻倍
+        OUTBOX_POLL_SECONDS=5,  # 发件箱轮询间隔（秒）
+        SCHEDULER_LEASE_SECONDS=30,  # 调度器主节点租约时长（秒），主节点失效后最多这么久被接管
+        ADMIN_PAGE_SIZE=50,  # 预约管理页每页显示的预约数
+        BOOKING_COUNT_CACHE_SECONDS=60,  # 预约管理页总数的缓存时间（秒）
+        ROLLUP_REFRESH_SECONDS=60,  # 使用统计汇总表的增量刷新间隔（秒）
+        EXPORT_BATCH_SIZE=1000,  # 导出预约时每批读取的行数
+        DASHBOARD_CACHE_SECONDS=30,  # 管理员控制面板计数器的缓存时间（秒）
+        ARCHIVE_AFTER_DAYS=90,  # 已结束的预约超过多少天后移入归档表
+        ARCHIVE_BATCH_SIZE=1000,  # 每批归档的预约数
+        USER_CACHE_SECONDS=60,  # 登录用户缓存的有效期（秒），其他进程的修改最多延迟这么久可见
+        USER_CACHE_SIZE=10000,  # 登录用户缓存的最大条目数
+        PASSWORD_HASH_METHOD='pbkdf2:sha256:260000',  # 密码哈希算法和迭代次数，修改后旧哈希在用户登录时自动升级
+        PASSWORD_HASH_WORKERS=None,  # 密码哈希线程数，默认为CPU核数
+        PASSWORD_HASH_QUEUE_LIMIT=32,  # 密码哈希最多排队的请求数，超过时返回"繁忙，请重试"
+        BOOKING_ADMISSION_ENABLED=True,  # 是否通过准入队列批量创建预约
+        ADMISSION_QUEUE_SIZE=5000,  # 准入队列最多排队的预约请求数，超过时提示稍后重试
+        ADMISSION_BATCH_SIZE=200,  # 写入线程每个事务最多提交的预约请求数
+        ADMISSION_WAIT_SECONDS=2,  # 预约请求同步等待处理结果的时间（秒），超时后跳转到排队页面
+        ADMISSION_TICKET_SECONDS=600,  # 排队票据的保留时间（秒）
+        LOTTERY_ENABLED=False,  # 是否以抽签方式分配次日的座位
+        LOTTERY_OPEN_HOUR=7,  # 抽签志愿提交窗口的开始时间（点）
+        LOTTERY_CLOSE_HOUR=8,  # 抽签志愿提交窗口的截止时间（点），截止后统一分配并开放剩余座位
+        LOTTERY_MAX_PREFERENCES=5,  # 每个学生最多填写的志愿数
+        LOTTERY_VIOLATION_WEIGHT=1.0,  # 违约次数对中签权重的影响，权重为 1 / (1 + 系数 * 违约次数)
+        IDEMPOTENCY_KEY_SECONDS=86400,  # 预约和取消请求的幂等键保留时间（秒）
+        RECURRING_MAX_OCCURRENCES=120,  # 一次周期预约最多包含的次数
+        GROUP_BOOKING_MAX_SIZE=8  # 小组预约最多人数（含发起人）
     )
+    if config is not None:
+        app.config.update(config)
     
     # 确保实例文件夹存在
     try:
@@ -40,8 +78,29 @@ def create_app():
     login_manager.login_view = 'auth.login'
     login_manager.login_message = '请先登录以访问此页面'
     mail.init_app(app)
+    
+    from app.utils.occupancy import occupancy_index
+    occupancy_index.init_app(app)
+    
+    from app.utils.seat_counters import seat_counters
+    seat_counters.init_app(app)
+    
+    from app.utils.dashboard import dashboard_counters
+    dashboard_counters.init_app(app)
+    
+    from app.utils.user_cache import user_cache
+    user_cache.init_app(app)
+    
+    from app.utils.passwords import password_hasher
+    password_hasher.init_app(app)
+    
+    from app.utils.admission import booking_admission
+    booking_admission.init_app(app)
+    
+    from app.utils.idempotency import idempotency_store
+    idempotency_store.init_app(app)
+    
     scheduler.init_app(app)
-    scheduler.start()
     
     # 注册蓝图
     from app.routes import auth, student, admin, main
@@ -4,4 +4,10 @@ db = SQLAlchemy()
 
 from app.models.user import User
 from app.models.study_room import StudyRoom, Seat
-from app.models.booking import Booking 
\ No newline at end of file
+from app.models.booking import Booking, BookingSlot, BookingNotification, ArchivedBooking
+from app.models.outbox import OutboxEmail
+from app.models.scheduler_lease import SchedulerLease
+from app.models.usage import RoomUsageHourly, RollupWatermark
+from app.models.lottery import LotteryEntry, LotteryDay
+from app.models.idempotency import IdempotencyKey
+from app.models.admission import AdmissionTicket
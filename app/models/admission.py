@@ -0,0 +1,22 @@
+from app import db
+from datetime import datetime
+
+class AdmissionTicket(db.Model):
+    """准入队列票据的处理结果，供其他进程回答排队页面的轮询"""
+    __tablename__ = 'admission_tickets'
+    
+    id = db.Column(db.String(40), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    seat_id = db.Column(db.Integer, nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), nullable=False)  # confirmed, rejected
+    booking_id = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.String(200), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+    
+    def to_dict(self):
+        return {'ticket': self.id, 'status': self.status, 'booking_id': self.booking_id, 'error': self.error}
+    
+    def __repr__(self):
+        return f'<AdmissionTicket {self.id} {self.status}>'
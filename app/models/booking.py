@@ -3,6 +3,15 @@ from datetime import datetime, timedelta
 
 class Booking(db.Model):
     __tablename__ = 'bookings'
+    __table_args__ = (
+        db.Index('ix_bookings_status_start_time', 'status', 'start_time'),
+        db.Index('ix_bookings_status_end_time', 'status', 'end_time'),
+        db.Index('ix_bookings_start_time_id', 'start_time', 'id'),
+        db.Index('ix_bookings_updated_at', 'updated_at'),
+        db.Index('ix_bookings_booking_time', 'booking_time'),
+        # 归档会删除旧预约，禁止 SQLite 复用已删除的最大ID，保证与归档表中的ID不冲突
+        {'sqlite_autoincrement': True},
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -12,6 +21,7 @@ class Booking(db.Model):
     status = db.Column(db.String(20), default='confirmed')  # confirmed, checked_in, cancelled, completed, expired
     booking_time = db.Column(db.DateTime, default=datetime.now)
     checkin_time = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)  # 用于增量刷新使用汇总
     
     def __init__(self, user_id, seat_id, start_time, end_time):
         self.user_id = user_id
@@ -23,18 +33,34 @@ class Booking(db.Model):
         self.status = 'checked_in'
         self.checkin_time = datetime.now()
         db.session.commit()
+        self._sync_occupancy()
         
     def cancel(self):
         self.status = 'cancelled'
+        self._release_slots()
         db.session.commit()
+        self._sync_occupancy()
         
     def complete(self):
         self.status = 'completed'
+        self._release_slots()
         db.session.commit()
+        self._sync_occupancy()
         
     def expire(self):
         self.status = 'expired'
+        self._release_slots()
         db.session.commit()
+        self._sync_occupancy()
+        
+    def _release_slots(self):
+        """预约结束后释放占用的时间槽"""
+        BookingSlot.query.filter_by(booking_id=self.id).delete()
+        
+    def _sync_occupancy(self):
+        """将状态变化同步到座位占用索引"""
+        from app.utils.occupancy import occupancy_index
+        occupancy_index.sync_booking(self)
         
     def is_active(self):
         now = datetime.now()
@@ -70,4 +96,71 @@ class Booking(db.Model):
         return self.end_time - now
         
     def __repr__(self):
-        return f'<Booking {self.id} for User {self.user_id} on Seat {self.seat_id}>' 
\ No newline at end of file
+        return f'<Booking {self.id} for User {self.user_id} on Seat {self.seat_id}>' 
+
+
+class BookingSlot(db.Model):
+    """有效预约占用的时间槽
+
+    每个预约按 BOOKING_SLOT_MINUTES 拆分为若干行，(seat_id, slot_start) 和
+    (user_id, slot_start) 上的唯一约束由数据库保证同一座位、同一用户的
+    有效预约不会重叠，即使多个进程同时写入。
+    """
+    __tablename__ = 'booking_slots'
+    __table_args__ = (
+        db.UniqueConstraint('seat_id', 'slot_start', name='uq_booking_slots_seat'),
+        db.UniqueConstraint('user_id', 'slot_start', name='uq_booking_slots_user'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id'), nullable=False, index=True)
+    seat_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    slot_start = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<BookingSlot {self.slot_start} of Booking {self.booking_id}>'
+
+
+
+class BookingNotification(db.Model):
+    """预约通知发送记录，(booking_id, kind) 主键保证每类通知只发送一次"""
+    __tablename__ = 'booking_notifications'
+    
+    booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id'), primary_key=True)
+    kind = db.Column(db.String(20), primary_key=True)  # reminder, late_warning
+    sent_at = db.Column(db.DateTime, default=datetime.now)
+    
+    def __repr__(self):
+        return f'<BookingNotification {self.kind} for Booking {self.booking_id}>'
+
+
+class ArchivedBooking(db.Model):
+    """已归档的历史预约
+
+    已结束（completed、cancelled、expired）且超过 ARCHIVE_AFTER_DAYS 天的预约
+    从 bookings 表移到这里，保留原预约ID，使 bookings 表只包含近期数据。
+    """
+    __tablename__ = 'bookings_archive'
+    __table_args__ = (
+        db.Index('ix_bookings_archive_user_start_time', 'user_id', 'start_time'),
+        db.Index('ix_bookings_archive_start_time', 'start_time'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    seat_id = db.Column(db.Integer, db.ForeignKey('seats.id'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    booking_time = db.Column(db.DateTime)
+    checkin_time = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.now)
+    
+    # 关联
+    user = db.relationship('User')
+    seat = db.relationship('Seat')
+    
+    def __repr__(self):
+        return f'<ArchivedBooking {self.id} for User {self.user_id} on Seat {self.seat_id}>'
@@ -0,0 +1,20 @@
+from app import db
+from datetime import datetime
+
+class IdempotencyKey(db.Model):
+    """带幂等键的 POST 请求及其结果，重放时直接返回记录的结果
+
+    记录与请求所做的修改在同一事务中写入，因此存在即表示请求已完成。
+    """
+    __tablename__ = 'idempotency_keys'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    key = db.Column(db.String(64), primary_key=True)
+    endpoint = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer, nullable=True)
+    location = db.Column(db.String(255), nullable=True)
+    flashes = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+    
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key} of user {self.user_id}>'
@@ -0,0 +1,37 @@
+from app import db
+from datetime import datetime
+
+class LotteryEntry(db.Model):
+    """抽签放号时学生提交的志愿，每个学生每个放号日一条
+
+    preferences 为按志愿顺序排列的列表，每项为 {'room_id': ..., 'seat_id': ...}，
+    seat_id 为空表示该自习室的任意座位。
+    """
+    __tablename__ = 'lottery_entries'
+    __table_args__ = (db.UniqueConstraint('user_id', 'day', name='uq_lottery_entries_user_day'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False, index=True)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    preferences = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(20), default='pending')  # pending, allocated, unallocated
+    booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    
+    user = db.relationship('User')
+    booking = db.relationship('Booking')
+    
+    def __repr__(self):
+        return f'<LotteryEntry user {self.user_id} on {self.day}>'
+
+class LotteryDay(db.Model):
+    """已完成抽签分配的放号日；分配提交后才开放该日期的直接预约"""
+    __tablename__ = 'lottery_days'
+    
+    day = db.Column(db.Date, primary_key=True)
+    allocated_at = db.Column(db.DateTime, default=datetime.now)
+    
+    def __repr__(self):
+        return f'<LotteryDay {self.day}>'
@@ -0,0 +1,30 @@
+from app import db
+from datetime import datetime
+
+class OutboxEmail(db.Model):
+    """待发送邮件队列"""
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+        db.Index('ix_email_outbox_status_sent_at', 'status', 'sent_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default='pending')  # pending, sent, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.now)
+    last_error = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    send_seconds = db.Column(db.Float, nullable=True)  # SMTP 发送耗时
+    
+    def __init__(self, recipient, subject, html):
+        self.recipient = recipient
+        self.subject = subject
+        self.html = html
+        
+    def __repr__(self):
+        return f'<OutboxEmail {self.id} to {self.recipient}>'
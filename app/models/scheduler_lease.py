@@ -0,0 +1,12 @@
+from app import db
+
+class SchedulerLease(db.Model):
+    """调度器主节点租约，持有未过期租约的进程负责运行定时任务"""
+    __tablename__ = 'scheduler_leases'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<SchedulerLease {self.name} held by {self.holder}>'
@@ -1,5 +1,5 @@
 from app import db
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
 
 class StudyRoom(db.Model):
     __tablename__ = 'study_rooms'
@@ -40,6 +40,17 @@ class StudyRoom(db.Model):
             
         return self.open_time <= current_time <= self.close_time
         
+    def is_open_during(self, start_time, end_time):
+        """时间段内的每个整点是否都在开放时间内"""
+        if self.is_24h:
+            return True
+        current_time = start_time
+        while current_time < end_time:
+            if not self.open_time <= current_time.time() <= self.close_time:
+                return False
+            current_time += timedelta(hours=1)
+        return True
+        
     def update_verify_code(self, code, qr_path=None):
         self.verify_code = code
         if qr_path:
@@ -58,6 +69,8 @@ class Seat(db.Model):
     seat_number = db.Column(db.String(10), nullable=False)
     has_power_outlet = db.Column(db.Boolean, default=False)  # 是否有电源插座
     is_active = db.Column(db.Boolean, default=True)
+    pos_x = db.Column(db.Integer, nullable=True)  # 平面图上的列位置
+    pos_y = db.Column(db.Integer, nullable=True)  # 平面图上的行位置
     
     # 关联
     bookings = db.relationship('Booking', backref='seat', lazy='dynamic')
@@ -70,10 +83,14 @@ class Seat(db.Model):
     def is_available(self, start_time, end_time):
         """检查指定时间段内座位是否可用"""
         from app.models.booking import Booking
+        from app.utils.occupancy import occupancy_index
         
         if not self.is_active:
             return False
             
+        if occupancy_index.enabled:
+            return occupancy_index.is_free(self.id, start_time, end_time)
+            
         # 查找与请求时间段重叠的预约
         overlapping_bookings = Booking.query.filter(
             Booking.seat_id == self.id,
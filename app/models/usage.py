@@ -0,0 +1,26 @@
+from app import db
+
+class RoomUsageHourly(db.Model):
+    """自习室每小时的使用汇总，按预约开始时间所在的小时和预约状态统计"""
+    __tablename__ = 'room_usage_hourly'
+    
+    room_id = db.Column(db.Integer, db.ForeignKey('study_rooms.id'), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    booking_count = db.Column(db.Integer, nullable=False, default=0)
+    booked_seat_hours = db.Column(db.Float, nullable=False, default=0)
+    checked_in_seat_hours = db.Column(db.Float, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<RoomUsageHourly room {self.room_id} {self.hour} {self.status}>'
+
+
+class RollupWatermark(db.Model):
+    """汇总表的增量刷新进度，记录已处理到的预约更新时间"""
+    __tablename__ = 'rollup_watermarks'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<RollupWatermark {self.name} at {self.value}>'
@@ -1,5 +1,4 @@
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from app import db, login_manager
 from datetime import datetime
 
@@ -26,10 +25,16 @@ class User(UserMixin, db.Model):
         self.is_admin = is_admin
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        from app.utils.passwords import password_hasher
+        self.password_hash = password_hasher.hash(password)
         
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """校验密码；哈希强度低于当前配置时顺便更新哈希，由调用方提交"""
+        from app.utils.passwords import password_hasher
+        valid, new_hash = password_hasher.verify(self.password_hash, password)
+        if new_hash:
+            self.password_hash = new_hash
+        return valid
     
     def add_violation(self):
         self.violation_count += 1
@@ -40,4 +45,5 @@ class User(UserMixin, db.Model):
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id)) 
\ No newline at end of file
+    from app.utils.user_cache import user_cache
+    return user_cache.load(int(user_id)) 
\ No newline at end of file
@@ -1,8 +1,24 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
 from app import db
 from app.models import User, StudyRoom, Seat, Booking
+from app.utils.seat_counters import seat_counters
+from app.utils.dashboard import dashboard_counters
+from app.utils.outbox import outbox_sender
+from app.utils.user_cache import user_cache
+from app.utils.passwords import password_hasher
+from app.utils.admission import booking_admission
+from app.utils.idempotency import idempotency_store
+from app.utils.cache import TTLCache
+from app.utils.rollups import usage_summary
+from app.utils.analytics import occupancy_heatmap, WEEKDAYS
+from app.utils.export import filter_bookings, iter_booking_batches, iter_csv, iter_parquet
+from app.utils.seat_import import import_seat_rows
+from app.utils.file_rows import read_rows
+from sqlalchemy import tuple_, insert
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
+import csv
 import random
 import string
 import qrcode
@@ -10,6 +26,13 @@ import os
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 
+# 预约管理页按筛选条件缓存的总数
+booking_counts = TTLCache(ttl=60)
+
+@bp.record_once
+def configure_caches(state):
+    booking_counts.ttl = state.app.config.get('BOOKING_COUNT_CACHE_SECONDS', 60)
+
 def admin_required(view):
     """管理员权限验证装饰器"""
     @login_required
@@ -25,28 +48,17 @@ def admin_required(view):
 @admin_required
 def index():
     """管理员控制面板"""
-    # 统计信息
-    total_rooms = StudyRoom.query.filter_by(is_active=True).count()
-    total_seats = Seat.query.filter_by(is_active=True).count()
-    total_users = User.query.filter_by(is_admin=False).count()
-    
-    # 今日预约数据
-    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    tomorrow = today + timedelta(days=1)
-    today_bookings = Booking.query.filter(
-        Booking.start_time >= today,
-        Booking.start_time < tomorrow
-    ).count()
+    # 统计信息，缓存 DASHBOARD_CACHE_SECONDS 秒
+    counters = dashboard_counters.get()
     
-    # 获取最近活跃的预约
-    recent_bookings = Booking.query.order_by(Booking.booking_time.desc()).limit(10).all()
+    # 获取最近活跃的预约，用户、座位和自习室随预约一起加载
+    recent_bookings = Booking.query.options(
+        joinedload(Booking.user), joinedload(Booking.seat).joinedload(Seat.room)
+    ).order_by(Booking.booking_time.desc()).limit(10).all()
     
     return render_template('admin/index.html',
-                          total_rooms=total_rooms,
-                          total_seats=total_seats,
-                          total_users=total_users,
-                          today_bookings=today_bookings,
-                          recent_bookings=recent_bookings)
+                          recent_bookings=recent_bookings,
+                          **counters)
 
 @bp.route('/rooms')
 @admin_required
@@ -84,6 +96,7 @@ def add_room():
         
         db.session.add(room)
         db.session.commit()
+        dashboard_counters.invalidate()
         
         # 生成初始验证码
         generate_verify_code(room)
@@ -115,6 +128,7 @@ def edit_room(room_id):
         room.is_active = 'is_active' in request.form
         
         db.session.commit()
+        dashboard_counters.invalidate()
         flash('自习室信息已更新', 'success')
         return redirect(url_for('admin.rooms'))
         
@@ -139,21 +153,47 @@ def add_seats(room_id):
         count = int(request.form['count'])
         has_power = 'has_power' in request.form
         
-        for i in range(count):
-            seat_number = f"{start_num + i}"
-            seat = Seat(
-                room_id=room.id,
-                seat_number=seat_number,
-                has_power_outlet=has_power
-            )
-            db.session.add(seat)
-            
+        db.session.execute(insert(Seat), [{
+            'room_id': room.id,
+            'seat_number': f"{start_num + i}",
+            'has_power_outlet': has_power,
+            'is_active': True
+        } for i in range(count)])
         db.session.commit()
+        seat_counters.invalidate()
+        dashboard_counters.invalidate()
         flash(f'成功添加 {count} 个座位', 'success')
         return redirect(url_for('admin.room_seats', room_id=room.id))
         
     return render_template('admin/add_seats.html', room=room)
 
+@bp.route('/room/<int:room_id>/import_seats', methods=['GET', 'POST'])
+@admin_required
+def import_seats(room_id):
+    """从 CSV/JSON 平面图文件批量导入座位"""
+    room = StudyRoom.query.get_or_404(room_id)
+    errors = []
+    
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('请选择要导入的文件', 'danger')
+            return redirect(url_for('admin.import_seats', room_id=room.id))
+        
+        try:
+            rows = read_rows(upload.stream, upload.filename)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            flash(f'无法解析文件: {str(e)}', 'danger')
+            return redirect(url_for('admin.import_seats', room_id=room.id))
+        
+        created, errors = import_seat_rows(rows, room_id=room.id)
+        if not errors:
+            flash(f'成功导入 {created} 个座位', 'success')
+            return redirect(url_for('admin.room_seats', room_id=room.id))
+        flash(f'文件中有 {len(errors)} 处错误，未导入任何座位', 'danger')
+        
+    return render_template('admin/import_seats.html', room=room, errors=errors[:200], error_count=len(errors))
+
 @bp.route('/seat/<int:seat_id>/toggle', methods=['POST'])
 @admin_required
 def toggle_seat(seat_id):
@@ -161,6 +201,8 @@ def toggle_seat(seat_id):
     seat = Seat.query.get_or_404(seat_id)
     seat.is_active = not seat.is_active
     db.session.commit()
+    seat_counters.invalidate()
+    dashboard_counters.invalidate()
     
     status = '启用' if seat.is_active else '禁用'
     flash(f'座位 {seat.seat_number} 已{status}', 'success')
@@ -181,41 +223,98 @@ def toggle_power(seat_id):
 @bp.route('/bookings')
 @admin_required
 def bookings():
-    """预约管理"""
+    """预约管理
+
+    按 (start_time, id) 倒序做键集分页：before 游标取更早的一页，after 游标
+    取更晚的一页，每页只扫描索引上的 ADMIN_PAGE_SIZE + 1 行，与总数据量无关。
+    """
     # 获取查询参数
     status = request.args.get('status')
     room_id = request.args.get('room_id')
     date_str = request.args.get('date')
+    before = parse_cursor(request.args.get('before'))
+    after = parse_cursor(request.args.get('after'))
+    page_size = current_app.config.get('ADMIN_PAGE_SIZE', 50)
     
     # 构建查询
-    query = Booking.query
+    query = filter_bookings(Booking.query, status, room_id, date_str)
     
-    if status:
-        query = query.filter_by(status=status)
-        
-    if room_id:
-        query = query.join(Seat).filter(Seat.room_id == room_id)
-        
-    if date_str:
-        date = datetime.fromisoformat(date_str).date()
-        next_date = date + timedelta(days=1)
-        start_datetime = datetime.combine(date, datetime.min.time())
-        end_datetime = datetime.combine(next_date, datetime.min.time())
-        query = query.filter(Booking.start_time >= start_datetime, Booking.start_time < end_datetime)
+    # 总数按筛选条件缓存，避免每次翻页都全表计数
+    total = booking_counts.get_or_set((status, room_id, date_str), query.count)
         
     # 获取所有自习室，用于筛选
     rooms = StudyRoom.query.all()
     
-    # 执行查询
-    bookings = query.order_by(Booking.start_time.desc()).all()
+    # 执行查询，一次性加载用户、座位和自习室
+    key = tuple_(Booking.start_time, Booking.id)
+    query = query.options(joinedload(Booking.user), joinedload(Booking.seat).joinedload(Seat.room))
+    if after:
+        rows = query.filter(key > after).order_by(Booking.start_time, Booking.id).limit(page_size + 1).all()
+        has_newer = len(rows) > page_size
+        bookings = rows[:page_size][::-1]
+        has_older = True
+    else:
+        if before:
+            query = query.filter(key < before)
+        rows = query.order_by(Booking.start_time.desc(), Booking.id.desc()).limit(page_size + 1).all()
+        bookings = rows[:page_size]
+        has_newer = before is not None
+        has_older = len(rows) > page_size
+    
+    filters = {'status': status, 'room_id': room_id, 'date': date_str}
+    newer_url = url_for('admin.bookings', after=format_cursor(bookings[0]), **filters) if bookings and has_newer else None
+    older_url = url_for('admin.bookings', before=format_cursor(bookings[-1]), **filters) if bookings and has_older else None
     
     return render_template('admin/bookings.html', 
                           bookings=bookings, 
                           rooms=rooms,
+                          total=total,
+                          newer_url=newer_url,
+                          older_url=older_url,
                           selected_room=room_id,
                           selected_status=status,
                           selected_date=date_str if date_str else datetime.now().date().isoformat())
 
+@bp.route('/bookings/export')
+@admin_required
+def export_bookings():
+    """按预约管理页的筛选条件流式导出预约，支持 CSV 和 Parquet"""
+    export_format = request.args.get('format', 'csv')
+    batches = iter_booking_batches(
+        status=request.args.get('status'),
+        room_id=request.args.get('room_id'),
+        date_str=request.args.get('date'),
+        batch_size=current_app.config.get('EXPORT_BATCH_SIZE', 1000)
+    )
+    
+    if export_format == 'parquet':
+        try:
+            import pyarrow
+        except ImportError:
+            flash('服务器未安装 pyarrow，无法导出 Parquet 格式', 'danger')
+            return redirect(url_for('admin.bookings', **request.args))
+        body, mimetype = iter_parquet(batches), 'application/vnd.apache.parquet'
+    else:
+        body, mimetype = iter_csv(batches), 'text/csv; charset=utf-8'
+    
+    filename = f'bookings_{datetime.now().strftime("%Y%m%d%H%M%S")}.{"parquet" if export_format == "parquet" else "csv"}'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+def format_cursor(booking):
+    """生成分页游标：开始时间_预约ID"""
+    return f'{booking.start_time.isoformat()}_{booking.id}'
+
+def parse_cursor(value):
+    """解析分页游标，格式错误时视为没有游标"""
+    if not value:
+        return None
+    try:
+        start_time, booking_id = value.rsplit('_', 1)
+        return datetime.fromisoformat(start_time), int(booking_id)
+    except ValueError:
+        return None
+
 @bp.route('/statistics')
 @admin_required
 def statistics():
@@ -238,25 +337,8 @@ def statistics():
         start_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=datetime.now().weekday())
         title = '本周使用统计'
         
-    # 各状态预约数
-    status_counts = db.session.query(
-        Booking.status, 
-        db.func.count(Booking.id)
-    ).filter(
-        Booking.start_time >= start_date
-    ).group_by(Booking.status).all()
-    
-    status_data = {status: count for status, count in status_counts}
-    
-    # 各自习室使用情况
-    room_usage = db.session.query(
-        StudyRoom.name,
-        db.func.count(Booking.id)
-    ).join(Seat, Seat.id == Booking.seat_id
-    ).join(StudyRoom, StudyRoom.id == Seat.room_id
-    ).filter(
-        Booking.start_time >= start_date
-    ).group_by(StudyRoom.name).order_by(db.func.count(Booking.id).desc()).all()
+    # 各状态预约数和各自习室使用情况，从小时汇总表读取
+    status_data, room_usage = usage_summary(start_date)
     
     # 违约用户
     violation_users = User.query.filter(User.violation_count > 0).order_by(User.violation_count.desc()).limit(10).all()
@@ -268,6 +350,48 @@ def statistics():
                           room_usage=room_usage,
                           violation_users=violation_users)
 
+@bp.route('/analytics')
+@admin_required
+def analytics():
+    """按星期和小时的占用率与爽约率热力图"""
+    today = datetime.now().date()
+    try:
+        start_date = datetime.fromisoformat(request.args['start']).date() if request.args.get('start') else today - timedelta(days=27)
+        end_date = datetime.fromisoformat(request.args['end']).date() if request.args.get('end') else today
+    except ValueError:
+        flash('日期格式不正确', 'danger')
+        start_date, end_date = today - timedelta(days=27), today
+    if end_date < start_date:
+        flash('结束日期不能早于开始日期', 'danger')
+        start_date, end_date = end_date, start_date
+    
+    heatmap = occupancy_heatmap(start_date, end_date)
+    # 区间内的状态分布直接读取使用统计汇总表
+    status_data, _ = usage_summary(
+        datetime.combine(start_date, datetime.min.time()),
+        datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+    )
+    
+    return render_template('admin/analytics.html',
+                          heatmap=heatmap,
+                          status_data=status_data,
+                          weekdays=WEEKDAYS,
+                          start_date=start_date.isoformat(),
+                          end_date=end_date.isoformat())
+
+@bp.route('/api/metrics')
+@admin_required
+def metrics():
+    """后台任务运行指标的API"""
+    return jsonify({
+        'dashboard_cache': dashboard_counters.stats(),
+        'outbox': outbox_sender.stats(),
+        'user_cache': user_cache.stats(),
+        'password_hasher': password_hasher.stats(),
+        'admission': booking_admission.stats(),
+        'idempotency': idempotency_store.stats()
+    })
+
 @bp.route('/verify_codes')
 @admin_required
 def verify_codes():
@@ -2,10 +2,19 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
 from app import db
 from app.models import User
-from werkzeug.security import generate_password_hash
+from app.utils.dashboard import dashboard_counters
+from app.utils.passwords import PasswordHasherBusy
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+@bp.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    """登录高峰时密码哈希队列已满，提示用户稍后重试"""
+    db.session.rollback()
+    flash('当前登录人数较多，请稍后重试', 'warning')
+    template = f'auth/{request.endpoint.rsplit(".", 1)[-1]}.html'
+    return render_template(template), 503, {'Retry-After': '1'}
+
 @bp.route('/register', methods=('GET', 'POST'))
 def register():
     if current_user.is_authenticated:
@@ -41,6 +50,7 @@ def register():
             )
             db.session.add(user)
             db.session.commit()
+            dashboard_counters.invalidate()
             flash('注册成功，请登录', 'success')
             return redirect(url_for('auth.login'))
             
@@ -67,6 +77,8 @@ def login():
             error = '密码不正确'
             
         if error is None:
+            # 提交登录时可能升级的密码哈希
+            db.session.commit()
             login_user(user, remember=remember)
             next_page = request.args.get('next')
             if not next_page or not next_page.startswith('/'):
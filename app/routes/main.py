@@ -1,5 +1,8 @@
 from flask import Blueprint, render_template, request, jsonify
-from app.models import StudyRoom, Seat
+from app import db
+from app.models import StudyRoom, Seat, Booking
+from app.utils.occupancy import occupancy_index
+from app.utils.seat_counters import seat_counters
 from flask_login import current_user
 from datetime import datetime, timedelta
 
@@ -8,26 +11,25 @@ bp = Blueprint('main', __name__)
 @bp.route('/')
 def index():
     # 获取可用自习室
-    now = datetime.now()
     active_rooms = StudyRoom.query.filter_by(is_active=True).all()
     
     # 获取当前可用的自习室
     available_rooms = [room for room in active_rooms if room.is_open()]
     
+    # 空闲座位数来自预先维护的计数器，不再逐座位查询
+    counters = seat_counters.snapshot()
+    
     # 查找有空座的自习室数量
     rooms_with_seats = []
     for room in available_rooms:
-        available_seats = 0
-        for seat in room.seats:
-            if seat.is_active and seat.is_available(now, now + timedelta(hours=1)):
-                available_seats += 1
+        available_seats, total_seats = counters.get(room.id, (0, 0))
         if available_seats > 0:
             rooms_with_seats.append({
                 'id': room.id,
                 'name': room.name,
                 'building': room.building,
                 'available_seats': available_seats,
-                'total_seats': room.seats.filter_by(is_active=True).count()
+                'total_seats': total_seats
             })
     
     return render_template('index.html', 
@@ -93,4 +95,54 @@ def get_room_seats(room_id):
         'seats': seats
     }
     
-    return jsonify(room_data) 
\ No newline at end of file
+    return jsonify(room_data) 
+
+@bp.route('/api/room/<int:room_id>/grid')
+def get_room_grid(room_id):
+    """获取自习室全天座位占用矩阵的API
+
+    每个座位返回一行十六进制编码的位图，第 i 个时间槽对应第 i//8 个
+    字节的第 i%8 位，置位表示已被预约。
+    """
+    room = StudyRoom.query.get_or_404(room_id)
+    
+    date_str = request.args.get('date')
+    try:
+        date = datetime.fromisoformat(date_str).date() if date_str else datetime.now().date()
+    except ValueError:
+        return jsonify({'error': '日期格式应为 YYYY-MM-DD'}), 400
+    
+    seats = room.seats.filter_by(is_active=True).order_by(Seat.id).all()
+    seat_ids = [seat.id for seat in seats]
+    
+    if occupancy_index.enabled:
+        rows = occupancy_index.day_rows(seat_ids, date)
+    else:
+        # 一次查询当天该自习室的有效预约，在内存中按位合并
+        day_start = datetime.combine(date, datetime.min.time())
+        intervals = db.session.query(Booking.seat_id, Booking.start_time, Booking.end_time).filter(
+            Booking.seat_id.in_(seat_ids),
+            Booking.end_time > day_start,
+            Booking.start_time < day_start + timedelta(days=1),
+            Booking.status.in_(['confirmed', 'checked_in'])
+        ).all() if seat_ids else []
+        rows = occupancy_index.day_rows(seat_ids, date, intervals)
+    
+    room_data = {
+        'id': room.id,
+        'name': room.name,
+        'date': date.isoformat(),
+        'is_24h': room.is_24h,
+        'open_time': room.open_time.strftime('%H:%M'),
+        'close_time': room.close_time.strftime('%H:%M'),
+        'slot_minutes': occupancy_index.slot_minutes,
+        'slots': occupancy_index.slots_per_day,
+        'seats': [{
+            'id': seat.id,
+            'seat_number': seat.seat_number,
+            'has_power_outlet': seat.has_power_outlet,
+            'booked': rows[seat.id].hex()
+        } for seat in seats]
+    }
+    
+    return jsonify(room_data)
@@ -1,7 +1,15 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_required, current_user
 from app import db
-from app.models import StudyRoom, Seat, Booking
+from app.models import StudyRoom, Seat, Booking, LotteryEntry
+from app.utils.availability import find_available_seats
+from app.utils.booking_service import create_booking
+from app.utils.admission import booking_admission
+from app.utils.idempotency import idempotency_store
+from app.utils.recurring import create_recurring_bookings, WEEKDAY_NAMES
+from app.utils.group_booking import create_group_booking, free_runs
+from app.utils.lottery import lottery_enabled, lottery_day, lottery_allocated, window_open, booking_blocked
+from app.utils.archive import all_bookings, booking_history
 from datetime import datetime, timedelta
 
 bp = Blueprint('student', __name__, url_prefix='/student')
@@ -19,12 +27,8 @@ def bookings():
         Booking.status.in_(['confirmed', 'checked_in'])
     ).order_by(Booking.start_time).all()
     
-    # 获取历史预约（最近30天内的）
-    history_bookings = Booking.query.filter(
-        Booking.user_id == current_user.id,
-        Booking.end_time < today,
-        Booking.start_time >= today - timedelta(days=30)
-    ).order_by(Booking.start_time.desc()).all()
+    # 获取历史预约（最近30天内的），包括已归档的预约
+    history_bookings = booking_history(current_user.id, today - timedelta(days=30), today)
     
     return render_template('student/bookings.html', 
                           active_bookings=active_bookings,
@@ -73,38 +77,14 @@ def search():
     rooms = query.all()
     
     # 过滤时间范围外的自习室
+    open_rooms = [room for room in rooms if room.is_open_during(start_time, end_time)]
+    
+    # 一次查询获取所有开放自习室的可用座位
+    seats_by_room = find_available_seats([room.id for room in open_rooms], start_time, end_time, has_power)
+    
     available_rooms = []
-    for room in rooms:
-        # 检查自习室是否在请求的时间范围内开放
-        room_open = True
-        current_time = start_time
-        while current_time < end_time:
-            current_date = current_time.date()
-            current_time_of_day = current_time.time()
-            
-            # 检查当前时间点自习室是否开放
-            if not room.is_24h and (current_time_of_day < room.open_time or current_time_of_day > room.close_time):
-                room_open = False
-                break
-                
-            current_time += timedelta(hours=1)
-        
-        if not room_open:
-            continue
-            
-        # 获取可用座位
-        available_seats = []
-        for seat in room.seats.filter_by(is_active=True).all():
-            if has_power and not seat.has_power_outlet:
-                continue
-                
-            if seat.is_available(start_time, end_time):
-                available_seats.append({
-                    'id': seat.id,
-                    'seat_number': seat.seat_number,
-                    'has_power_outlet': seat.has_power_outlet
-                })
-        
+    for room in open_rooms:
+        available_seats = seats_by_room[room.id]
         if available_seats:
             available_rooms.append({
                 'id': room.id,
@@ -131,6 +111,7 @@ def search():
 
 @bp.route('/book', methods=['POST'])
 @login_required
+@idempotency_store.idempotent
 def book():
     """预约座位"""
     seat_id = request.form.get('seat_id')
@@ -151,6 +132,10 @@ def book():
     start_time = datetime.combine(date, datetime.min.time().replace(hour=start_hour))
     end_time = start_time + timedelta(hours=duration)
     
+    if not seat.room.is_open_during(start_time, end_time):
+        flash('自习室在选择的时间段内未开放', 'danger')
+        return redirect(url_for('student.search'))
+    
     # 验证座位在这个时间段是否可用
     if not seat.is_available(start_time, end_time):
         flash('该座位在选择的时间段已被预约', 'danger')
@@ -162,36 +147,206 @@ def book():
         flash(f'单次预约时长不能超过{max_hours}小时', 'danger')
         return redirect(url_for('student.search'))
     
-    # 检查是否有与当前预约时间重叠的其他预约
-    overlapping_bookings = Booking.query.filter(
-        Booking.user_id == current_user.id,
-        Booking.end_time > start_time,
-        Booking.start_time < end_time,
-        Booking.status.in_(['confirmed', 'checked_in'])
-    ).count()
+    if booking_blocked(start_time):
+        flash('该日期的座位通过抽签分配，请在抽签页面提交志愿', 'warning')
+        return redirect(url_for('student.lottery_entry'))
+    
+    # 幂等键随预约一起写入，不单独提交
+    idempotency_store.expect(url_for('student.bookings'), [('success', '座位预约成功！')])
+    if booking_admission.enabled:
+        # 放号高峰时排队，由写入线程批量提交；短时间内未处理完则跳转到排队页面轮询
+        ticket = booking_admission.submit(current_user.id, seat.id, start_time, end_time,
+                                          idempotency=idempotency_store.take_expected())
+        if ticket is None:
+            flash('当前预约人数较多，请稍后重试', 'warning')
+            return redirect(url_for('student.search'))
+        if not ticket.wait(current_app.config.get('ADMISSION_WAIT_SECONDS', 2)):
+            return redirect(url_for('student.booking_ticket', ticket_id=ticket.id))
+        return _booking_result(ticket.error)
     
-    if overlapping_bookings > 0:
-        flash('您在选择的时间段内已有其他预约', 'danger')
+    # 原子地创建预约，座位和用户时间冲突由数据库唯一约束保证
+    booking, error = create_booking(current_user.id, seat.id, start_time, end_time)
+    return _booking_result(error)
+
+def _booking_result(error):
+    if error:
+        flash(error, 'danger')
         return redirect(url_for('student.search'))
+    flash('座位预约成功！', 'success')
+    return redirect(url_for('student.bookings'))
+
+def _own_ticket(ticket_id):
+    ticket = booking_admission.get_ticket(ticket_id)
+    if ticket is None or ticket.user_id != current_user.id:
+        return None
+    return ticket
+
+@bp.route('/tickets/<ticket_id>')
+@login_required
+def booking_ticket(ticket_id):
+    """排队中的预约，处理完成后显示结果"""
+    ticket = _own_ticket(ticket_id)
+    if ticket is None:
+        if booking_admission.may_be_pending(ticket_id):
+            # 票据在其他进程的队列中尚未处理完
+            return render_template('student/ticket.html', ticket_id=ticket_id, ticket=None)
+        flash('排队记录已过期，请在"我的预约"中查看预约结果', 'warning')
+        return redirect(url_for('student.bookings'))
+    if ticket.status == 'pending':
+        return render_template('student/ticket.html', ticket_id=ticket_id, ticket=ticket)
+    return _booking_result(ticket.error)
+
+@bp.route('/api/tickets/<ticket_id>')
+@login_required
+def ticket_status(ticket_id):
+    """排队页面轮询的预约处理状态API"""
+    ticket = _own_ticket(ticket_id)
+    if ticket is None:
+        if booking_admission.may_be_pending(ticket_id):
+            return jsonify({'ticket': ticket_id, 'status': 'pending', 'booking_id': None, 'error': None})
+        return jsonify({'error': '排队记录不存在或已过期'}), 404
+    return jsonify(ticket.to_dict())
+
+@bp.route('/recurring', methods=['GET', 'POST'])
+@login_required
+@idempotency_store.idempotent
+def recurring_booking():
+    """周期预约：在日期范围内每周固定几天预约同一座位的同一时段"""
+    seat = Seat.query.get_or_404(request.values.get('seat_id', type=int))
     
-    # 创建预约
-    booking = Booking(
-        user_id=current_user.id,
-        seat_id=seat_id,
-        start_time=start_time,
-        end_time=end_time
-    )
+    if request.method == 'POST':
+        try:
+            start_date = datetime.fromisoformat(request.form['start_date']).date()
+            end_date = datetime.fromisoformat(request.form['end_date']).date()
+            start_hour = int(request.form['start_hour'])
+            duration = int(request.form['duration'])
+        except (KeyError, ValueError):
+            flash('请提供有效的预约信息', 'danger')
+            return redirect(url_for('student.recurring_booking', seat_id=seat.id))
+        weekdays = [int(day) for day in request.form.getlist('weekdays') if day.isdigit()]
+        
+        bookings, failures = create_recurring_bookings(
+            current_user.id, seat.id, start_date, end_date, weekdays, start_hour, duration,
+            all_or_nothing=request.form.get('mode') != 'partial'
+        )
+        for day, error in failures:
+            flash(f'{day.isoformat()}: {error}' if day else error, 'danger')
+        if bookings:
+            flash(f'周期预约成功，共 {len(bookings)} 次', 'success')
+            return redirect(url_for('student.bookings'))
+        if failures and failures[0][0] is not None:
+            flash('未创建任何预约', 'warning')
+        return redirect(url_for('student.recurring_booking', seat_id=seat.id))
     
-    db.session.add(booking)
-    db.session.commit()
+    today = datetime.now().date()
+    return render_template('student/recurring.html',
+                          seat=seat,
+                          weekday_names=WEEKDAY_NAMES,
+                          today=today.isoformat(),
+                          default_end=(today + timedelta(days=28)).isoformat(),
+                          max_hours=current_app.config.get('MAX_BOOKING_HOURS', 4))
+
+@bp.route('/api/bookings/recurring', methods=['POST'])
+@login_required
+def recurring_booking_api():
+    """周期预约API
+
+    请求体为 JSON：seat_id、start_date、end_date、weekdays（0 为周一）、
+    start_hour、duration，可选 all_or_nothing（默认 true）。
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        seat_id = int(data['seat_id'])
+        start_date = datetime.fromisoformat(data['start_date']).date()
+        end_date = datetime.fromisoformat(data['end_date']).date()
+        weekdays = [int(day) for day in data['weekdays']]
+        start_hour = int(data['start_hour'])
+        duration = int(data['duration'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': '请提供有效的预约信息'}), 400
+    
+    bookings, failures = create_recurring_bookings(
+        current_user.id, seat_id, start_date, end_date, weekdays, start_hour, duration,
+        all_or_nothing=data.get('all_or_nothing', True)
+    )
+    if failures and failures[0][0] is None:
+        return jsonify({'error': failures[0][1]}), 400
+    return jsonify({
+        'created': [{'id': booking.id, 'start_time': booking.start_time.isoformat(),
+                     'end_time': booking.end_time.isoformat()} for booking in bookings],
+        'failed': [{'date': day.isoformat(), 'error': error} for day, error in failures]
+    }), 201 if bookings else 409
+
+@bp.route('/group', methods=['GET', 'POST'])
+@login_required
+@idempotency_store.idempotent
+def group_booking():
+    """小组预约：为发起人和同组同学预约同一自习室的一组相邻座位"""
+    if request.method == 'POST':
+        try:
+            date = datetime.fromisoformat(request.form['date']).date()
+            start_time = datetime.combine(date, datetime.min.time().replace(hour=int(request.form['start_hour'])))
+            end_time = start_time + timedelta(hours=int(request.form['duration']))
+        except (KeyError, ValueError):
+            flash('请提供有效的预约信息', 'danger')
+            return redirect(url_for('student.group_booking'))
+        student_ids = request.form.get('student_ids', '').replace('，', ',').replace(',', ' ').split()
+        
+        bookings, error = create_group_booking(
+            current_user.id, student_ids, start_time, end_time,
+            room_id=request.form.get('room_id', type=int),
+            prefer_power=request.form.get('prefer_power') == 'on'
+        )
+        if error:
+            flash(error, 'danger')
+            return redirect(url_for('student.group_booking'))
+        seats = ', '.join(booking.seat.seat_number for booking in bookings)
+        flash(f'小组预约成功：{bookings[0].seat.room.name} 座位 {seats}', 'success')
+        return redirect(url_for('student.bookings'))
     
-    # 触发预约提醒任务（在实际应用中会通过调度器执行）
+    rooms = StudyRoom.query.filter_by(is_active=True).order_by(StudyRoom.building, StudyRoom.name).all()
+    return render_template('student/group.html',
+                          rooms=rooms,
+                          today=datetime.now().date().isoformat(),
+                          max_size=current_app.config.get('GROUP_BOOKING_MAX_SIZE', 8),
+                          max_hours=current_app.config.get('MAX_BOOKING_HOURS', 4))
+
+@bp.route('/api/bookings/group', methods=['POST'])
+@login_required
+def group_booking_api():
+    """小组预约API
+
+    请求体为 JSON：student_ids（同组同学学号，不含发起人）、date、start_hour、
+    duration，可选 room_id 和 prefer_power。
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data.get('student_ids'), list):
+        return jsonify({'error': 'student_ids 应为学号列表'}), 400
+    try:
+        student_ids = [str(student_id) for student_id in data['student_ids']]
+        date = datetime.fromisoformat(data['date']).date()
+        start_time = datetime.combine(date, datetime.min.time().replace(hour=int(data['start_hour'])))
+        end_time = start_time + timedelta(hours=int(data['duration']))
+        room_id = int(data['room_id']) if data.get('room_id') is not None else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': '请提供有效的预约信息'}), 400
     
-    flash('座位预约成功！', 'success')
-    return redirect(url_for('student.bookings'))
+    bookings, error = create_group_booking(current_user.id, student_ids, start_time, end_time,
+                                           room_id=room_id, prefer_power=bool(data.get('prefer_power')))
+    if error:
+        return jsonify({'error': error}), 409
+    seats = [{'id': booking.seat_id, 'seat_number': booking.seat.seat_number,
+              'has_power_outlet': booking.seat.has_power_outlet} for booking in bookings]
+    return jsonify({
+        'room_id': bookings[0].seat.room_id,
+        'contiguous': len(free_runs(seats)) == 1,
+        'bookings': [{'id': booking.id, 'student_id': booking.user.student_id, 'seat_id': booking.seat_id,
+                      'seat_number': booking.seat.seat_number} for booking in bookings]
+    }), 201
 
 @bp.route('/cancel/<int:booking_id>', methods=['POST'])
 @login_required
+@idempotency_store.idempotent
 def cancel_booking(booking_id):
     """取消预约"""
     booking = Booking.query.get_or_404(booking_id)
@@ -206,6 +361,7 @@ def cancel_booking(booking_id):
         flash('此预约无法被取消', 'danger')
         return redirect(url_for('student.bookings'))
     
+    idempotency_store.expect(url_for('student.bookings'), [('success', '预约已取消')])
     booking.cancel()
     flash('预约已取消', 'success')
     return redirect(url_for('student.bookings'))
@@ -263,14 +419,15 @@ def favorites():
     # 获取用户最近一个月内使用过的座位
     one_month_ago = datetime.now() - timedelta(days=30)
     
-    # 查找用户的历史预约并按座位分组计数
+    # 查找用户的历史预约（包括已归档的）并按座位分组计数
+    bookings = all_bookings()
     seat_usage = db.session.query(
-        Booking.seat_id,
-        db.func.count(Booking.id).label('usage_count')
+        bookings.c.seat_id,
+        db.func.count(bookings.c.id).label('usage_count')
     ).filter(
-        Booking.user_id == current_user.id,
-        Booking.booking_time >= one_month_ago
-    ).group_by(Booking.seat_id).order_by(db.desc('usage_count')).limit(10).all()
+        bookings.c.user_id == current_user.id,
+        bookings.c.booking_time >= one_month_ago
+    ).group_by(bookings.c.seat_id).order_by(db.desc('usage_count')).limit(10).all()
     
     # 获取座位详细信息
     favorite_seats = []
@@ -286,4 +443,82 @@ def favorites():
                 'usage_count': count
             })
     
-    return render_template('student/favorites.html', favorite_seats=favorite_seats) 
\ No newline at end of file
+    return render_template('student/favorites.html', favorite_seats=favorite_seats)
+
+@bp.route('/lottery', methods=['GET', 'POST'])
+@login_required
+def lottery_entry():
+    """抽签放号：在提交窗口内填写志愿，窗口关闭后统一分配"""
+    if not lottery_enabled():
+        flash('当前未启用抽签放号', 'info')
+        return redirect(url_for('student.search'))
+    
+    day = lottery_day()
+    entry = LotteryEntry.query.filter_by(user_id=current_user.id, day=day).first()
+    rooms = StudyRoom.query.filter_by(is_active=True).order_by(StudyRoom.building, StudyRoom.name).all()
+    max_preferences = current_app.config.get('LOTTERY_MAX_PREFERENCES', 5)
+    
+    if request.method == 'POST':
+        if not window_open():
+            flash('当前不在志愿提交时间内', 'danger')
+            return redirect(url_for('student.lottery_entry'))
+        if lottery_allocated(day):
+            flash('本期抽签已完成分配', 'danger')
+            return redirect(url_for('student.lottery_entry'))
+        
+        start_hour = request.form.get('start_hour', type=int)
+        duration = request.form.get('duration', type=int)
+        max_hours = current_app.config.get('MAX_BOOKING_HOURS', 4)
+        error = None
+        if start_hour is None or duration is None or not 0 <= start_hour <= 23 or duration < 1 or start_hour + duration > 24:
+            error = '请提供有效的时间段'
+        elif duration > max_hours:
+            error = f'单次预约时长不能超过{max_hours}小时'
+        
+        preferences = []
+        room_ids = {room.id for room in rooms}
+        for i in range(max_preferences):
+            room_id = request.form.get(f'room_{i}', type=int)
+            seat_number = request.form.get(f'seat_{i}', '').strip()
+            if not room_id:
+                continue
+            if room_id not in room_ids:
+                error = '志愿中包含无效的自习室'
+                break
+            seat_id = None
+            if seat_number:
+                seat = Seat.query.filter_by(room_id=room_id, seat_number=seat_number, is_active=True).first()
+                if seat is None:
+                    error = f'座位 {seat_number} 不存在'
+                    break
+                seat_id = seat.id
+            preferences.append({'room_id': room_id, 'seat_id': seat_id})
+        if error is None and not preferences:
+            error = '请至少填写一个志愿'
+        
+        if error is None:
+            start_time = datetime.combine(day, datetime.min.time().replace(hour=start_hour))
+            if entry is None:
+                entry = LotteryEntry(user_id=current_user.id, day=day)
+                db.session.add(entry)
+            entry.start_time = start_time
+            entry.end_time = start_time + timedelta(hours=duration)
+            entry.preferences = preferences
+            db.session.commit()
+            flash('志愿已提交，抽签结果将在提交截止后公布', 'success')
+            return redirect(url_for('student.lottery_entry'))
+        
+        flash(error, 'danger')
+    
+    seat_ids = [preference['seat_id'] for preference in entry.preferences if preference.get('seat_id')] if entry else []
+    seat_numbers = dict(db.session.query(Seat.id, Seat.seat_number).filter(Seat.id.in_(seat_ids))) if seat_ids else {}
+    
+    return render_template('student/lottery.html',
+                          entry=entry,
+                          seat_numbers=seat_numbers,
+                          day=day,
+                          rooms=rooms,
+                          max_preferences=max_preferences,
+                          window_open=window_open(),
+                          open_hour=current_app.config.get('LOTTERY_OPEN_HOUR', 7),
+                          close_hour=current_app.config.get('LOTTERY_CLOSE_HOUR', 8))
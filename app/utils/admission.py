@@ -0,0 +1,279 @@
+import queue
+import threading
+import uuid
+from datetime import datetime, timedelta
+from app.utils.cache import TTLCache
+
+# 票据ID的前8位是十六进制的创建时间戳，任何进程都能据此判断票据是否可能仍在排队
+TICKET_ID_LENGTH = 40
+
+class BookingTicket:
+    """排队中的预约请求，写入线程处理后 status 变为 confirmed 或 rejected"""
+
+    def __init__(self, user_id, seat_id, start_time, end_time):
+        self.created_at = datetime.now()
+        self.id = f'{int(self.created_at.timestamp()):08x}{uuid.uuid4().hex}'
+        self.user_id = user_id
+        self.seat_id = seat_id
+        self.start_time = start_time
+        self.end_time = end_time
+        self.status = 'pending'
+        self.booking_id = None
+        self.error = None
+        self.idempotency = None
+        self._done = threading.Event()
+
+    def resolve(self, booking_id=None, error=None):
+        """记录处理结果；等待者在整批结果写入数据库后才被唤醒"""
+        self.booking_id = booking_id
+        self.error = error
+        self.status = 'rejected' if error else 'confirmed'
+
+    def finish(self):
+        """结果已保存，唤醒等待者"""
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """等待处理结果，超时返回 False"""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {'ticket': self.id, 'status': self.status, 'booking_id': self.booking_id, 'error': self.error}
+
+    def to_row(self):
+        return {'id': self.id, 'user_id': self.user_id, 'seat_id': self.seat_id, 'start_time': self.start_time,
+                'end_time': self.end_time, 'status': self.status, 'booking_id': self.booking_id,
+                'error': self.error, 'created_at': self.created_at}
+
+class BookingAdmission:
+    """放号高峰时的预约准入队列
+
+    预约请求放入有界队列后立即得到一张票据，单个写入线程按到达顺序每次取出
+    最多 ADMISSION_BATCH_SIZE 个请求，用一次查询加载相关的时间槽，在内存中
+    判断座位和用户冲突（包括同一批内的冲突），再在一个事务中插入整批预约。
+    队列已满时 submit() 返回 None，由调用方提示稍后重试。
+
+    多进程部署时各进程有自己的写入线程，跨进程的冲突仍由 booking_slots 的
+    唯一约束保证。票据缓存在本进程内，每批的处理结果同时写入 admission_tickets
+    表，排队页面的轮询落到其他进程时从表中读取；尚未处理完的票据在其他进程
+    看来仍在排队。票据和结果保留 ADMISSION_TICKET_SECONDS 秒。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._app = None
+        self._queue = queue.Queue(maxsize=5000)
+        self._tickets = TTLCache(ttl=600, maxsize=100000)
+        self.enabled = True
+        self.batch_size = 200
+        self.ticket_seconds = 600
+        self.submitted = 0
+        self.busy = 0
+        self.confirmed = 0
+        self.rejected = 0
+        self.batches = 0
+
+    def init_app(self, app):
+        self._app = app
+        self.enabled = app.config.get('BOOKING_ADMISSION_ENABLED', True)
+        self.batch_size = app.config.get('ADMISSION_BATCH_SIZE', 200)
+        self.ticket_seconds = app.config.get('ADMISSION_TICKET_SECONDS', 600)
+        self._tickets.ttl = self.ticket_seconds
+        with self._lock:
+            if self._thread is None:
+                self._queue = queue.Queue(maxsize=app.config.get('ADMISSION_QUEUE_SIZE', 5000))
+
+    def submit(self, user_id, seat_id, start_time, end_time, idempotency=None):
+        """将预约请求加入队列，返回票据；队列已满时返回 None
+
+        idempotency 为 IdempotencyStore.take_expected() 返回的幂等键记录，
+        预约成功时随整批票据结果一起写入。
+        """
+        ticket = BookingTicket(user_id, seat_id, start_time, end_time)
+        ticket.idempotency = idempotency
+        self._tickets.set(ticket.id, ticket)
+        try:
+            self._queue.put_nowait(ticket)
+        except queue.Full:
+            self._tickets.delete(ticket.id)
+            with self._lock:
+                self.busy += 1
+            return None
+        with self._lock:
+            self.submitted += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='booking-admission', daemon=True)
+                self._thread.start()
+        return ticket
+
+    def get_ticket(self, ticket_id):
+        """本进程的票据，或其他进程已处理完并写入数据库的票据结果"""
+        from app import db
+        from app.models import AdmissionTicket
+
+        ticket = self._tickets.get(ticket_id)
+        if ticket is None and len(ticket_id) == TICKET_ID_LENGTH:
+            ticket = db.session.get(AdmissionTicket, ticket_id)
+        return ticket
+
+    def may_be_pending(self, ticket_id, now=None):
+        """未找到的票据是否可能仍在其他进程的队列中（创建不超过 ADMISSION_TICKET_SECONDS 秒）"""
+        if now is None:
+            now = datetime.now()
+        if len(ticket_id) != TICKET_ID_LENGTH:
+            return False
+        try:
+            created_at = datetime.fromtimestamp(int(ticket_id[:8], 16))
+        except ValueError:
+            return False
+        return now - timedelta(seconds=self.ticket_seconds) <= created_at <= now + timedelta(minutes=1)
+
+    def purge(self, now=None):
+        """删除过期的票据结果，返回删除的条数"""
+        from app import db
+        from app.models import AdmissionTicket
+
+        if now is None:
+            now = datetime.now()
+        deleted = AdmissionTicket.query.filter(
+            AdmissionTicket.created_at < now - timedelta(seconds=self.ticket_seconds)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        from app import db
+
+        with self._app.app_context():
+            try:
+                self._admit(batch)
+            except Exception as e:
+                db.session.rollback()
+                print(f'预约准入批处理失败: {e}')
+                for ticket in batch:
+                    if ticket.status == 'pending':
+                        ticket.resolve(error='系统繁忙，请稍后重试')
+            try:
+                self._record(batch)
+            except Exception as e:
+                db.session.rollback()
+                print(f'保存预约票据结果失败: {e}')
+            finally:
+                db.session.remove()
+        for ticket in batch:
+            ticket.finish()
+        with self._lock:
+            self.batches += 1
+            for ticket in batch:
+                if ticket.status == 'confirmed':
+                    self.confirmed += 1
+                else:
+                    self.rejected += 1
+
+    def _record(self, batch):
+        """在一个事务中写入整批票据的处理结果和预约成功的请求的幂等键"""
+        from app import db
+        from app.models import AdmissionTicket, IdempotencyKey
+        from sqlalchemy import insert
+        from sqlalchemy.exc import IntegrityError
+
+        db.session.execute(insert(AdmissionTicket), [ticket.to_row() for ticket in batch])
+        keys = [ticket.idempotency for ticket in batch if ticket.idempotency and ticket.status == 'confirmed']
+        if keys:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(IdempotencyKey), keys)
+            except IntegrityError:
+                # 同一个键已由并发的重复请求写入，逐个写入其余的键
+                for row in keys:
+                    try:
+                        with db.session.begin_nested():
+                            db.session.execute(insert(IdempotencyKey), [row])
+                    except IntegrityError:
+                        pass
+        db.session.commit()
+
+    def _admit(self, batch):
+        """判断一批请求的冲突并在一个事务中插入通过的预约"""
+        from app import db
+        from app.models import Booking, BookingSlot
+        from app.utils.booking_service import slot_starts, slot_rows, create_booking, bookings_created
+        from sqlalchemy import insert, or_
+        from sqlalchemy.exc import IntegrityError, OperationalError
+
+        slots = {ticket.id: slot_starts(ticket.start_time, ticket.end_time) for ticket in batch}
+        seat_slots = set()
+        user_slots = set()
+        for seat_id, user_id, slot_start in db.session.query(
+            BookingSlot.seat_id, BookingSlot.user_id, BookingSlot.slot_start
+        ).filter(
+            BookingSlot.slot_start.in_(sorted({slot for starts in slots.values() for slot in starts})),
+            or_(BookingSlot.seat_id.in_(list({ticket.seat_id for ticket in batch})),
+                BookingSlot.user_id.in_(list({ticket.user_id for ticket in batch})))
+        ):
+            seat_slots.add((seat_id, slot_start))
+            user_slots.add((user_id, slot_start))
+
+        accepted = []
+        for ticket in batch:
+            starts = slots[ticket.id]
+            if any((ticket.seat_id, slot) in seat_slots for slot in starts):
+                ticket.resolve(error='该座位在选择的时间段已被预约')
+            elif any((ticket.user_id, slot) in user_slots for slot in starts):
+                ticket.resolve(error='您在选择的时间段内已有其他预约')
+            else:
+                seat_slots.update((ticket.seat_id, slot) for slot in starts)
+                user_slots.update((ticket.user_id, slot) for slot in starts)
+                accepted.append(ticket)
+        if not accepted:
+            return
+
+        bookings = [Booking(user_id=ticket.user_id, seat_id=ticket.seat_id,
+                            start_time=ticket.start_time, end_time=ticket.end_time) for ticket in accepted]
+        try:
+            db.session.add_all(bookings)
+            db.session.flush()
+            db.session.execute(insert(BookingSlot), [row for booking in bookings for row in slot_rows(booking)])
+            db.session.commit()
+        except IntegrityError:
+            # 其他进程抢先占用了某些时间槽，逐个创建以确定是哪些请求冲突
+            db.session.rollback()
+            for ticket in accepted:
+                booking, error = create_booking(ticket.user_id, ticket.seat_id, ticket.start_time, ticket.end_time)
+                ticket.resolve(booking.id if booking else None, error)
+            return
+        except OperationalError:
+            db.session.rollback()
+            for ticket in accepted:
+                ticket.resolve(error='系统繁忙，请稍后重试')
+            return
+
+        bookings_created(bookings)
+        for ticket, booking in zip(accepted, bookings):
+            ticket.resolve(booking.id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'submitted': self.submitted,
+                'busy': self.busy,
+                'confirmed': self.confirmed,
+                'rejected': self.rejected,
+                'batches': self.batches,
+                'average_batch': (self.confirmed + self.rejected) / self.batches if self.batches else 0
+            }
+
+
+booking_admission = BookingAdmission()
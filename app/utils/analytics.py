@@ -0,0 +1,84 @@
+import numpy as np
+from itertools import chain
+from app import db
+from app.models import Seat, StudyRoom
+from app.utils.archive import all_bookings
+from sqlalchemy import select, func, cast, Integer
+from datetime import datetime, timedelta
+
+WEEKDAYS = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+
+def occupancy_heatmap(start_date, end_date):
+    """计算 [start_date, end_date] 内各自习室按星期和小时的占用率与爽约率
+
+    预约区间一次性载入为数组：占用率用差分数组在小时轴上累加区间再求前缀和，
+    爽约率按预约开始的星期和小时用 np.add.at 计数，不逐行循环。
+    返回 {'rooms', 'occupancy', 'no_show', 'bookings'}，后三者形状为 [自习室][星期][小时]。
+    """
+    days = (end_date - start_date).days + 1
+    hours = days * 24
+    range_start = datetime.combine(start_date, datetime.min.time())
+    range_end = range_start + timedelta(days=days)
+
+    rooms = StudyRoom.query.order_by(StudyRoom.id).all()
+    room_ids = np.array([room.id for room in rooms], dtype=np.int64)
+    seat_counts = dict(db.session.query(Seat.room_id, func.count(Seat.id)).filter(
+        Seat.is_active == True
+    ).group_by(Seat.room_id).all())
+    seats = np.array([seat_counts.get(room.id, 0) for room in rooms], dtype=np.float64)
+
+    # 由 SQLite 直接计算相对区间起点的分钟数，避免逐行解析 datetime；包括已归档的预约
+    bookings = all_bookings()
+    base = func.julianday(range_start.isoformat(' '))
+    rows = db.session.connection().execute(select(
+        Seat.room_id,
+        cast(func.round((func.julianday(bookings.c.start_time) - base) * 1440), Integer),
+        cast(func.round((func.julianday(bookings.c.end_time) - base) * 1440), Integer),
+        cast(bookings.c.status == 'expired', Integer)
+    ).join(Seat, Seat.id == bookings.c.seat_id).where(
+        bookings.c.start_time < range_end,
+        bookings.c.end_time > range_start,
+        bookings.c.status != 'cancelled'
+    )).all()
+    columns = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=len(rows) * 4).reshape(-1, 4)
+    room_index = np.searchsorted(room_ids, columns[:, 0])
+    start = columns[:, 1]
+    end = columns[:, 2]
+    expired = columns[:, 3].astype(bool)
+
+    # 每小时被占用的座位数：区间起点 +1、终点 -1，再沿时间轴求前缀和
+    # 过期预约在开始15分钟后即释放座位，不计入占用
+    first_hour = np.clip(start // 60, 0, hours)
+    last_hour = np.clip(-(-end // 60), 0, hours)
+    diff = np.zeros((len(rooms), hours + 1))
+    np.add.at(diff, (room_index[~expired], first_hour[~expired]), 1)
+    np.add.at(diff, (room_index[~expired], last_hour[~expired]), -1)
+    occupied = np.cumsum(diff, axis=1)[:, :hours].reshape(len(rooms), days, 24)
+
+    # 按星期折叠，除以座位数和该星期在区间内出现的天数
+    weekday_of_day = (start_date.weekday() + np.arange(days)) % 7
+    occupied_by_weekday = np.zeros((len(rooms), 7, 24))
+    for weekday in range(7):
+        occupied_by_weekday[:, weekday] = occupied[:, weekday_of_day == weekday].sum(axis=1)
+    capacity = np.broadcast_to(
+        seats[:, None, None] * np.bincount(weekday_of_day, minlength=7)[None, :, None], occupied_by_weekday.shape
+    )
+    occupancy = np.divide(occupied_by_weekday, capacity, out=np.zeros_like(occupied_by_weekday), where=capacity > 0)
+
+    # 爽约率：区间内开始的预约中过期的比例，按开始时间的星期和小时统计
+    starts_in_range = (start >= 0) & (start < hours * 60)
+    weekday = (start_date.weekday() + start // 1440) % 7
+    hour = (start // 60) % 24
+    bookings = np.zeros((len(rooms), 7, 24))
+    no_shows = np.zeros((len(rooms), 7, 24))
+    np.add.at(bookings, (room_index[starts_in_range], weekday[starts_in_range], hour[starts_in_range]), 1)
+    no_show_starts = starts_in_range & expired
+    np.add.at(no_shows, (room_index[no_show_starts], weekday[no_show_starts], hour[no_show_starts]), 1)
+    no_show = np.divide(no_shows, bookings, out=np.zeros_like(bookings), where=bookings > 0)
+
+    return {
+        'rooms': [{'id': room.id, 'name': room.name, 'seats': int(count)} for room, count in zip(rooms, seats)],
+        'occupancy': occupancy.round(3).tolist(),
+        'no_show': no_show.round(3).tolist(),
+        'bookings': bookings.astype(int).tolist()
+    }
@@ -0,0 +1,75 @@
+from app import db
+from app.models import Booking, BookingSlot, BookingNotification, ArchivedBooking, LotteryEntry
+from flask import current_app
+from sqlalchemy import select, insert, update, delete, union_all, literal
+from datetime import datetime, timedelta
+
+# 可以归档的终态
+FINAL_STATUSES = ['completed', 'cancelled', 'expired']
+
+# 热表和归档表共有的列
+COLUMNS = ['id', 'user_id', 'seat_id', 'start_time', 'end_time', 'status', 'booking_time', 'checkin_time', 'updated_at']
+
+def archive_bookings(now=None, batch_size=None, after_days=None):
+    """将结束超过 after_days（默认 ARCHIVE_AFTER_DAYS）天的已结束预约分批移入归档表，返回归档的预约数
+
+    每批在一个事务中复制到 bookings_archive，并删除预约本身及其时间槽和通知记录，
+    中途失败时已提交的批次保持归档，未提交的批次仍留在热表中，可以重新执行。
+    """
+    if now is None:
+        now = datetime.now()
+    if batch_size is None:
+        batch_size = current_app.config.get('ARCHIVE_BATCH_SIZE', 1000)
+    if after_days is None:
+        after_days = current_app.config.get('ARCHIVE_AFTER_DAYS', 90)
+    cutoff = now - timedelta(days=after_days)
+
+    hot = Booking.__table__
+    archived = 0
+    while True:
+        ids = db.session.scalars(
+            select(hot.c.id).where(
+                hot.c.status.in_(FINAL_STATUSES),
+                hot.c.end_time < cutoff
+            ).order_by(hot.c.id).limit(batch_size)
+        ).all()
+        if not ids:
+            return archived
+
+        db.session.execute(insert(ArchivedBooking.__table__).from_select(
+            COLUMNS + ['archived_at'],
+            select(*[hot.c[name] for name in COLUMNS], literal(now)).where(hot.c.id.in_(ids))
+        ))
+        db.session.execute(delete(BookingSlot.__table__).where(BookingSlot.__table__.c.booking_id.in_(ids)))
+        db.session.execute(delete(BookingNotification.__table__).where(BookingNotification.__table__.c.booking_id.in_(ids)))
+        db.session.execute(update(LotteryEntry.__table__).where(LotteryEntry.__table__.c.booking_id.in_(ids)).values(booking_id=None))
+        db.session.execute(delete(hot).where(hot.c.id.in_(ids)))
+        db.session.commit()
+        archived += len(ids)
+
+def all_bookings():
+    """热表与归档表合并后的只读子查询，供历史记录和统计使用
+
+    返回的子查询具有与 bookings 表相同的列（通过 .c 访问），外层的筛选条件
+    会被 SQLite 下推到两个分支中，分别使用各自的索引。
+    """
+    archive = ArchivedBooking.__table__
+    hot = Booking.__table__
+    return union_all(
+        select(*[hot.c[name] for name in COLUMNS]),
+        select(*[archive.c[name] for name in COLUMNS])
+    ).subquery('all_bookings')
+
+def booking_history(user_id, since, until):
+    """用户在 [since, until) 内结束的预约，包括已归档的，按开始时间倒序"""
+    bookings = Booking.query.filter(
+        Booking.user_id == user_id,
+        Booking.end_time < until,
+        Booking.start_time >= since
+    ).all()
+    archived = ArchivedBooking.query.filter(
+        ArchivedBooking.user_id == user_id,
+        ArchivedBooking.end_time < until,
+        ArchivedBooking.start_time >= since
+    ).all()
+    return sorted(bookings + archived, key=lambda booking: booking.start_time, reverse=True)
@@ -0,0 +1,46 @@
+from app import db
+from app.models import Seat, Booking
+from app.utils.occupancy import occupancy_index
+
+def find_available_seats(room_ids, start_time, end_time, has_power=False):
+    """查询指定自习室在 [start_time, end_time) 内的空闲座位
+
+    返回 {room_id: [座位信息, ...]}，座位按ID排序，与逐座位调用
+    Seat.is_available 的结果一致。启用占用索引时只查询一次座位表，
+    空闲判断由位图完成；否则使用一次反连接查询。
+    """
+    result = {room_id: [] for room_id in room_ids}
+    if not room_ids:
+        return result
+
+    query = db.session.query(
+        Seat.id, Seat.room_id, Seat.seat_number, Seat.has_power_outlet
+    ).filter(
+        Seat.room_id.in_(room_ids),
+        Seat.is_active == True
+    )
+    if has_power:
+        query = query.filter(Seat.has_power_outlet == True)
+
+    if occupancy_index.enabled:
+        seats = query.order_by(Seat.id).all()
+        free_ids = set(occupancy_index.free_seat_ids([seat[0] for seat in seats], start_time, end_time))
+        seats = [seat for seat in seats if seat[0] in free_ids]
+    else:
+        # 与请求时间段重叠的有效预约
+        overlapping = db.session.query(Booking.id).filter(
+            Booking.seat_id == Seat.id,
+            Booking.end_time > start_time,
+            Booking.start_time < end_time,
+            Booking.status.in_(['confirmed', 'checked_in'])
+        ).exists()
+        seats = query.filter(~overlapping).order_by(Seat.id).all()
+
+    for seat_id, room_id, seat_number, has_power_outlet in seats:
+        result[room_id].append({
+            'id': seat_id,
+            'seat_number': seat_number,
+            'has_power_outlet': has_power_outlet
+        })
+
+    return result
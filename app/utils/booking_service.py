@@ -0,0 +1,100 @@
+from app import db
+from app.models import Booking, BookingSlot
+from app.utils.occupancy import occupancy_index
+from app.utils.deadlines import deadline_scheduler
+from app.utils.dashboard import dashboard_counters
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+from datetime import datetime, timedelta
+
+def slot_starts(start_time, end_time):
+    """返回时间段覆盖的各时间槽起点，向外取整到 BOOKING_SLOT_MINUTES"""
+    minutes = current_app.config.get('BOOKING_SLOT_MINUTES', 60)
+    slot = timedelta(minutes=minutes)
+    day_start = datetime.combine(start_time.date(), datetime.min.time())
+    current = day_start + (start_time - day_start) // slot * slot
+    starts = []
+    while current < end_time:
+        starts.append(current)
+        current += slot
+    return starts
+
+def slot_rows(booking):
+    """生成预约的时间槽记录，用于批量插入 booking_slots"""
+    return [{
+        'booking_id': booking.id,
+        'seat_id': booking.seat_id,
+        'user_id': booking.user_id,
+        'slot_start': slot_start
+    } for slot_start in slot_starts(booking.start_time, booking.end_time)]
+
+def conflict_message(user_id, seat_id, start_time, end_time):
+    """判断冲突来自座位还是用户，返回提示信息"""
+    seat_taken = BookingSlot.query.filter(
+        BookingSlot.seat_id == seat_id,
+        BookingSlot.user_id != user_id,
+        BookingSlot.slot_start.in_(slot_starts(start_time, end_time))
+    ).first()
+    if seat_taken:
+        return '该座位在选择的时间段已被预约'
+    return '您在选择的时间段内已有其他预约'
+
+def create_booking(user_id, seat_id, start_time, end_time):
+    """原子地创建预约，返回 (booking, error)
+
+    预约与其时间槽在同一事务中插入，座位或用户的时间槽已被占用时
+    唯一约束使整个事务回滚，因此并发请求中只有一个能成功。
+    """
+    booking = Booking(
+        user_id=user_id,
+        seat_id=seat_id,
+        start_time=start_time,
+        end_time=end_time
+    )
+
+    try:
+        db.session.add(booking)
+        db.session.flush()
+        db.session.execute(insert(BookingSlot), slot_rows(booking))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return None, conflict_message(user_id, seat_id, start_time, end_time)
+    except OperationalError:
+        # SQLite 写锁等待超时
+        db.session.rollback()
+        return None, '系统繁忙，请稍后重试'
+
+    bookings_created([booking])
+    return booking, None
+
+def bookings_created(bookings):
+    """预约提交后更新占用索引、截止事件和控制面板计数"""
+    for booking in bookings:
+        occupancy_index.add(booking.seat_id, booking.start_time, booking.end_time)
+        deadline_scheduler.schedule_booking(booking)
+    dashboard_counters.invalidate()
+
+def backfill_slots():
+    """为尚无时间槽记录的有效预约补建时间槽
+
+    返回 (补建的预约数, 与已有预约冲突而跳过的预约ID列表)。
+    """
+    claimed = db.session.query(BookingSlot.booking_id)
+    bookings = Booking.query.filter(
+        Booking.status.in_(['confirmed', 'checked_in']),
+        ~Booking.id.in_(claimed)
+    ).order_by(Booking.booking_time).all()
+
+    created = 0
+    conflicts = []
+    for booking in bookings:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(BookingSlot), slot_rows(booking))
+            created += 1
+        except IntegrityError:
+            conflicts.append(booking.id)
+    db.session.commit()
+    return created, conflicts
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+from app.utils.cache import TTLCache
+
+class DashboardCounters:
+    """管理员控制面板的计数器缓存
+
+    自习室数、座位数、用户数和今日预约数缓存 DASHBOARD_CACHE_SECONDS 秒，
+    本进程内预约、自习室、座位或用户写入后调用 invalidate() 立即失效；
+    其他进程的写入最多延迟一个缓存周期后可见。
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(ttl=30, maxsize=4)
+
+    def init_app(self, app):
+        self._cache.ttl = app.config.get('DASHBOARD_CACHE_SECONDS', 30)
+        self._cache.clear()
+
+    def invalidate(self):
+        self._cache.clear()
+
+    def get(self):
+        """返回 {'total_rooms', 'total_seats', 'total_users', 'today_bookings'}"""
+        today = datetime.now().date()
+        return self._cache.get_or_set(today, lambda: self._count(today))
+
+    def _count(self, today):
+        from app import db
+        from app.models import User, StudyRoom, Seat, Booking
+
+        start = datetime.combine(today, datetime.min.time())
+        count = lambda model, *filters: db.session.query(db.func.count(model.id)).filter(*filters).scalar_subquery()
+        # 四个计数合并为一条语句
+        total_rooms, total_seats, total_users, today_bookings = db.session.query(
+            count(StudyRoom, StudyRoom.is_active == True),
+            count(Seat, Seat.is_active == True),
+            count(User, User.is_admin == False),
+            count(Booking, Booking.start_time >= start, Booking.start_time < start + timedelta(days=1))
+        ).one()
+        return {
+            'total_rooms': total_rooms,
+            'total_seats': total_seats,
+            'total_users': total_users,
+            'today_bookings': today_bookings
+        }
+
+    def stats(self):
+        return self._cache.stats()
+
+
+dashboard_counters = DashboardCounters()
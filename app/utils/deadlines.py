@@ -0,0 +1,164 @@
+import heapq
+import itertools
+import threading
+from datetime import datetime, timedelta
+
+# 预约的截止事件类型
+REMINDER = 'reminder'          # 开始前15分钟提醒
+LATE_WARNING = 'late_warning'  # 开始10分钟后仍未签到的提醒
+EXPIRY = 'expiry'              # 开始15分钟后仍未签到则过期
+COMPLETION = 'completion'      # 结束后完成
+
+class DeadlineScheduler:
+    """基于最小堆的预约截止事件调度器
+
+    每个预约按状态生成提醒、迟到提醒、过期和完成事件放入堆中，后台线程
+    在最近的事件到期时醒来，把同一时刻到期的同类事件合并交给处理函数，
+    入堆和出堆都是 O(log n)。本进程创建的预约通过 schedule_booking 直接
+    入堆；其他进程创建的预约按ID水位线每隔 DEADLINE_POLL_SECONDS 秒增量
+    加载。水位线只由轮询推进：本进程的预约ID可能大于其他进程尚未被轮询到
+    的预约，直接入堆的预约记在 _local_ids 中，轮询时跳过以免重复入堆。
+    事件触发时处理函数会重新检查预约状态，已取消的预约不需要出堆。
+    """
+
+    def __init__(self, handlers=None):
+        self.handlers = handlers or {}
+        self.poll_seconds = 5
+        self._cond = threading.Condition()
+        self._counter = itertools.count()
+        self._heap = []
+        self._last_booking_id = 0
+        self._local_ids = set()
+        self._thread = None
+        self._stopping = False
+
+    def init_app(self, app):
+        self.poll_seconds = app.config.get('DEADLINE_POLL_SECONDS', 5)
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def _push(self, due, kind, booking_id):
+        heapq.heappush(self._heap, (due, next(self._counter), kind, booking_id))
+
+    def _push_booking(self, booking):
+        if booking.status == 'confirmed':
+            self._push(booking.start_time - timedelta(minutes=15), REMINDER, booking.id)
+            self._push(booking.start_time + timedelta(minutes=10), LATE_WARNING, booking.id)
+            self._push(booking.start_time + timedelta(minutes=15), EXPIRY, booking.id)
+        if booking.status in ('confirmed', 'checked_in'):
+            self._push(booking.end_time, COMPLETION, booking.id)
+
+    def schedule_booking(self, booking):
+        """新预约写入后调用；调度线程未运行时忽略"""
+        if not self.running:
+            return
+        with self._cond:
+            self._push_booking(booking)
+            if booking.id > self._last_booking_id:
+                self._local_ids.add(booking.id)
+            self._cond.notify()
+
+    def rebuild(self):
+        """从数据库重建事件堆"""
+        from app.models import Booking
+
+        bookings = Booking.query.filter(Booking.status.in_(['confirmed', 'checked_in'])).all()
+        last_id = Booking.query.with_entities(Booking.id).order_by(Booking.id.desc()).limit(1).scalar()
+        with self._cond:
+            self._heap = []
+            self._last_booking_id = last_id or 0
+            self._local_ids = set()
+            for booking in bookings:
+                self._push_booking(booking)
+
+    def load_new_bookings(self):
+        """加载其他进程创建的新预约"""
+        from app.models import Booking
+
+        last_id = self._last_booking_id
+        bookings = Booking.query.filter(
+            Booking.id > last_id,
+            Booking.status.in_(['confirmed', 'checked_in'])
+        ).order_by(Booking.id).all()
+        # 水位线取已提交的最大ID，已取消或过期的新预约也不再重复查询
+        new_last_id = Booking.query.with_entities(Booking.id).filter(
+            Booking.id > last_id
+        ).order_by(Booking.id.desc()).limit(1).scalar()
+        with self._cond:
+            for booking in bookings:
+                if booking.id not in self._local_ids:
+                    self._push_booking(booking)
+            if new_last_id is not None:
+                self._last_booking_id = max(self._last_booking_id, new_last_id)
+                self._local_ids = {booking_id for booking_id in self._local_ids if booking_id > self._last_booking_id}
+
+    def pop_due(self, now):
+        """弹出所有到期事件，返回 {事件类型: [预约ID, ...]}"""
+        due = {}
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                _, _, kind, booking_id = heapq.heappop(self._heap)
+                due.setdefault(kind, []).append(booking_id)
+        return due
+
+    def next_due(self):
+        with self._cond:
+            return self._heap[0][0] if self._heap else None
+
+    def run_pending(self, now=None):
+        """处理到期事件，按提醒、迟到提醒、过期、完成的顺序调用处理函数"""
+        self.load_new_bookings()
+        if now is None:
+            now = datetime.now()
+        due = self.pop_due(now)
+        for kind in (REMINDER, LATE_WARNING, EXPIRY, COMPLETION):
+            if kind in due and kind in self.handlers:
+                self.handlers[kind](due[kind], now)
+        return due
+
+    def start(self, app, handlers=None):
+        """启动后台调度线程"""
+        if self.running:
+            return
+        if handlers:
+            self.handlers = handlers
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, args=(app,), name='deadline-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, app):
+        from app import db
+
+        with app.app_context():
+            self.rebuild()
+            db.session.remove()
+
+        while not self._stopping:
+            with app.app_context():
+                try:
+                    self.run_pending()
+                except Exception as e:
+                    print(f"处理预约截止事件失败: {str(e)}")
+                finally:
+                    db.session.remove()
+
+            timeout = self.poll_seconds
+            next_due = self.next_due()
+            if next_due is not None:
+                timeout = max(0, min(timeout, (next_due - datetime.now()).total_seconds()))
+            with self._cond:
+                if not self._stopping:
+                    self._cond.wait(timeout)
+
+
+deadline_scheduler = DeadlineScheduler()
@@ -0,0 +1,130 @@
+import csv
+import io
+from app import db
+from app.models import Booking, ArchivedBooking, Seat, StudyRoom, User
+from sqlalchemy import select, tuple_
+from datetime import datetime, timedelta
+
+# 导出的列：(列名, 预约表中的属性名或关联表的列)
+EXPORT_COLUMNS = [
+    ('booking_id', 'id'),
+    ('student_id', User.student_id),
+    ('username', User.username),
+    ('room', StudyRoom.name),
+    ('seat_number', Seat.seat_number),
+    ('start_time', 'start_time'),
+    ('end_time', 'end_time'),
+    ('status', 'status'),
+    ('booking_time', 'booking_time'),
+    ('checkin_time', 'checkin_time'),
+]
+
+def filter_bookings(query, status=None, room_id=None, date_str=None, source=Booking):
+    """按预约管理页的筛选条件（状态、自习室、日期）过滤预约查询
+
+    source 为 Booking 或 ArchivedBooking。
+    """
+    if status:
+        query = query.filter(source.status == status)
+
+    if room_id:
+        query = query.filter(source.seat_id.in_(select(Seat.id).where(Seat.room_id == room_id)))
+
+    if date_str:
+        date = datetime.fromisoformat(date_str).date()
+        start_datetime = datetime.combine(date, datetime.min.time())
+        end_datetime = start_datetime + timedelta(days=1)
+        query = query.filter(source.start_time >= start_datetime, source.start_time < end_datetime)
+    return query
+
+def iter_booking_batches(status=None, room_id=None, date_str=None, batch_size=1000):
+    """按 (start_time, id) 键集分批读取预约及其用户、座位和自习室信息
+
+    先导出归档表中的历史预约，再导出 bookings 表，两者各自沿索引分页。
+    每批是一次独立的查询，内存占用只与 batch_size 有关，与导出的总行数无关。
+    """
+    for source in (ArchivedBooking, Booking):
+        columns = [(getattr(source, column) if isinstance(column, str) else column).label(name)
+                   for name, column in EXPORT_COLUMNS]
+        query = db.session.query(*columns
+        ).join(User, User.id == source.user_id
+        ).join(Seat, Seat.id == source.seat_id
+        ).join(StudyRoom, StudyRoom.id == Seat.room_id)
+        query = filter_bookings(query, status, room_id, date_str, source)
+
+        last = None
+        while True:
+            batch_query = query
+            if last is not None:
+                batch_query = batch_query.filter(tuple_(source.start_time, source.id) > last)
+            rows = batch_query.order_by(source.start_time, source.id).limit(batch_size).all()
+            if rows:
+                yield rows
+            if len(rows) < batch_size:
+                break
+            last = (rows[-1].start_time, rows[-1].booking_id)
+
+def iter_csv(batches):
+    """将预约批次编码为 CSV 文本块，开头带 BOM 以便 Excel 正确识别中文"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([name for name, _ in EXPORT_COLUMNS])
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+class _ChunkSink(io.RawIOBase):
+    """只追加的文件对象，写入的字节由调用方逐块取走"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_parquet(batches):
+    """将预约批次编码为 Parquet，每批写成一个行组后立即输出
+
+    需要安装 pyarrow，未安装时抛出 ImportError。
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('booking_id', pa.int64()),
+        ('student_id', pa.string()),
+        ('username', pa.string()),
+        ('room', pa.string()),
+        ('seat_number', pa.string()),
+        ('start_time', pa.timestamp('s')),
+        ('end_time', pa.timestamp('s')),
+        ('status', pa.string()),
+        ('booking_time', pa.timestamp('us')),
+        ('checkin_time', pa.timestamp('us')),
+    ])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for rows in batches:
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays([pa.array(values, type=field.type)
+                                                      for values, field in zip(columns, schema)], schema=schema))
+            yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,20 @@
+import csv
+import io
+import json
+
+def read_rows(stream, filename):
+    """读取 CSV 或 JSON 导入文件，返回行字典列表
+
+    文件名以 .json 结尾时按 JSON 对象数组读取，否则按带表头的 CSV 读取。
+    stream 可以是文本流或二进制流（如上传的文件），二进制流按 UTF-8 解码。
+    格式错误时抛出 ValueError、UnicodeDecodeError 或 csv.Error。
+    """
+    if filename.lower().endswith('.json'):
+        rows = json.load(stream)
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError('JSON 文件必须是对象数组')
+        return rows
+
+    if isinstance(stream.read(0), bytes):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    return list(csv.DictReader(stream))
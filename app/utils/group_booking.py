@@ -0,0 +1,162 @@
+import re
+from app import db
+from app.models import Booking, BookingSlot, StudyRoom, User
+from app.utils.availability import find_available_seats
+from app.utils.booking_service import slot_starts, slot_rows, bookings_created
+from app.utils.lottery import booking_blocked
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+from datetime import datetime, timedelta
+
+# 座位号末尾的数字部分，例如 "A12" 拆为 ("A", 12)
+_SEAT_NUMBER = re.compile(r'^(.*?)(\d+)$')
+
+def seat_key(seat_number):
+    """座位号的排序键 (前缀, 序号)，没有数字部分的序号为 None"""
+    match = _SEAT_NUMBER.match(seat_number)
+    if match is None:
+        return seat_number, None
+    return match.group(1), int(match.group(2))
+
+def free_runs(seats):
+    """把空闲座位按座位号切分为连续段
+
+    seats 为 find_available_seats 返回的座位信息。前缀相同且序号相差 1
+    的座位视为相邻；排序后扫描一遍即可得到所有极大连续段。
+    """
+    runs = []
+    previous = None
+    for seat in sorted(seats, key=lambda seat: (seat_key(seat['seat_number'])[0],
+                                                seat_key(seat['seat_number'])[1] or 0,
+                                                seat['seat_number'])):
+        prefix, number = seat_key(seat['seat_number'])
+        if runs and number is not None and previous == (prefix, number - 1):
+            runs[-1].append(seat)
+        else:
+            runs.append([seat])
+        previous = (prefix, number) if number is not None else None
+    return runs
+
+def choose_seats(seats, size, prefer_power=False):
+    """从一个自习室的空闲座位中选出 size 个，返回 (评分, 座位列表)，不够时返回 (None, None)
+
+    优先选择连续的座位，并采用最佳适配：在能容纳小组的连续段中选最短的一段，
+    尽量不拆散长的连续段；prefer_power 为 True 时先比较有电源的座位数。
+    没有足够长的连续段时从最长的段开始拼凑，使小组分成尽量少的几段。
+    评分越小越好，可以在不同自习室之间比较。
+    """
+    if len(seats) < size:
+        return None, None
+    runs = free_runs(seats)
+
+    best = None
+    for run in runs:
+        if len(run) < size:
+            continue
+        # 滑动窗口统计有电源的座位数
+        power = sum(1 for seat in run[:size] if seat['has_power_outlet'])
+        for start in range(len(run) - size + 1):
+            if start:
+                power += run[start + size - 1]['has_power_outlet'] - run[start - 1]['has_power_outlet']
+            score = (1, -power if prefer_power else 0, len(run))
+            if best is None or score < best[0]:
+                best = (score, run[start:start + size])
+    if best is not None:
+        return best
+
+    chosen = []
+    fragments = 0
+    for run in sorted(runs, key=lambda run: (-len(run), -sum(seat['has_power_outlet'] for seat in run))):
+        chosen.extend(run[:size - len(chosen)])
+        fragments += 1
+        if len(chosen) == size:
+            break
+    power = sum(1 for seat in chosen if seat['has_power_outlet'])
+    return (fragments, -power if prefer_power else 0, 0), chosen
+
+def find_group_seats(room_ids, start_time, end_time, size, prefer_power=False):
+    """在 room_ids 中为小组找 size 个空闲座位，返回 (room_id, 座位列表)，找不到时返回 (None, [])
+
+    空闲座位由 find_available_seats 一次取出，每个自习室只做一遍连续段扫描。
+    """
+    seats_by_room = find_available_seats(room_ids, start_time, end_time)
+    best = None
+    for room_id in room_ids:
+        score, seats = choose_seats(seats_by_room[room_id], size, prefer_power)
+        if seats is not None and (best is None or score < best[0]):
+            best = (score, room_id, seats)
+    if best is None:
+        return None, []
+    return best[1], best[2]
+
+def create_group_booking(organizer_id, student_ids, start_time, end_time, room_id=None,
+                         prefer_power=False, now=None):
+    """为发起人和 student_ids 中的同学原子地预约同一自习室的一组座位，返回 (预约列表, 错误信息)
+
+    未指定 room_id 时在所有启用且在该时间段开放的自习室中选择。所有成员的时间冲突由一次
+    查询检查，全部预约在一个事务中插入，任何一个座位或成员冲突都不会创建预约。
+    """
+    if now is None:
+        now = datetime.now()
+    max_hours = current_app.config.get('MAX_BOOKING_HOURS', 4)
+    if end_time <= start_time or end_time - start_time > timedelta(hours=max_hours):
+        return [], f'单次预约时长应为1到{max_hours}小时'
+    if start_time < now:
+        return [], '开始时间已过'
+    if booking_blocked(start_time, now):
+        return [], '该日期的座位通过抽签分配，请在抽签页面提交志愿'
+
+    organizer = db.session.get(User, organizer_id)
+    student_ids = [student_id for student_id in dict.fromkeys(student_ids) if student_id != organizer.student_id]
+    members = User.query.filter(User.student_id.in_(student_ids)).all() if student_ids else []
+    missing = set(student_ids) - {member.student_id for member in members}
+    if missing:
+        return [], f'学号不存在：{"、".join(sorted(missing))}'
+    members = [organizer] + sorted(members, key=lambda member: student_ids.index(member.student_id))
+    max_size = current_app.config.get('GROUP_BOOKING_MAX_SIZE', 8)
+    if len(members) > max_size:
+        return [], f'小组最多{max_size}人'
+
+    if room_id is not None:
+        room = db.session.get(StudyRoom, room_id)
+        if room is None or not room.is_active:
+            return [], '自习室不存在或已停用'
+        rooms = [room]
+    else:
+        rooms = StudyRoom.query.filter_by(is_active=True).order_by(StudyRoom.id).all()
+    # 与搜索页相同的开放时间过滤
+    room_ids = [room.id for room in rooms if room.is_open_during(start_time, end_time)]
+    if not room_ids:
+        return [], '自习室在选择的时间段内未开放'
+
+    slots = slot_starts(start_time, end_time)
+    member_ids = [member.id for member in members]
+    # 检查与插入之间座位被抢先预约时唯一约束会报错，重新查找一次
+    for attempt in range(2):
+        busy = {user_id for user_id, in db.session.query(BookingSlot.user_id).filter(
+            BookingSlot.user_id.in_(member_ids), BookingSlot.slot_start.in_(slots)).distinct()}
+        if busy:
+            names = [member.student_id for member in members if member.id in busy]
+            return [], f'以下成员在选择的时间段内已有其他预约：{"、".join(names)}'
+
+        chosen_room, seats = find_group_seats(room_ids, start_time, end_time, len(members), prefer_power)
+        if chosen_room is None:
+            return [], f'没有能容纳{len(members)}人的空闲座位'
+
+        bookings = [Booking(user_id=member.id, seat_id=seat['id'], start_time=start_time, end_time=end_time)
+                    for member, seat in zip(members, seats)]
+        try:
+            db.session.add_all(bookings)
+            db.session.flush()
+            db.session.execute(insert(BookingSlot), [row for booking in bookings for row in slot_rows(booking)])
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            continue
+        except OperationalError:
+            db.session.rollback()
+            return [], '系统繁忙，请稍后重试'
+        bookings_created(bookings)
+        return bookings, None
+    return [], '座位已被其他同学抢先预约，请重试'
@@ -0,0 +1,200 @@
+import uuid
+from datetime import datetime, timedelta
+from functools import wraps
+from app.utils.cache import TTLCache
+
+# 重放时视为可以记录的响应（重定向）
+REPLAYABLE_STATUS = {301, 302, 303, 307, 308}
+
+class IdempotencyStore:
+    """预约和取消等 POST 请求的幂等键
+
+    客户端通过 Idempotency-Key 请求头或 idempotency_key 表单字段提供幂等键，
+    同一用户的同一个键只执行一次视图，结果（重定向地址和提示消息）写入
+    idempotency_keys 表并缓存在本进程内，重放时由缓存或一次主键查询直接返回，
+    不再执行预约逻辑。
+
+    视图在提交预约之前用 expect() 声明成功时的响应，幂等键及其结果随预约在
+    同一事务中写入（排队预约随整批票据写入），不会为幂等键单独提交事务；并发
+    的重复请求中只有一个能提交，其余的因唯一约束回滚后重放它的结果。没有声明
+    结果而提交了修改的视图（周期预约、小组预约）在返回后单独写入一次结果。
+    记录保留 IDEMPOTENCY_KEY_SECONDS 秒，由定时任务清理。
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(ttl=86400, maxsize=10000)
+        self.ttl = 86400
+        self.replays = 0
+
+    def init_app(self, app):
+        from sqlalchemy import event
+        from app import db
+
+        self.ttl = app.config.get('IDEMPOTENCY_KEY_SECONDS', 86400)
+        self._cache.ttl = self.ttl
+        self._cache.clear()
+        # 模板中为每个表单生成新的幂等键
+        app.jinja_env.globals['idempotency_key'] = lambda: uuid.uuid4().hex
+        for name, listener in (('before_commit', self._before_commit), ('after_commit', self._after_commit),
+                               ('after_soft_rollback', self._after_rollback)):
+            if not event.contains(db.session, name, listener):
+                event.listen(db.session, name, listener)
+
+    def idempotent(self, view):
+        """视图装饰器，放在 login_required 之后"""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            from flask import request, abort, make_response, session, g
+            from flask_login import current_user
+
+            key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+            if not key or not current_user.is_authenticated:
+                return view(*args, **kwargs)
+            if len(key) > 64:
+                abort(400)
+
+            user_id = current_user.id
+            result = self._cache.get((user_id, key)) or self._lookup(user_id, key)
+            if result is not None:
+                return self._replay(result, request.endpoint)
+
+            state = g._idempotency = {'user_id': user_id, 'key': key, 'endpoint': request.endpoint,
+                                      'expected': None, 'adding': False, 'saved': False, 'committed': False}
+            flashed = len(session.get('_flashes', []))
+            try:
+                response = make_response(view(*args, **kwargs))
+            finally:
+                g._idempotency = None
+            if response.status_code not in REPLAYABLE_STATUS:
+                return response
+
+            if not state['saved']:
+                # 并发的重复请求已提交同一个键时，丢弃本次的提示消息并重放它的结果
+                existing = self._lookup(user_id, key)
+                if existing is not None:
+                    session['_flashes'] = session.get('_flashes', [])[:flashed]
+                    return self._replay(existing, request.endpoint)
+
+            result = {
+                'endpoint': request.endpoint,
+                'status_code': response.status_code,
+                'location': response.location,
+                'flashes': [list(message) for message in session.get('_flashes', [])[flashed:]]
+            }
+            if state['committed'] and not state['saved']:
+                self._save(user_id, key, result)
+            self._cache.set((user_id, key), result)
+            return response
+        return wrapper
+
+    def expect(self, location, flashes):
+        """声明视图接下来的提交成功时的响应，幂等键随该次提交一起写入
+
+        flashes 为 [(类别, 消息)]。不在带幂等键的请求中时不做任何事。
+        """
+        state = self._state()
+        if state is not None:
+            state['expected'] = {'status_code': 302, 'location': location,
+                                 'flashes': [list(message) for message in flashes]}
+
+    def take_expected(self):
+        """取出声明的结果，交给排队预约的写入线程随票据一起写入，返回幂等键记录或 None"""
+        state = self._state()
+        if state is None or state['expected'] is None:
+            return None
+        row = dict(state['expected'], user_id=state['user_id'], key=state['key'], endpoint=state['endpoint'],
+                   created_at=datetime.now())
+        state['expected'] = None
+        state['saved'] = True
+        return row
+
+    def _state(self):
+        from flask import g, has_request_context
+
+        return g.get('_idempotency') if has_request_context() else None
+
+    def _before_commit(self, session):
+        from app.models import IdempotencyKey
+
+        state = self._state()
+        if state is None or state['expected'] is None or state['adding']:
+            return
+        session.add(IdempotencyKey(user_id=state['user_id'], key=state['key'], endpoint=state['endpoint'],
+                                   **state['expected']))
+        state['adding'] = True
+
+    def _after_commit(self, session):
+        state = self._state()
+        if state is None:
+            return
+        state['committed'] = True
+        if state['adding']:
+            state['adding'] = False
+            state['expected'] = None
+            state['saved'] = True
+
+    def _after_rollback(self, session, previous_transaction):
+        # 回滚时随之丢弃的幂等键在下一次提交时重新写入
+        state = self._state()
+        if state is not None:
+            state['adding'] = False
+
+    def _lookup(self, user_id, key):
+        """按主键读取已记录的结果，过期的记录视为不存在并删除"""
+        from app import db
+        from app.models import IdempotencyKey
+
+        row = db.session.query(
+            IdempotencyKey.endpoint, IdempotencyKey.status_code, IdempotencyKey.location,
+            IdempotencyKey.flashes, IdempotencyKey.created_at
+        ).filter_by(user_id=user_id, key=key).first()
+        if row is None:
+            return None
+        if row.status_code is None or row.created_at < datetime.now() - timedelta(seconds=self.ttl):
+            IdempotencyKey.query.filter_by(user_id=user_id, key=key).delete()
+            db.session.commit()
+            return None
+        result = {'endpoint': row.endpoint, 'status_code': row.status_code,
+                  'location': row.location, 'flashes': row.flashes or []}
+        self._cache.set((user_id, key), result)
+        return result
+
+    def _save(self, user_id, key, result):
+        from app import db
+        from app.models import IdempotencyKey
+        from sqlalchemy.exc import IntegrityError
+
+        try:
+            db.session.add(IdempotencyKey(user_id=user_id, key=key, **result))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+
+    def _replay(self, result, endpoint):
+        from flask import flash, redirect, abort
+
+        if result['endpoint'] != endpoint:
+            abort(422)
+        self.replays += 1
+        for category, message in result['flashes']:
+            flash(message, category)
+        return redirect(result['location'], code=result['status_code'])
+
+    def purge(self, now=None):
+        """删除过期的幂等键，返回删除的条数"""
+        from app import db
+        from app.models import IdempotencyKey
+
+        if now is None:
+            now = datetime.now()
+        deleted = IdempotencyKey.query.filter(
+            IdempotencyKey.created_at < now - timedelta(seconds=self.ttl)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    def stats(self):
+        return dict(self._cache.stats(), replays=self.replays)
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,122 @@
+import atexit
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import update, or_
+from sqlalchemy.exc import IntegrityError
+
+class LeaderElection:
+    """基于数据库租约的主节点选举
+
+    多个工作进程竞争 scheduler_leases 表中的同一行租约，持有未过期租约的
+    进程成为主节点并每隔 1/3 租期续约。主节点退出或失去响应后租约过期，
+    其他进程会在下一次尝试时自动接管。
+    """
+
+    def __init__(self, name='scheduler'):
+        self.name = name
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.lease_seconds = 30
+        self.is_leader = False
+        self._expires_at = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        self.lease_seconds = app.config.get('SCHEDULER_LEASE_SECONDS', 30)
+
+    def try_acquire(self, now=None):
+        """获取或续约租约，返回当前进程是否为主节点"""
+        from app import db
+        from app.models import SchedulerLease
+
+        if now is None:
+            now = datetime.now()
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+
+        # 续约自己的租约，或接管已过期的租约
+        result = db.session.execute(
+            update(SchedulerLease).where(
+                SchedulerLease.name == self.name,
+                or_(SchedulerLease.holder == self.holder, SchedulerLease.expires_at < now)
+            ).values(holder=self.holder, expires_at=expires_at)
+        )
+        if result.rowcount:
+            db.session.commit()
+            self._expires_at = expires_at
+            return True
+
+        # 租约行不存在时尝试创建
+        try:
+            db.session.add(SchedulerLease(name=self.name, holder=self.holder, expires_at=expires_at))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return False
+        self._expires_at = expires_at
+        return True
+
+    def release(self):
+        """主动释放租约，使其他进程可以立即接管"""
+        from app import db
+        from app.models import SchedulerLease
+
+        db.session.execute(
+            update(SchedulerLease).where(
+                SchedulerLease.name == self.name,
+                SchedulerLease.holder == self.holder
+            ).values(expires_at=datetime.now() - timedelta(seconds=1))
+        )
+        db.session.commit()
+        self.is_leader = False
+
+    def start(self, app, on_elected, on_demoted):
+        """启动选举线程，成为主节点时调用 on_elected，失去主节点时调用 on_demoted"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, args=(app, on_elected, on_demoted), name='leader-election', daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop, app)
+
+    def stop(self, app):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.is_leader:
+            with app.app_context():
+                self.release()
+
+    def _run(self, app, on_elected, on_demoted):
+        from app import db
+
+        while not self._stopping.is_set():
+            with app.app_context():
+                try:
+                    acquired = self.try_acquire()
+                except Exception as e:
+                    # 数据库暂时不可用时，在租约到期前仍保持主节点身份
+                    print(f"调度器租约续约失败: {str(e)}")
+                    db.session.rollback()
+                    acquired = self.is_leader and datetime.now() < self._expires_at
+                finally:
+                    db.session.remove()
+
+            if acquired and not self.is_leader:
+                self.is_leader = True
+                on_elected()
+            elif not acquired and self.is_leader:
+                self.is_leader = False
+                on_demoted()
+
+            self._stopping.wait(self.lease_seconds / 3)
+
+        if self.is_leader:
+            on_demoted()
+
+
+leader_election = LeaderElection()
@@ -0,0 +1,168 @@
+import random
+from app import db
+from app.models import Booking, BookingSlot, Seat, StudyRoom, User, LotteryEntry, LotteryDay
+from app.utils.booking_service import slot_starts, slot_rows, bookings_created
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+
+def lottery_enabled():
+    return current_app.config.get('LOTTERY_ENABLED', False)
+
+def lottery_day(now=None):
+    """当前放号周期抽签分配的日期（明天）"""
+    if now is None:
+        now = datetime.now()
+    return now.date() + timedelta(days=1)
+
+def window_open(now=None):
+    """当前是否处于提交志愿的时间窗口 [LOTTERY_OPEN_HOUR, LOTTERY_CLOSE_HOUR)"""
+    if now is None:
+        now = datetime.now()
+    return lottery_enabled() and \
+        current_app.config.get('LOTTERY_OPEN_HOUR', 7) <= now.hour < current_app.config.get('LOTTERY_CLOSE_HOUR', 8)
+
+def lottery_allocated(day):
+    """放号日的抽签分配是否已经提交"""
+    return db.session.get(LotteryDay, day) is not None
+
+def blocked_days(days, now=None):
+    """抽签模式下 days 中尚未完成抽签分配、不能直接预约的日期集合
+
+    放号日及之后的日期在该日的分配提交前都不能直接预约，否则学生可以提前
+    预约抽签尚未分配的日期；之前的日期如果还有待分配的志愿（分配失败尚未
+    重新执行）也不能直接预约。解除限制以分配事务提交为准，而不是按时间点，
+    避免直接预约与分配同时写入。
+    """
+    if now is None:
+        now = datetime.now()
+    days = set(days)
+    if not lottery_enabled() or not days:
+        return set()
+    first = lottery_day(now)
+    allocated = {day for day, in db.session.query(LotteryDay.day).filter(LotteryDay.day.in_(days))}
+    pending = {day for day, in db.session.query(LotteryEntry.day).filter(
+        LotteryEntry.day.in_(days), LotteryEntry.status == 'pending').distinct()}
+    return {day for day in days if day not in allocated and (day >= first or day in pending)}
+
+def booking_blocked(start_time, now=None):
+    """抽签模式下 start_time 所在日期是否还不能直接预约，见 blocked_days"""
+    return start_time.date() in blocked_days([start_time.date()], now)
+
+def priority_order(entries, violations, rng):
+    """按违约次数加权的随机顺序
+
+    每个志愿的权重为 1 / (1 + LOTTERY_VIOLATION_WEIGHT * 违约次数)，以
+    random() ** (1 / 权重) 为键降序排列（Efraimidis-Spirakis 加权随机抽样），
+    等价于按权重依次不放回抽取，排序一次即可得到完整顺序。
+    """
+    factor = current_app.config.get('LOTTERY_VIOLATION_WEIGHT', 1.0)
+    keys = {}
+    for entry in entries:
+        weight = 1 / (1 + factor * (violations.get(entry.user_id) or 0))
+        keys[entry.id] = rng.random() ** (1 / weight)
+    return sorted(entries, key=lambda entry: keys[entry.id], reverse=True)
+
+def _assign(ordered, room_seats, active_seats, day):
+    """按顺序为每个志愿分配第一个仍然空闲的志愿座位，返回 [(志愿, 座位ID或None)]
+
+    已占用的时间槽从数据库一次加载到内存集合中；志愿为整个自习室时，每个
+    (自习室, 时间段) 记录扫描位置，已扫描过的座位不会再被检查。
+    """
+    day_start = datetime.combine(day, datetime.min.time())
+    seat_slots = set()
+    user_slots = set()
+    for seat_id, user_id, slot_start in db.session.query(
+        BookingSlot.seat_id, BookingSlot.user_id, BookingSlot.slot_start
+    ).filter(BookingSlot.slot_start >= day_start, BookingSlot.slot_start < day_start + timedelta(days=1)):
+        seat_slots.add((seat_id, slot_start))
+        user_slots.add((user_id, slot_start))
+
+    cursors = {}
+    assignments = []
+    for entry in ordered:
+        starts = tuple(slot_starts(entry.start_time, entry.end_time))
+        seat_id = None
+        if not any((entry.user_id, slot) in user_slots for slot in starts):
+            for preference in entry.preferences:
+                if preference.get('seat_id'):
+                    candidate = preference['seat_id']
+                    if candidate in active_seats and not any((candidate, slot) in seat_slots for slot in starts):
+                        seat_id = candidate
+                else:
+                    seats = room_seats.get(preference.get('room_id'), [])
+                    key = (preference.get('room_id'), starts)
+                    position = cursors.get(key, 0)
+                    while position < len(seats) and any((seats[position], slot) in seat_slots for slot in starts):
+                        position += 1
+                    cursors[key] = position
+                    if position < len(seats):
+                        seat_id = seats[position]
+                if seat_id is not None:
+                    break
+
+        if seat_id is not None:
+            seat_slots.update((seat_id, slot) for slot in starts)
+            user_slots.update((entry.user_id, slot) for slot in starts)
+        assignments.append((entry, seat_id))
+    return assignments
+
+def allocate_lottery(day, rng=None, attempts=3):
+    """为放号日的全部待分配志愿分配座位，返回 (分配成功数, 未分配数)
+
+    按 priority_order 的顺序依次为每个学生分配第一个仍然空闲的志愿座位
+    （串行独裁分配），整个分配过程只需对志愿和座位各扫描一遍，所有预约在
+    一个事务中批量写入，并在同一事务中将该日记为已分配，提交后才开放直接
+    预约（没有志愿时也会记录）。分配期间有预约从其他途径写入导致唯一约束冲突时，
+    按同一顺序对重新加载的占用情况再分配一次，冲突的学生会继续尝试后面的
+    志愿；attempts 次仍冲突时抛出异常，志愿保持待分配，可以重新执行。
+    """
+    if rng is None:
+        rng = random.SystemRandom()
+    entries = LotteryEntry.query.filter_by(day=day, status='pending').all()
+    if not entries:
+        if not lottery_allocated(day):
+            db.session.add(LotteryDay(day=day))
+            db.session.commit()
+        return 0, 0
+
+    violations = dict(db.session.query(User.id, User.violation_count).filter(
+        User.id.in_({entry.user_id for entry in entries})))
+    ordered = priority_order(entries, violations, rng)
+    room_seats = {}
+    for seat_id, room_id in db.session.query(Seat.id, Seat.room_id).join(StudyRoom).filter(
+            Seat.is_active == True, StudyRoom.is_active == True).order_by(Seat.room_id, Seat.id):
+        room_seats.setdefault(room_id, []).append(seat_id)
+    active_seats = {seat_id for seats in room_seats.values() for seat_id in seats}
+
+    for attempt in range(attempts):
+        allocated = []
+        for entry, seat_id in _assign(ordered, room_seats, active_seats, day):
+            if seat_id is None:
+                entry.status = 'unallocated'
+            else:
+                allocated.append((entry, Booking(user_id=entry.user_id, seat_id=seat_id,
+                                                 start_time=entry.start_time, end_time=entry.end_time)))
+
+        bookings = [booking for _, booking in allocated]
+        try:
+            db.session.add_all(bookings)
+            db.session.flush()
+            if bookings:
+                db.session.execute(insert(BookingSlot), [row for booking in bookings for row in slot_rows(booking)])
+            for entry, booking in allocated:
+                entry.status = 'allocated'
+                entry.booking_id = booking.id
+            if not lottery_allocated(day):
+                db.session.add(LotteryDay(day=day))
+            db.session.commit()
+        except IntegrityError:
+            # 回滚后志愿恢复为待分配，重新加载占用情况后再分配
+            db.session.rollback()
+            if attempt == attempts - 1:
+                raise
+            continue
+
+        bookings_created(bookings)
+        return len(bookings), len(entries) - len(bookings)
@@ -0,0 +1,275 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+# 与水位线重叠的时间，覆盖同步期间尚未提交的事务和进程间的时钟误差
+OVERLAP = timedelta(seconds=60)
+
+class OccupancyIndex:
+    """座位占用位图索引
+
+    为每一天维护一个 bytearray，每个座位按座位ID占一行，每行是一天的
+    时间槽位图（默认15分钟一个槽，96位即12字节）。5000个座位一天约60KB，
+    一学期的预约只需几MB内存。
+
+    索引只记录有效预约（confirmed、checked_in），预约的写入路径负责增量
+    更新；为了让多进程部署下其他进程的写入也能生效，读取时若距上次同步
+    超过 OCCUPANCY_REFRESH_SECONDS 秒，会按 updated_at 水位线找出此后有
+    变化的预约所在的座位，只重新加载这些座位今天及以后的预约。同步期间
+    其他读取者不等待，直接使用现有的索引。预约以整点为单位，因此时间槽
+    位图可以精确表示每个预约。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # 同一时间只允许一个线程从数据库加载
+        self._load_lock = threading.Lock()
+        self._listeners = []
+        self._days = {}
+        self._replay = None
+        self._refreshed_at = None
+        self._watermark = None
+        self.enabled = True
+        self.refresh_seconds = 5
+        self._set_slot_minutes(15)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('OCCUPANCY_INDEX_ENABLED', True)
+        self.refresh_seconds = app.config.get('OCCUPANCY_REFRESH_SECONDS', 5)
+        self._set_slot_minutes(app.config.get('OCCUPANCY_SLOT_MINUTES', 15))
+        self.reset()
+
+    def _set_slot_minutes(self, minutes):
+        self.slot_minutes = minutes
+        self.slots_per_day = 24 * 60 // minutes
+        self.row_bytes = (self.slots_per_day + 7) // 8
+
+    def reset(self):
+        """清空索引，下次读取时从数据库重建"""
+        with self._lock:
+            self._days = {}
+            self._replay = None
+            self._refreshed_at = None
+            self._watermark = None
+
+    def add_listener(self, callback):
+        """注册变化回调：callback(seat_id)，整体重载时 seat_id 为 None"""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def _notify(self, seat_id=None):
+        # 在索引锁之外调用，避免与监听者的锁形成死锁
+        for callback in self._listeners:
+            callback(seat_id)
+
+    # ---- 时间槽计算 ----
+
+    def _spans(self, start_time, end_time):
+        """将时间段按天拆分为 (日期, 起始槽, 结束槽)，向外取整到时间槽"""
+        slot = timedelta(minutes=self.slot_minutes)
+        current = start_time
+        while current < end_time:
+            day_start = datetime.combine(current.date(), datetime.min.time())
+            day_end = day_start + timedelta(days=1)
+            span_end = min(end_time, day_end)
+            first = (current - day_start) // slot
+            last = -((day_start - span_end) // slot)
+            yield current.date(), first, min(last, self.slots_per_day)
+            current = day_end
+
+    @staticmethod
+    def _mask(first, last):
+        return ((1 << (last - first)) - 1) << first
+
+    def _read_row(self, rows, seat_id):
+        offset = seat_id * self.row_bytes
+        if rows is None or offset >= len(rows):
+            return 0
+        return int.from_bytes(rows[offset:offset + self.row_bytes], 'little')
+
+    def _write_row(self, days, day, seat_id, value):
+        rows = days.get(day)
+        if rows is None:
+            rows = days[day] = bytearray()
+        offset = seat_id * self.row_bytes
+        if offset + self.row_bytes > len(rows):
+            rows.extend(bytes(offset + self.row_bytes - len(rows)))
+        rows[offset:offset + self.row_bytes] = value.to_bytes(self.row_bytes, 'little')
+
+    def _apply(self, days, seat_id, start_time, end_time, occupied):
+        for day, first, last in self._spans(start_time, end_time):
+            mask = self._mask(first, last)
+            value = self._read_row(days.get(day), seat_id)
+            value = value | mask if occupied else value & ~mask
+            self._write_row(days, day, seat_id, value)
+
+    # ---- 写入 ----
+
+    def _update(self, seat_id, start_time, end_time, occupied):
+        if not self.enabled:
+            self._notify(seat_id)
+            return
+        with self._lock:
+            if self._refreshed_at is None and self._replay is None:
+                # 尚未加载，首次读取时会从数据库完整重建
+                return
+            self._apply(self._days, seat_id, start_time, end_time, occupied)
+            if self._replay is not None:
+                self._replay.append((seat_id, start_time, end_time, occupied))
+        self._notify(seat_id)
+
+    def add(self, seat_id, start_time, end_time):
+        """标记座位在该时间段被占用"""
+        self._update(seat_id, start_time, end_time, True)
+
+    def remove(self, seat_id, start_time, end_time):
+        """释放座位在该时间段的占用"""
+        self._update(seat_id, start_time, end_time, False)
+
+    def sync_booking(self, booking):
+        """根据预约的当前状态更新索引"""
+        occupied = booking.status in ('confirmed', 'checked_in')
+        self._update(booking.seat_id, booking.start_time, booking.end_time, occupied)
+
+    # ---- 从数据库加载 ----
+
+    def _load(self, since=None, seat_ids=None):
+        from app.models import Booking
+
+        query = Booking.query.with_entities(
+            Booking.seat_id, Booking.start_time, Booking.end_time
+        ).filter(Booking.status.in_(['confirmed', 'checked_in']))
+        if since is not None:
+            query = query.filter(Booking.end_time > since)
+        if seat_ids is not None:
+            query = query.filter(Booking.seat_id.in_(sorted(seat_ids)))
+
+        days = {}
+        for seat_id, start_time, end_time in query.yield_per(1000):
+            self._apply(days, seat_id, start_time, end_time, True)
+        return days
+
+    def rebuild(self):
+        """从 bookings 表完整重建索引"""
+        with self._load_lock:
+            self._rebuild()
+        self._notify()
+
+    def _rebuild(self):
+        started = datetime.now()
+        with self._lock:
+            self._replay = []
+        days = self._load()
+        with self._lock:
+            for op in self._replay:
+                self._apply(days, *op)
+            self._days = days
+            self._replay = None
+            self._refreshed_at = time.monotonic()
+            self._watermark = started
+
+    def refresh(self):
+        """合并其他进程在上次同步之后的写入"""
+        with self._load_lock:
+            self._refresh()
+        self._notify()
+
+    def _changed_seats(self, since):
+        """updated_at 不早于 since 且尚未结束的预约所在的座位"""
+        from app.models import Booking
+
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+        return {seat_id for seat_id, in Booking.query.with_entities(Booking.seat_id).filter(
+            Booking.updated_at >= since, Booking.end_time > today).distinct()}
+
+    def _refresh(self):
+        if self._watermark is None:
+            self._rebuild()
+            return
+        started = datetime.now()
+        today = datetime.combine(started.date(), datetime.min.time())
+        with self._lock:
+            self._replay = []
+        seat_ids = self._changed_seats(self._watermark - OVERLAP)
+        recent = self._load(since=today, seat_ids=seat_ids) if seat_ids else {}
+        with self._lock:
+            # 同步期间本进程对这些座位的写入已经记入旧的位图，需要在新加载的位图上重放
+            for op in self._replay:
+                if op[0] in seat_ids:
+                    self._apply(recent, *op)
+            # 只替换有变化的座位今天及以后的位图；跨越午夜的预约在 recent 中只有
+            # 昨天的一部分，过去的日期保留原有的完整位图
+            for day in set(self._days) | set(recent):
+                if day < today.date():
+                    continue
+                rows = recent.get(day)
+                for seat_id in seat_ids:
+                    self._write_row(self._days, day, seat_id, self._read_row(rows, seat_id))
+            self._replay = None
+            self._refreshed_at = time.monotonic()
+            self._watermark = started
+
+    def _stale(self):
+        return self._refreshed_at is None or time.monotonic() - self._refreshed_at > self.refresh_seconds
+
+    def ensure_fresh(self):
+        if not self._stale():
+            return
+        # 已有索引时不等待其他线程的同步，先使用现有的索引
+        if not self._load_lock.acquire(blocking=self._refreshed_at is None):
+            return
+        try:
+            # 等待锁期间其他线程可能已经完成加载
+            if not self._stale():
+                return
+            if self._refreshed_at is None:
+                self._rebuild()
+            else:
+                self._refresh()
+        finally:
+            self._load_lock.release()
+        self._notify()
+
+    # ---- 查询 ----
+
+    def is_free(self, seat_id, start_time, end_time):
+        """座位在 [start_time, end_time) 内是否空闲"""
+        self.ensure_fresh()
+        days = self._days
+        for day, first, last in self._spans(start_time, end_time):
+            if self._read_row(days.get(day), seat_id) & self._mask(first, last):
+                return False
+        return True
+
+    def free_seat_ids(self, seat_ids, start_time, end_time):
+        """返回 seat_ids 中在该时间段内空闲的座位ID，保持原有顺序"""
+        self.ensure_fresh()
+        days = self._days
+        spans = [(days.get(day), self._mask(first, last))
+                 for day, first, last in self._spans(start_time, end_time)]
+        return [seat_id for seat_id in seat_ids
+                if not any(self._read_row(rows, seat_id) & mask for rows, mask in spans)]
+
+    def day_rows(self, seat_ids, day, intervals=None):
+        """返回各座位某天的占用位图 {seat_id: bytes}
+
+        第 i 个时间槽对应第 i//8 个字节的第 i%8 位。传入 intervals
+        （(seat_id, start_time, end_time) 序列）时按其临时计算，不使用索引。
+        """
+        if intervals is None:
+            self.ensure_fresh()
+            rows = self._days.get(day)
+        else:
+            days = {}
+            for seat_id, start_time, end_time in intervals:
+                self._apply(days, seat_id, start_time, end_time, True)
+            rows = days.get(day)
+        return {seat_id: self._read_row(rows, seat_id).to_bytes(self.row_bytes, 'little')
+                for seat_id in seat_ids}
+
+    def memory_bytes(self):
+        """索引占用的位图字节数"""
+        return sum(len(rows) for rows in self._days.values())
+
+
+occupancy_index = OccupancyIndex()
@@ -0,0 +1,156 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from flask_mail import Message
+
+class OutboxSender:
+    """邮件发件箱的后台发送器
+
+    邮件先写入 email_outbox 表，后台线程每次取出一批到期的邮件，复用同一个
+    SMTP 连接逐封发送。失败的邮件按 OUTBOX_RETRY_SECONDS * 2^(n-1) 退避重试，
+    超过 OUTBOX_MAX_ATTEMPTS 次后标记为失败。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.batch_size = 50
+        self.max_attempts = 5
+        self.retry_seconds = 60
+        self.poll_seconds = 5
+
+    def init_app(self, app):
+        self.batch_size = app.config.get('OUTBOX_BATCH_SIZE', 50)
+        self.max_attempts = app.config.get('OUTBOX_MAX_ATTEMPTS', 5)
+        self.retry_seconds = app.config.get('OUTBOX_RETRY_SECONDS', 60)
+        self.poll_seconds = app.config.get('OUTBOX_POLL_SECONDS', 5)
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def enqueue(self, recipient, subject, html, commit=True):
+        """将邮件写入发件箱，并唤醒本进程的发送线程
+
+        批量写入时传入 commit=False，由调用方统一提交后再调用 wake()。
+        """
+        from app import db
+        from app.models import OutboxEmail
+
+        email = OutboxEmail(recipient=recipient, subject=subject, html=html)
+        db.session.add(email)
+        if commit:
+            db.session.commit()
+            self.wake()
+        return email
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify()
+
+    def _retry_later(self, email, error, now):
+        email.attempts = (email.attempts or 0) + 1
+        email.last_error = str(error)[:500]
+        if email.attempts >= self.max_attempts:
+            email.status = 'failed'
+        else:
+            email.next_attempt_at = now + timedelta(seconds=self.retry_seconds * 2 ** (email.attempts - 1))
+
+    def flush(self, now=None):
+        """发送一批到期的邮件，返回成功发送的数量"""
+        from app import db, mail
+        from app.models import OutboxEmail
+
+        if now is None:
+            now = datetime.now()
+        emails = OutboxEmail.query.filter(
+            OutboxEmail.status == 'pending',
+            OutboxEmail.next_attempt_at <= now
+        ).order_by(OutboxEmail.id).limit(self.batch_size).all()
+        if not emails:
+            return 0
+
+        sent = 0
+        try:
+            with mail.connect() as conn:
+                for email in emails:
+                    started = time.monotonic()
+                    try:
+                        conn.send(Message(subject=email.subject, recipients=[email.recipient], html=email.html))
+                    except Exception as e:
+                        self._retry_later(email, e, now)
+                        continue
+                    email.status = 'sent'
+                    email.sent_at = datetime.now()
+                    email.send_seconds = time.monotonic() - started
+                    sent += 1
+        except Exception as e:
+            # 连接或退出失败，本批尚未发送的邮件稍后重试
+            print(f"发送邮件失败: {str(e)}")
+            for email in emails:
+                if email.status == 'pending' and email.next_attempt_at <= now:
+                    self._retry_later(email, e, now)
+
+        db.session.commit()
+        return sent
+
+    def stats(self, recent=200):
+        """队列深度与最近 recent 封已发送邮件的平均发送耗时和排队时间
+
+        数据来自 email_outbox 表，任何进程都能得到发送线程所在进程的统计。
+        """
+        from app import db
+        from app.models import OutboxEmail
+
+        counts = dict(db.session.query(OutboxEmail.status, db.func.count(OutboxEmail.id)).group_by(OutboxEmail.status).all())
+        sent = db.session.query(OutboxEmail.send_seconds, OutboxEmail.created_at, OutboxEmail.sent_at).filter(
+            OutboxEmail.status == 'sent'
+        ).order_by(OutboxEmail.sent_at.desc()).limit(recent).all()
+        average = lambda values: round(sum(values) / len(values), 3) if values else None
+        return {
+            'pending': counts.get('pending', 0),
+            'failed': counts.get('failed', 0),
+            'sent': counts.get('sent', 0),
+            'avg_send_seconds': average([row.send_seconds for row in sent if row.send_seconds is not None]),
+            'avg_queue_seconds': average([(row.sent_at - row.created_at).total_seconds()
+                                          for row in sent if row.created_at is not None])
+        }
+
+    def start(self, app):
+        """启动后台发送线程"""
+        if self.running:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, args=(app,), name='outbox-sender', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, app):
+        from app import db
+
+        while not self._stopping:
+            sent = 0
+            with app.app_context():
+                try:
+                    sent = self.flush()
+                except Exception as e:
+                    print(f"处理发件箱失败: {str(e)}")
+                finally:
+                    db.session.remove()
+            # 整批发送完后可能还有积压，立即继续
+            if sent >= self.batch_size:
+                continue
+            with self._cond:
+                if not self._stopping:
+                    self._cond.wait(self.poll_seconds)
+
+
+outbox_sender = OutboxSender()
@@ -0,0 +1,97 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+class PasswordHasherBusy(Exception):
+    """密码哈希线程池的等待队列已满"""
+
+class PasswordHasher:
+    """在有界线程池中执行密码哈希和校验
+
+    PBKDF2 计算期间会释放 GIL，PASSWORD_HASH_WORKERS 个线程（默认为 CPU 核数）
+    可以占满所有核心，同时避免登录高峰时大量请求线程同时抢占 CPU。正在计算和
+    排队的任务超过 workers + PASSWORD_HASH_QUEUE_LIMIT 时立即抛出
+    PasswordHasherBusy，由调用方返回"繁忙，请重试"。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._prefix = None
+        self.method = 'pbkdf2:sha256:260000'
+        self.workers = os.cpu_count() or 1
+        self.queue_limit = 32
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    def init_app(self, app):
+        with self._lock:
+            self.method = app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+            self.workers = app.config.get('PASSWORD_HASH_WORKERS') or os.cpu_count() or 1
+            self.queue_limit = app.config.get('PASSWORD_HASH_QUEUE_LIMIT', 32)
+            self._prefix = None
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def _run(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.workers + self.queue_limit:
+                self.rejected += 1
+                raise PasswordHasherBusy()
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+            self.pending += 1
+            future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._done)
+        return future.result()
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+
+    def hash(self, password):
+        """按当前配置的算法和强度生成密码哈希"""
+        return self._run(generate_password_hash, password, self.method)
+
+    def needs_rehash(self, password_hash):
+        """已存储的哈希是否使用了与当前配置不同的算法或强度"""
+        if self._prefix is None:
+            # 由 werkzeug 补全省略的迭代次数等参数
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._prefix
+
+    def verify(self, password_hash, password):
+        """校验密码，返回 (是否正确, 新哈希)
+
+        密码正确且存储的哈希强度与当前配置不一致时，在同一个任务中生成新哈希，
+        否则新哈希为 None。
+        """
+        return self._run(self._verify, password_hash, password)
+
+    def _verify(self, password_hash, password):
+        if not password_hash or not check_password_hash(password_hash, password):
+            return False, None
+        if not self.needs_rehash(password_hash):
+            return True, None
+        with self._lock:
+            self.rehashed += 1
+        return True, generate_password_hash(password, self.method)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'method': self.method,
+                'workers': self.workers,
+                'pending': self.pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'rehashed': self.rehashed
+            }
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,109 @@
+from app import db
+from app.models import Booking, BookingSlot, Seat
+from app.utils.booking_service import slot_starts, slot_rows, bookings_created
+from app.utils.lottery import blocked_days
+from flask import current_app
+from sqlalchemy import insert, or_
+from sqlalchemy.exc import IntegrityError, OperationalError
+from datetime import datetime, timedelta
+
+WEEKDAY_NAMES = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+
+def occurrence_dates(start_date, end_date, weekdays):
+    """[start_date, end_date] 内星期几（0 为周一）在 weekdays 中的日期"""
+    weekdays = set(weekdays)
+    dates = []
+    current = start_date
+    while current <= end_date:
+        if current.weekday() in weekdays:
+            dates.append(current)
+        current += timedelta(days=1)
+    return dates
+
+def _check(user_id, seat_id, occurrences, now):
+    """用一次查询检查所有日期的座位和用户冲突，返回 {日期: 错误信息}"""
+    slots = {day: slot_starts(start_time, end_time) for day, start_time, end_time in occurrences}
+    seat_slots = set()
+    user_slots = set()
+    all_slots = sorted({slot for starts in slots.values() for slot in starts})
+    for taken_seat, taken_user, slot_start in db.session.query(
+        BookingSlot.seat_id, BookingSlot.user_id, BookingSlot.slot_start
+    ).filter(
+        BookingSlot.slot_start.in_(all_slots),
+        or_(BookingSlot.seat_id == seat_id, BookingSlot.user_id == user_id)
+    ):
+        if taken_seat == seat_id:
+            seat_slots.add(slot_start)
+        if taken_user == user_id:
+            user_slots.add(slot_start)
+
+    blocked = blocked_days([start_time.date() for _, start_time, _ in occurrences], now)
+    failures = {}
+    for day, start_time, _ in occurrences:
+        if start_time < now:
+            failures[day] = '开始时间已过'
+        elif start_time.date() in blocked:
+            failures[day] = '该日期的座位通过抽签分配'
+        elif any(slot in seat_slots for slot in slots[day]):
+            failures[day] = '该座位在选择的时间段已被预约'
+        elif any(slot in user_slots for slot in slots[day]):
+            failures[day] = '您在选择的时间段内已有其他预约'
+    return failures
+
+def create_recurring_bookings(user_id, seat_id, start_date, end_date, weekdays, start_hour, duration,
+                              all_or_nothing=True, now=None):
+    """按周期创建同一座位同一时段的多次预约，返回 (创建的预约列表, 失败列表)
+
+    失败列表的元素为 (日期, 错误信息)；日期为 None 表示整个请求无效。所有日期
+    的冲突由一次集合查询检查，通过的预约在一个事务中插入。all_or_nothing 为
+    True 时任何一个日期失败都不创建预约；否则只跳过失败的日期。
+    """
+    if now is None:
+        now = datetime.now()
+    max_hours = current_app.config.get('MAX_BOOKING_HOURS', 4)
+    if duration < 1 or duration > max_hours:
+        return [], [(None, f'单次预约时长应为1到{max_hours}小时')]
+    if not 0 <= start_hour <= 23 or start_hour + duration > 24:
+        return [], [(None, '预约时间段不能跨天')]
+    if not weekdays:
+        return [], [(None, '请至少选择一个星期')]
+
+    seat = db.session.get(Seat, seat_id)
+    if seat is None or not seat.is_active or not seat.room.is_active:
+        return [], [(None, '座位不存在或已停用')]
+
+    dates = occurrence_dates(start_date, end_date, weekdays)
+    if not dates:
+        return [], [(None, '日期范围内没有符合条件的日期')]
+    limit = current_app.config.get('RECURRING_MAX_OCCURRENCES', 120)
+    if len(dates) > limit:
+        return [], [(None, f'一次最多预约{limit}次')]
+
+    occurrences = []
+    for day in dates:
+        start_time = datetime.combine(day, datetime.min.time().replace(hour=start_hour))
+        occurrences.append((day, start_time, start_time + timedelta(hours=duration)))
+
+    # 检查与插入之间其他请求抢先写入时唯一约束会报错，重新检查一次
+    for attempt in range(2):
+        failures = _check(user_id, seat_id, occurrences, now)
+        if failures and all_or_nothing:
+            return [], sorted(failures.items())
+        bookings = [Booking(user_id=user_id, seat_id=seat_id, start_time=start_time, end_time=end_time)
+                    for day, start_time, end_time in occurrences if day not in failures]
+        if not bookings:
+            return [], sorted(failures.items())
+        try:
+            db.session.add_all(bookings)
+            db.session.flush()
+            db.session.execute(insert(BookingSlot), [row for booking in bookings for row in slot_rows(booking)])
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            continue
+        except OperationalError:
+            db.session.rollback()
+            return [], [(None, '系统繁忙，请稍后重试')]
+        bookings_created(bookings)
+        return bookings, sorted(failures.items())
+    return [], [(None, '预约冲突，请重试')]
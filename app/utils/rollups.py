@@ -0,0 +1,116 @@
+from app import db
+from app.models import Booking, Seat, StudyRoom, RoomUsageHourly, RollupWatermark
+from app.utils.archive import all_bookings
+from sqlalchemy import insert
+from datetime import datetime, timedelta
+
+WATERMARK = 'room_usage_hourly'
+
+# 与水位线重叠的时间，覆盖刷新期间尚未提交的事务
+OVERLAP = timedelta(seconds=60)
+
+def _aggregate(query):
+    """将 (room_id, start_time, end_time, status, checkin_time) 汇总为按小时的统计行"""
+    totals = {}
+    for room_id, start_time, end_time, status, checkin_time in query.yield_per(1000):
+        hour = start_time.replace(minute=0, second=0, microsecond=0)
+        row = totals.get((room_id, hour, status))
+        if row is None:
+            row = totals[(room_id, hour, status)] = {
+                'room_id': room_id, 'hour': hour, 'status': status,
+                'booking_count': 0, 'booked_seat_hours': 0.0, 'checked_in_seat_hours': 0.0
+            }
+        row['booking_count'] += 1
+        row['booked_seat_hours'] += (end_time - start_time).total_seconds() / 3600
+        if checkin_time and status in ('checked_in', 'completed'):
+            used_from = max(start_time, checkin_time)
+            row['checked_in_seat_hours'] += max(0, (end_time - used_from).total_seconds()) / 3600
+    return list(totals.values())
+
+def _booking_rows(bookings):
+    return db.session.query(
+        Seat.room_id, bookings.c.start_time, bookings.c.end_time, bookings.c.status, bookings.c.checkin_time
+    ).join(Seat, Seat.id == bookings.c.seat_id)
+
+def _set_watermark(value):
+    watermark = db.session.get(RollupWatermark, WATERMARK)
+    if watermark is None:
+        db.session.add(RollupWatermark(name=WATERMARK, value=value))
+    else:
+        watermark.value = value
+
+def rollup_days(days):
+    """重新计算若干天（按预约开始日期）的小时汇总，调用方负责提交"""
+    for day in sorted(days):
+        day_start = datetime.combine(day, datetime.min.time())
+        day_end = day_start + timedelta(days=1)
+        RoomUsageHourly.query.filter(
+            RoomUsageHourly.hour >= day_start,
+            RoomUsageHourly.hour < day_end
+        ).delete(synchronize_session=False)
+        bookings = all_bookings()
+        rows = _aggregate(_booking_rows(bookings).filter(
+            bookings.c.start_time >= day_start,
+            bookings.c.start_time < day_end
+        ))
+        if rows:
+            db.session.execute(insert(RoomUsageHourly), rows)
+
+def refresh_usage_rollups(now=None):
+    """增量刷新使用汇总，返回重新计算的天数
+
+    自上次刷新以来有更新（updated_at 变化）的预约所在的日期会整天重算，
+    因此无论预约由哪条路径写入或批量更新，汇总都能保持一致。
+    """
+    if now is None:
+        now = datetime.now()
+    watermark = db.session.get(RollupWatermark, WATERMARK)
+    if watermark is None:
+        rebuild_usage_rollups(now)
+        return None
+
+    changed = db.session.query(db.func.date(Booking.start_time)).filter(
+        Booking.updated_at >= watermark.value - OVERLAP
+    ).distinct().all()
+    days = {datetime.fromisoformat(str(day)).date() for (day,) in changed}
+    rollup_days(days)
+    watermark.value = now
+    db.session.commit()
+    return len(days)
+
+def rebuild_usage_rollups(now=None):
+    """根据全部历史预约（包括已归档的）重建使用汇总，返回汇总行数"""
+    if now is None:
+        now = datetime.now()
+    RoomUsageHourly.query.delete(synchronize_session=False)
+    rows = _aggregate(_booking_rows(all_bookings()))
+    if rows:
+        db.session.execute(insert(RoomUsageHourly), rows)
+    _set_watermark(now)
+    db.session.commit()
+    return len(rows)
+
+def usage_summary(start_time, end_time=None):
+    """从汇总表读取时间段内的统计，返回 (各状态预约数, 各自习室使用情况)
+
+    各自习室使用情况为 (自习室名称, 预约数, 预约座位小时, 签到座位小时) 列表，按预约数降序。
+    """
+    filters = [RoomUsageHourly.hour >= start_time]
+    if end_time is not None:
+        filters.append(RoomUsageHourly.hour < end_time)
+
+    status_counts = db.session.query(
+        RoomUsageHourly.status,
+        db.func.sum(RoomUsageHourly.booking_count)
+    ).filter(*filters).group_by(RoomUsageHourly.status).all()
+
+    booking_count = db.func.sum(RoomUsageHourly.booking_count)
+    room_usage = db.session.query(
+        StudyRoom.name,
+        booking_count,
+        db.func.sum(RoomUsageHourly.booked_seat_hours),
+        db.func.sum(RoomUsageHourly.checked_in_seat_hours)
+    ).join(StudyRoom, StudyRoom.id == RoomUsageHourly.room_id
+    ).filter(*filters).group_by(StudyRoom.name).order_by(booking_count.desc()).all()
+
+    return {status: count for status, count in status_counts}, room_usage
@@ -0,0 +1,145 @@
+import csv
+import os
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+from app import db
+from app.models import User
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+# 集合查询时每条 IN 语句携带的参数个数
+LOOKUP_CHUNK = 500
+
+def _text(row, key):
+    value = row.get(key)
+    return '' if value is None else str(value).strip()
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _existing(column, values):
+    """分块查询已存在的学号或邮箱，返回 {值: (学号, 邮箱)}"""
+    found = {}
+    for chunk in _chunks(values, LOOKUP_CHUNK):
+        for student_id, email in db.session.query(User.student_id, User.email).filter(column.in_(chunk)):
+            found[student_id if column is User.student_id else email] = (student_id, email)
+    return found
+
+def plan_roster(rows):
+    """校验花名册，返回 (待创建的学生, 已存在而跳过的人数, 错误列表)
+
+    rows 通常由 read_rows 从 CSV/JSON 花名册读取，列包括 student_id、username
+    （或 name）、email 和可选的 password，未提供 password 的学生会生成随机初始密码。
+    学号和邮箱的唯一性分别用分块的集合查询检查，不逐行查询数据库。学号和邮箱
+    都与已有账号一致的行视为之前已导入（例如中断后重新执行），直接跳过。
+    """
+    students = []
+    errors = []
+    seen_ids = set()
+    seen_emails = set()
+    for line, row in enumerate(rows, start=1):
+        row_errors = []
+        student = {
+            'line': line,
+            'student_id': _text(row, 'student_id'),
+            'username': _text(row, 'username') or _text(row, 'name'),
+            'email': _text(row, 'email'),
+            'password': _text(row, 'password')
+        }
+        if not student['student_id']:
+            row_errors.append('缺少学号')
+        elif len(student['student_id']) > 20:
+            row_errors.append('学号不能超过20个字符')
+        elif student['student_id'] in seen_ids:
+            row_errors.append(f'学号 {student["student_id"]} 重复')
+        if not student['username']:
+            row_errors.append('缺少用户名')
+        elif len(student['username']) > 64:
+            row_errors.append('用户名不能超过64个字符')
+        email = student['email']
+        if not email or ('@fudan.edu.cn' not in email and '@m.fudan.edu.cn' not in email):
+            row_errors.append('需要有效的复旦大学邮箱')
+        elif len(email) > 120:
+            row_errors.append('邮箱不能超过120个字符')
+        elif email in seen_emails:
+            row_errors.append(f'邮箱 {email} 重复')
+        seen_ids.add(student['student_id'])
+        seen_emails.add(email)
+
+        if row_errors:
+            errors.extend((line, message) for message in row_errors)
+        else:
+            students.append(student)
+
+    by_id = _existing(User.student_id, [student['student_id'] for student in students])
+    by_email = _existing(User.email, [student['email'] for student in students])
+    new_students = []
+    skipped = 0
+    for student in students:
+        account = by_id.get(student['student_id'])
+        if account == (student['student_id'], student['email']):
+            skipped += 1
+        elif account is not None:
+            errors.append((student['line'], f'学号 {student["student_id"]} 已注册，邮箱为 {account[1]}'))
+        elif student['email'] in by_email:
+            errors.append((student['line'], f'邮箱 {student["email"]} 已被学号 {by_email[student["email"]][0]} 使用'))
+        else:
+            new_students.append(student)
+    errors.sort()
+    return new_students, skipped, errors
+
+def import_roster(rows, workers=None, batch_size=1000, method=None, credentials=None):
+    """批量创建学生账号，返回 (创建数, 跳过数, 错误列表)
+
+    有任何错误时不写入任何数据。初始密码在进程池中哈希，method 默认使用
+    PASSWORD_HASH_METHOD；使用较低的强度可以加快导入，学生首次登录时哈希
+    会自动升级到当前配置。每 batch_size 个账号批量插入并提交一次，中断后
+    重新执行会跳过已导入的学生，从中断处继续。
+
+    生成的随机初始密码以 CSV（student_id,password）追加写入 credentials，
+    写入在对应批次提交之前完成，因此不会出现已创建却没有记录密码的账号。
+    """
+    from app.utils.passwords import password_hasher
+    from app.utils.dashboard import dashboard_counters
+
+    students, skipped, errors = plan_roster(rows)
+    if credentials is None and any(not student['password'] for student in students):
+        errors.append((0, '花名册中有学生没有密码，需要指定初始密码的输出文件'))
+    if errors or not students:
+        return 0, skipped, errors
+
+    workers = workers or os.cpu_count() or 1
+    hash_password = partial(generate_password_hash, method=method or password_hasher.method)
+    writer = csv.writer(credentials) if credentials is not None else None
+    created = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+        for batch in _chunks(students, batch_size):
+            generated = {}
+            passwords = []
+            for student in batch:
+                password = student['password']
+                if not password:
+                    password = generated[student['student_id']] = secrets.token_urlsafe(9)
+                passwords.append(password)
+            chunksize = max(1, len(batch) // (workers * 4))
+            hashes = list(pool.map(hash_password, passwords, chunksize=chunksize))
+
+            if generated:
+                writer.writerows(generated.items())
+                credentials.flush()
+            db.session.execute(insert(User), [{
+                'student_id': student['student_id'],
+                'username': student['username'],
+                'email': student['email'],
+                'password_hash': password_hash,
+                'is_admin': False,
+                'violation_count': 0
+            } for student, password_hash in zip(batch, hashes)])
+            db.session.commit()
+            created += len(batch)
+
+    dashboard_counters.invalidate()
+    return created, skipped, []
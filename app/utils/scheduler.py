@@ -1,95 +1,215 @@
-from app import scheduler, db, mail
-from app.models import Booking, User
-from flask_mail import Message
+from app import scheduler, db
+from app.models import Booking, BookingSlot, BookingNotification, User, LotteryEntry
+from app.utils.occupancy import occupancy_index
+from app.utils.deadlines import deadline_scheduler, REMINDER, LATE_WARNING, EXPIRY, COMPLETION
+from app.utils.outbox import outbox_sender
+from app.utils.leader import leader_election
+from app.utils.user_cache import user_cache
+from sqlalchemy import update, case
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload
+from collections import Counter
 from datetime import datetime, timedelta
 from flask import current_app, render_template
 
 def init_scheduler(app):
-    """初始化调度器任务"""
+    """初始化调度器任务
+
+    多进程部署时只有通过租约选举出的主节点运行定时任务、截止事件调度器
+    和发件箱发送器，主节点退出后由其他进程自动接管。
+    """
+    deadline_scheduler.init_app(app)
+    outbox_sender.init_app(app)
+    leader_election.init_app(app)
+    leader_election.start(app, lambda: start_jobs(app), stop_jobs)
+
+def start_jobs(app):
+    """成为主节点后启动所有后台任务"""
     with app.app_context():
-        # 检查预约是否需要提醒
+        # 每天凌晨生成新的签到码
         scheduler.add_job(
-            id='check_upcoming_bookings',
-            func=check_upcoming_bookings,
-            trigger='interval',
-            minutes=5,
+            id='generate_daily_codes',
+            func=generate_daily_codes,
+            trigger='cron',
+            hour=0,
+            minute=0,
             replace_existing=True
         )
         
-        # 检查未签到的预约
+        # 每天凌晨将旧预约移入归档表
         scheduler.add_job(
-            id='check_unchecked_bookings',
-            func=check_unchecked_bookings,
-            trigger='interval',
-            minutes=5,
+            id='archive_bookings',
+            func=run_archival,
+            args=[app],
+            trigger='cron',
+            hour=3,
+            minute=0,
             replace_existing=True
         )
         
-        # 每天凌晨生成新的签到码
+        # 抽签志愿提交截止时统一分配次日座位
         scheduler.add_job(
-            id='generate_daily_codes',
-            func=generate_daily_codes,
+            id='allocate_lottery',
+            func=run_lottery,
+            args=[app],
             trigger='cron',
-            hour=0,
+            hour=app.config.get('LOTTERY_CLOSE_HOUR', 8),
             minute=0,
             replace_existing=True
         )
         
-        # 完成已结束的预约
+        # 每小时清理过期的幂等键
         scheduler.add_job(
-            id='complete_finished_bookings',
-            func=complete_finished_bookings,
+            id='purge_idempotency_keys',
+            func=run_idempotency_purge,
+            args=[app],
             trigger='interval',
-            minutes=10,
+            hours=1,
             replace_existing=True
         )
         
-def check_upcoming_bookings():
-    """检查即将开始的预约并发送提醒"""
-    now = datetime.now()
+        # 每小时清理过期的预约票据结果
+        scheduler.add_job(
+            id='purge_admission_tickets',
+            func=run_admission_ticket_purge,
+            args=[app],
+            trigger='interval',
+            hours=1,
+            replace_existing=True
+        )
+        
+        # 定期增量刷新使用统计汇总表
+        scheduler.add_job(
+            id='refresh_usage_rollups',
+            func=run_usage_rollups,
+            args=[app],
+            trigger='interval',
+            seconds=app.config.get('ROLLUP_REFRESH_SECONDS', 60),
+            replace_existing=True
+        )
+    
+    if scheduler.running:
+        scheduler.resume()
+    else:
+        scheduler.start()
     
-    # 查找15分钟内即将开始的预约
-    upcoming_bookings = Booking.query.filter(
+    # 提醒、过期和完成由截止事件调度器在到期时触发，不再定时轮询
+    deadline_scheduler.start(app, {
+        REMINDER: send_upcoming_reminders,
+        LATE_WARNING: send_late_warnings,
+        EXPIRY: expire_and_notify,
+        COMPLETION: complete_finished_bookings
+    })
+    
+    # 邮件由发件箱后台线程批量发送，不阻塞调度任务
+    outbox_sender.start(app)
+
+def stop_jobs():
+    """失去主节点身份后停止所有后台任务"""
+    if scheduler.running:
+        scheduler.pause()
+    deadline_scheduler.stop()
+    outbox_sender.stop()
+
+def unnotified(kind):
+    """尚未发送过该类通知的预约条件，利用通知记录表的主键索引"""
+    return ~BookingNotification.query.filter(
+        BookingNotification.booking_id == Booking.id,
+        BookingNotification.kind == kind
+    ).exists()
+
+def claim_notifications(booking_ids, kind):
+    """登记通知记录，返回本次成功登记（即尚未发送过）的预约ID
+
+    已存在的记录被忽略，多个进程同时处理同一预约时只有一个能登记成功。
+    """
+    if not booking_ids:
+        return set()
+    claimed = db.session.execute(
+        sqlite_insert(BookingNotification).values([
+            {'booking_id': booking_id, 'kind': kind, 'sent_at': datetime.now()}
+            for booking_id in booking_ids
+        ]).on_conflict_do_nothing().returning(BookingNotification.booking_id)
+    ).scalars().all()
+    return set(claimed)
+
+def send_upcoming_reminders(booking_ids, now):
+    """向即将开始的预约发送提醒，每个预约只发送一次"""
+    upcoming_bookings = Booking.query.options(joinedload(Booking.user)).filter(
+        Booking.id.in_(booking_ids),
         Booking.start_time > now,
-        Booking.start_time <= now + timedelta(minutes=15),
-        Booking.status == 'confirmed'
+        Booking.status == 'confirmed',
+        unnotified('reminder')
     ).all()
     
+    claimed = claim_notifications([booking.id for booking in upcoming_bookings], 'reminder')
     for booking in upcoming_bookings:
-        # 发送邮件提醒
-        send_reminder_email(booking, '预约即将开始', '您预约的自习座位即将开始，请提前到达并签到。')
+        if booking.id in claimed:
+            send_reminder_email(booking, '预约即将开始', '您预约的自习座位即将开始，请提前到达并签到。', commit=False)
+    commit_outbox()
 
-def check_unchecked_bookings():
-    """检查未签到的预约"""
-    now = datetime.now()
-    
-    # 查找已开始10分钟但未签到的预约
-    late_bookings = Booking.query.filter(
-        Booking.start_time < now,
+def send_late_warnings(booking_ids, now):
+    """向已开始10分钟但未签到的预约发送提醒，每个预约只发送一次"""
+    late_bookings = Booking.query.options(joinedload(Booking.user)).filter(
+        Booking.id.in_(booking_ids),
         Booking.start_time > now - timedelta(minutes=15),
-        Booking.start_time <= now - timedelta(minutes=10),
-        Booking.status == 'confirmed'
+        Booking.status == 'confirmed',
+        unnotified('late_warning')
     ).all()
     
+    claimed = claim_notifications([booking.id for booking in late_bookings], 'late_warning')
     for booking in late_bookings:
-        # 发送提醒邮件
-        send_reminder_email(booking, '签到提醒', '您的预约已开始，请尽快到达自习室并签到，否则预约将在5分钟后自动取消。')
+        if booking.id in claimed:
+            send_reminder_email(booking, '签到提醒', '您的预约已开始，请尽快到达自习室并签到，否则预约将在5分钟后自动取消。', commit=False)
+    commit_outbox()
+
+def expire_and_notify(booking_ids=None, now=None):
+    """过期超时未签到的预约，提交后再发送取消通知"""
+    for booking in expire_overdue_bookings(now):
+        send_reminder_email(booking, '预约已取消', '由于您未按时签到，您的座位预约已自动取消。这将记录为一次违约。', commit=False)
+    commit_outbox()
+
+def expire_overdue_bookings(now=None):
+    """批量将超过15分钟未签到的预约标记为过期并记录违约
+
+    一条 UPDATE ... RETURNING 修改预约状态，一条分组 UPDATE 累加各用户的
+    违约次数，并释放对应的时间槽，全部在同一事务中完成。
+    返回需要发送通知的预约列表（已预加载用户）。
+    """
+    if now is None:
+        now = datetime.now()
     
-    # 查找超过15分钟未签到的预约
-    expired_bookings = Booking.query.filter(
-        Booking.start_time < now - timedelta(minutes=15),
-        Booking.status == 'confirmed'
+    expired = db.session.execute(
+        update(Booking).where(
+            Booking.start_time <= now - timedelta(minutes=15),
+            Booking.status == 'confirmed'
+        ).values(status='expired').returning(
+            Booking.id, Booking.user_id, Booking.seat_id, Booking.start_time, Booking.end_time
+        ),
+        execution_options={'synchronize_session': False}
     ).all()
     
-    for booking in expired_bookings:
-        # 标记为过期并记录违约
-        booking.expire()
-        
-        user = User.query.get(booking.user_id)
-        user.add_violation()
-        
-        # 发送取消通知
-        send_reminder_email(booking, '预约已取消', '由于您未按时签到，您的座位预约已自动取消。这将记录为一次违约。')
+    if not expired:
+        db.session.commit()
+        return []
+    
+    booking_ids = [row.id for row in expired]
+    violations = Counter(row.user_id for row in expired)
+    
+    db.session.execute(
+        update(User).where(User.id.in_(violations)).values(
+            violation_count=db.func.coalesce(User.violation_count, 0) + case(violations, value=User.id)
+        ),
+        execution_options={'synchronize_session': False}
+    )
+    BookingSlot.query.filter(BookingSlot.booking_id.in_(booking_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    user_cache.invalidate(violations)
+    
+    for row in expired:
+        occupancy_index.remove(row.seat_id, row.start_time, row.end_time)
+    
+    return Booking.query.options(joinedload(Booking.user)).filter(Booking.id.in_(booking_ids)).all()
 
 def generate_daily_codes():
     """每日生成新的签到验证码"""
@@ -100,36 +220,119 @@ def generate_daily_codes():
     for room in rooms:
         generate_verify_code(room)
 
-def complete_finished_bookings():
-    """完成已结束的预约"""
-    now = datetime.now()
+def run_usage_rollups(app):
+    """增量刷新使用统计汇总表"""
+    from app.utils.rollups import refresh_usage_rollups
+    
+    with app.app_context():
+        try:
+            refresh_usage_rollups()
+        except Exception as e:
+            print(f"刷新使用统计汇总失败: {str(e)}")
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+def run_archival(app):
+    """将超过保留期的已结束预约移入归档表"""
+    from app.utils.archive import archive_bookings
     
-    # 查找已结束的预约
-    finished_bookings = Booking.query.filter(
-        Booking.end_time < now,
-        Booking.status == 'checked_in'
+    with app.app_context():
+        try:
+            archive_bookings()
+        except Exception as e:
+            print(f"归档预约失败: {str(e)}")
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+def run_lottery(app):
+    """抽签模式下为次日分配座位，之前分配失败仍有待分配志愿的日期一并补做"""
+    from app.utils.lottery import lottery_enabled, lottery_day, allocate_lottery
+    
+    with app.app_context():
+        try:
+            if lottery_enabled():
+                day = lottery_day()
+                missed = {missed_day for missed_day, in db.session.query(LotteryEntry.day).filter(
+                    LotteryEntry.day < day, LotteryEntry.status == 'pending').distinct()}
+                for missed_day in sorted(missed) + [day]:
+                    allocate_lottery(missed_day)
+        except Exception as e:
+            print(f"抽签分配失败: {str(e)}")
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+def run_idempotency_purge(app):
+    """删除过期的幂等键"""
+    from app.utils.idempotency import idempotency_store
+    
+    with app.app_context():
+        try:
+            idempotency_store.purge()
+        except Exception as e:
+            print(f"清理幂等键失败: {str(e)}")
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+def run_admission_ticket_purge(app):
+    """删除过期的预约票据结果"""
+    from app.utils.admission import booking_admission
+    
+    with app.app_context():
+        try:
+            booking_admission.purge()
+        except Exception as e:
+            print(f"清理预约票据失败: {str(e)}")
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+def complete_finished_bookings(booking_ids=None, now=None):
+    """批量完成已结束的已签到预约并释放时间槽"""
+    if now is None:
+        now = datetime.now()
+    
+    finished = db.session.execute(
+        update(Booking).where(
+            Booking.end_time <= now,
+            Booking.status == 'checked_in'
+        ).values(status='completed').returning(
+            Booking.id, Booking.seat_id, Booking.start_time, Booking.end_time
+        ),
+        execution_options={'synchronize_session': False}
     ).all()
     
-    for booking in finished_bookings:
-        booking.complete()
+    if finished:
+        BookingSlot.query.filter(
+            BookingSlot.booking_id.in_([row.id for row in finished])
+        ).delete(synchronize_session=False)
+    db.session.commit()
+    
+    for row in finished:
+        occupancy_index.remove(row.seat_id, row.start_time, row.end_time)
+
+def commit_outbox():
+    """提交批量写入发件箱的邮件并唤醒发送线程"""
+    db.session.commit()
+    outbox_sender.wake()
 
-def send_reminder_email(booking, subject, message):
-    """发送提醒邮件"""
+def send_reminder_email(booking, subject, message, commit=True):
+    """将提醒邮件写入发件箱，由后台发送器异步发送"""
     user = User.query.get(booking.user_id)
     
     if not user or not user.email:
         return
         
-    msg = Message(
+    outbox_sender.enqueue(
+        recipient=user.email,
         subject=f'[复旦自习室] {subject}',
-        recipients=[user.email],
         html=render_template('emails/reminder.html',
                            user=user,
                            booking=booking,
-                           message=message)
+                           message=message,
+                           now=datetime.now),
+        commit=commit
     )
-    
-    try:
-        mail.send(msg)
-    except Exception as e:
-        print(f"发送邮件失败: {str(e)}") 
\ No newline at end of file
@@ -0,0 +1,87 @@
+from app import db
+from app.models import Booking, Seat, ArchivedBooking, OutboxEmail
+from app.utils.booking_service import backfill_slots
+from sqlalchemy import inspect, text, func
+from sqlalchemy.schema import CreateTable
+
+# 已有表上新增的列，旧数据库需要补建（新增列均可为空）
+NEW_COLUMNS = [
+    (Booking, ['updated_at']),  # 增量刷新使用汇总
+    (Seat, ['pos_x', 'pos_y']),  # 平面图坐标
+    (OutboxEmail, ['send_seconds']),  # 发件箱发送耗时统计
+]
+
+def add_missing_columns(model, names):
+    """为旧数据库中缺少新增列的表补建列，返回补建的列名"""
+    table = model.__table__
+    existing = [column['name'] for column in inspect(db.engine).get_columns(table.name)]
+    missing = [name for name in names if name not in existing]
+    for name in missing:
+        column = table.c[name]
+        db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(db.engine.dialect)}'))
+    db.session.commit()
+    return missing
+
+def upgrade_booking_ids():
+    """将旧数据库的 bookings 表改为 AUTOINCREMENT，返回是否做了修改
+
+    sqlite_autoincrement 只在建表时生效。旧表中 SQLite 会复用归档后删除的
+    最大ID，新预约的ID与 bookings_archive 中的ID冲突，因此按 SQLite 推荐的
+    方式重建：建新表、复制数据、删除旧表后改名，索引由调用方补建。ID 序列
+    从热表和归档表中的最大ID继续，之后的新预约不会再使用已归档的ID。
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    table = Booking.__table__
+    sql = db.session.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                             {'name': table.name}).scalar()
+    if sql is None or 'AUTOINCREMENT' in sql.upper():
+        return False
+
+    temp = f'{table.name}_upgrade'
+    create = str(CreateTable(table).compile(db.engine)).replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {temp} ', 1)
+    names = ', '.join(column.name for column in table.columns)
+    db.session.execute(text(create))
+    db.session.execute(text(f'INSERT INTO {temp} ({names}) SELECT {names} FROM {table.name}'))
+    db.session.execute(text(f'DROP TABLE {table.name}'))
+    db.session.execute(text(f'ALTER TABLE {temp} RENAME TO {table.name}'))
+
+    last_id = max(db.session.query(func.max(Booking.id)).scalar() or 0,
+                  db.session.query(func.max(ArchivedBooking.id)).scalar() or 0)
+    db.session.execute(text('DELETE FROM sqlite_sequence WHERE name = :name'), {'name': table.name})
+    db.session.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'),
+                       {'name': table.name, 'seq': last_id})
+    db.session.commit()
+    return True
+
+def upgrade_schema():
+    """将已有数据库升级到当前模型，返回所做修改的说明列表
+
+    db.create_all() 只会创建缺少的表，不会修改已有的表，因此升级后还要
+    补建已有表上新增的列和索引。加入 booking_slots 之前的有效预约没有时间槽，
+    唯一约束无法防止与它们重叠，最后一并补建。可以重复执行，已是最新时不做
+    任何修改。
+    """
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    changes = [f'创建表 {table.name}' for table in db.metadata.sorted_tables if table.name not in tables]
+    db.create_all()
+
+    for model, names in NEW_COLUMNS:
+        changes += [f'添加列 {model.__tablename__}.{name}' for name in add_missing_columns(model, names)]
+    if upgrade_booking_ids():
+        changes.append('重建表 bookings（AUTOINCREMENT）')
+
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                changes.append(f'创建索引 {index.name}')
+
+    created, conflicts = backfill_slots()
+    if created:
+        changes.append(f'为 {created} 个预约补建时间槽')
+    changes += [f'预约 {booking_id} 与已有预约时间重叠，未补建时间槽' for booking_id in conflicts]
+    return changes
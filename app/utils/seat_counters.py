@@ -0,0 +1,89 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+class SeatCounters:
+    """首页使用的各自习室"当前空闲/有效座位"计数器
+
+    有效座位列表只在座位变动时重新加载；空闲数由占用索引计算，
+    预约变化时只重算受影响的自习室，并每隔 SEAT_COUNTER_REFRESH_SECONDS
+    秒整体刷新一次，使"未来一小时"的时间窗口随时间推进。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.refresh_seconds = 30
+        self.window = timedelta(hours=1)
+        self.reset()
+
+    def init_app(self, app):
+        from app.utils.occupancy import occupancy_index
+
+        self.refresh_seconds = app.config.get('SEAT_COUNTER_REFRESH_SECONDS', 30)
+        self.reset()
+        occupancy_index.add_listener(self.mark_changed)
+
+    def reset(self):
+        with self._lock:
+            self._room_seats = None
+            self._seat_rooms = {}
+            self._counts = {}
+            self._computed_at = None
+            self._dirty_rooms = set()
+
+    def invalidate(self):
+        """座位增删或启用状态变化后调用，下次读取时重新加载座位列表"""
+        with self._lock:
+            self._room_seats = None
+
+    def mark_changed(self, seat_id=None):
+        """预约变化时调用；seat_id 为 None 表示全部重算"""
+        with self._lock:
+            if seat_id is None:
+                self._computed_at = None
+            elif seat_id in self._seat_rooms:
+                self._dirty_rooms.add(self._seat_rooms[seat_id])
+
+    def _load_seats(self):
+        from app import db
+        from app.models import Seat
+
+        room_seats = {}
+        for seat_id, room_id in db.session.query(Seat.id, Seat.room_id).filter(Seat.is_active == True):
+            room_seats.setdefault(room_id, []).append(seat_id)
+        self._room_seats = room_seats
+        self._seat_rooms = {seat_id: room_id for room_id, seat_ids in room_seats.items() for seat_id in seat_ids}
+        self._computed_at = None
+
+    def _count_free(self, room_ids, now):
+        from app.utils.availability import find_available_seats
+        from app.utils.occupancy import occupancy_index
+
+        if occupancy_index.enabled:
+            for room_id in room_ids:
+                seat_ids = self._room_seats[room_id]
+                self._counts[room_id] = len(occupancy_index.free_seat_ids(seat_ids, now, now + self.window))
+        else:
+            free = find_available_seats(list(room_ids), now, now + self.window)
+            for room_id in room_ids:
+                self._counts[room_id] = len(free[room_id])
+
+    def snapshot(self):
+        """返回 {room_id: (空闲座位数, 有效座位数)}"""
+        now = datetime.now()
+        with self._lock:
+            if self._room_seats is None:
+                self._load_seats()
+            if self._computed_at is None or time.monotonic() - self._computed_at > self.refresh_seconds:
+                self._counts = {}
+                self._count_free(self._room_seats.keys(), now)
+                self._computed_at = time.monotonic()
+                self._dirty_rooms.clear()
+            elif self._dirty_rooms:
+                self._count_free(self._dirty_rooms, now)
+                self._dirty_rooms.clear()
+            return {room_id: (self._counts[room_id], len(seat_ids))
+                    for room_id, seat_ids in self._room_seats.items()}
+
+
+seat_counters = SeatCounters()
@@ -0,0 +1,122 @@
+from collections import Counter
+from app import db
+from app.models import StudyRoom, Seat
+from sqlalchemy import insert
+
+# 电源插座列可接受的写法
+TRUE_VALUES = {'1', 'true', 'yes', 'y', '是', '有'}
+FALSE_VALUES = {'', '0', 'false', 'no', 'n', '否', '无'}
+
+def _text(row, key):
+    value = row.get(key)
+    return '' if value is None else str(value).strip()
+
+def _parse_int(value, name, errors):
+    if value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        errors.append(f'{name} 必须是整数')
+
+def _parse_seat(row, errors):
+    seat_number = _text(row, 'seat_number')
+    if not seat_number:
+        errors.append('缺少座位号')
+    elif len(seat_number) > 10:
+        errors.append('座位号不能超过10个字符')
+
+    power = _text(row, 'has_power_outlet').lower()
+    if power not in TRUE_VALUES | FALSE_VALUES:
+        errors.append(f'无法识别的电源插座取值: {power}')
+
+    return {
+        'seat_number': seat_number,
+        'has_power_outlet': power in TRUE_VALUES,
+        'pos_x': _parse_int(_text(row, 'pos_x'), 'pos_x', errors),
+        'pos_y': _parse_int(_text(row, 'pos_y'), 'pos_y', errors),
+        'is_active': True
+    }
+
+def import_seat_rows(rows, room_id=None):
+    """批量校验并导入座位，返回 (导入的座位数, 错误列表)
+
+    rows 通常由 read_rows 从 CSV/JSON 平面图文件读取，列包括 room（未指定
+    自习室时必填）、seat_number、has_power_outlet、pos_x、pos_y，新建自习室
+    时还需 building 和 floor。
+    错误列表的元素为 (行号, 错误信息)，行号从数据的第一行算起。只要有
+    任何一行出错就不写入任何数据；全部通过时自习室和座位在同一事务中
+    批量插入，座位数超过自习室容量时容量随之调整。
+    """
+    rooms = {room.name: room for room in StudyRoom.query.all()}
+    fixed_room = db.session.get(StudyRoom, room_id) if room_id else None
+    if room_id and fixed_room is None:
+        return 0, [(0, f'自习室 {room_id} 不存在')]
+
+    existing = {}
+    for seat_room_id, seat_number in db.session.query(Seat.room_id, Seat.seat_number):
+        existing.setdefault(seat_room_id, set()).add(seat_number)
+
+    new_rooms = {}
+    seats = []
+    errors = []
+    seen = set()
+    for line, row in enumerate(rows, start=1):
+        row_errors = []
+        seat = _parse_seat(row, row_errors)
+
+        room_key = fixed_room.id if fixed_room else _text(row, 'room')
+        if not fixed_room:
+            if not room_key:
+                row_errors.append('缺少自习室名称')
+            elif room_key not in rooms and room_key not in new_rooms:
+                building = _text(row, 'building')
+                floor = _parse_int(_text(row, 'floor'), 'floor', row_errors)
+                if not building or floor is None:
+                    row_errors.append(f'自习室 {room_key} 不存在，新建时需要 building 和 floor')
+                else:
+                    new_rooms[room_key] = (building, floor)
+
+        if seat['seat_number']:
+            key = (room_key, seat['seat_number'])
+            room = fixed_room or rooms.get(room_key)
+            if key in seen or (room is not None and seat['seat_number'] in existing.get(room.id, ())):
+                row_errors.append(f'座位号 {seat["seat_number"]} 重复')
+            seen.add(key)
+
+        if row_errors:
+            errors.extend((line, message) for message in row_errors)
+        else:
+            seats.append((room_key, seat))
+
+    if errors:
+        return 0, errors
+
+    counts = Counter(room_key for room_key, _ in seats)
+    try:
+        room_ids = {fixed_room.id: fixed_room.id} if fixed_room else {name: room.id for name, room in rooms.items()}
+        for name, (building, floor) in new_rooms.items():
+            room = StudyRoom(name=name, building=building, floor=floor, capacity=counts[name])
+            db.session.add(room)
+            db.session.flush()
+            room_ids[name] = room.id
+
+        values = [dict(seat, room_id=room_ids[room_key]) for room_key, seat in seats]
+        if values:
+            db.session.execute(insert(Seat), values)
+
+        for room_key, count in counts.items():
+            if room_key in new_rooms:
+                continue
+            room = fixed_room or rooms[room_key]
+            room.capacity = max(room.capacity, len(existing.get(room.id, ())) + count)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    from app.utils.seat_counters import seat_counters
+    from app.utils.dashboard import dashboard_counters
+    seat_counters.invalidate()
+    dashboard_counters.invalidate()
+    return len(values), []
@@ -0,0 +1,88 @@
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from app.utils.cache import TTLCache
+
+# 会话中已刷新但尚未提交的用户修改
+PENDING_KEY = 'user_cache_pending'
+
+class UserCache:
+    """登录用户加载器使用的进程内用户缓存
+
+    缓存的是与任何会话都不关联的用户快照，每次请求通过 merge(load=False)
+    复制到当前会话中，因此已登录用户的请求不再需要查询 users 表。
+    本进程内通过 ORM 修改用户（资料、密码、管理员标记、违约次数等）后，
+    在事务提交时自动失效；批量 UPDATE 需要调用方显式调用 invalidate()。
+    其他进程的修改最多延迟 USER_CACHE_SECONDS 秒后可见。
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(ttl=60, maxsize=10000)
+        self._listening = False
+
+    def init_app(self, app):
+        from app import db
+
+        self._cache.ttl = app.config.get('USER_CACHE_SECONDS', 60)
+        self._cache.maxsize = app.config.get('USER_CACHE_SIZE', 10000)
+        self._cache.clear()
+        if not self._listening:
+            event.listen(db.session, 'after_flush', self._record_changes)
+            event.listen(db.session, 'after_commit', self._apply_changes)
+            event.listen(db.session, 'after_soft_rollback', self._discard_changes)
+            self._listening = True
+
+    def load(self, user_id):
+        """返回绑定到当前会话的用户，缓存未命中时查询数据库"""
+        from app import db
+        from app.models import User
+
+        snapshot = self._cache.get(user_id)
+        if snapshot is None:
+            user = db.session.get(User, user_id)
+            if user is None:
+                return None
+            self._cache.set(user_id, self._snapshot(user))
+            return user
+        return db.session.merge(snapshot, load=False)
+
+    def invalidate(self, user_ids=None):
+        """使指定用户（可迭代的 id）的缓存失效；user_ids 为 None 时全部失效"""
+        if user_ids is None:
+            self._cache.clear()
+            return
+        for user_id in user_ids:
+            self._cache.delete(user_id)
+
+    def stats(self):
+        return self._cache.stats()
+
+    @staticmethod
+    def _snapshot(user):
+        from app.models import User
+
+        mapper = User.__mapper__
+        snapshot = mapper.class_manager.new_instance()
+        for attr in mapper.column_attrs:
+            setattr(snapshot, attr.key, getattr(user, attr.key))
+        make_transient_to_detached(snapshot)
+        return snapshot
+
+    @staticmethod
+    def _record_changes(session, flush_context):
+        from app.models import User
+
+        user_ids = {obj.id for obj in list(session.dirty) + list(session.deleted) if isinstance(obj, User)}
+        if user_ids:
+            session.info.setdefault(PENDING_KEY, set()).update(user_ids)
+
+    def _apply_changes(self, session):
+        user_ids = session.info.pop(PENDING_KEY, None)
+        if user_ids:
+            self.invalidate(user_ids)
+
+    @staticmethod
+    def _discard_changes(session, previous_transaction):
+        session.info.pop(PENDING_KEY, None)
+
+
+user_cache = UserCache()
@@ -7,10 +7,81 @@ import json
 import time
 import random
 import string
+import threading
+import socketserver
+import multiprocessing
+import queue
+import re
+import html
+import io
+import csv
+import importlib.util
 from datetime import datetime, timedelta
+from sqlalchemy import insert, event
 from app import create_app, db, scheduler
 from app.models import User, StudyRoom, Seat, Booking
 
+class _SMTPStandInHandler(socketserver.StreamRequestHandler):
+    """本地测试用的简易SMTP服务器，记录收到的邮件"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost ESMTP')
+        in_data = False
+        for raw in self.rfile:
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            if in_data:
+                if line == '.':
+                    in_data = False
+                    self.server.messages.append(self.rcpt)
+                    self.reply('250 OK')
+                continue
+            command = line[:4].upper()
+            if command in ('HELO', 'EHLO'):
+                self.reply('250 localhost')
+            elif command == 'RCPT':
+                self.rcpt = line[line.index('<') + 1:line.index('>')]
+                if self.rcpt.startswith('reject'):
+                    self.reply('550 No such user')
+                else:
+                    self.reply('250 OK')
+            elif command == 'DATA':
+                in_data = True
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SMTPStandInHandler)
+        self.connections = 0
+        self.messages = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+def run_leader_candidate(name, lease_seconds, events):
+    """在子进程中参与调度器主节点选举，把角色变化写入 events"""
+    from app.utils.leader import LeaderElection
+    
+    app = create_app()
+    election = LeaderElection(name)
+    election.lease_seconds = lease_seconds
+    pid = os.getpid()
+    election.start(app, lambda: events.put(('elected', pid)), lambda: events.put(('demoted', pid)))
+    while True:
+        time.sleep(1)
+
+
 class TestStudyRoomApp(unittest.TestCase):
     """测试复旦大学自习室预约系统的功能测试类"""
 
@@ -97,6 +168,25 @@ class TestStudyRoomApp(unittest.TestCase):
         self.room_id = room.id
         self.admin_id = admin.id
     
+    def _create_user(self, prefix, login=False):
+        """创建测试用户，可选择立即登录"""
+        random_suffix = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
+        user = User(
+            student_id=f'{prefix}_{random_suffix}',
+            username=f'{prefix}用户',
+            email=f'{prefix}_{random_suffix}@fudan.edu.cn',
+            password='123456'
+        )
+        db.session.add(user)
+        db.session.commit()
+        
+        if login:
+            self.client.post('/auth/login', data={
+                'student_id': user.student_id,
+                'password': '123456'
+            })
+        return user
+    
     def test_1_register(self):
         """测试用户注册功能"""
         # 提交注册表单，注意使用随机后缀确保邮箱唯一
@@ -346,5 +436,1293 @@ class TestStudyRoomApp(unittest.TestCase):
         # 验证筛选结果不同
         self.assertNotEqual(html_with_power.count('座位'), html_all.count('座位'))
 
+    def test_9_search_excludes_booked_seats(self):
+        """测试搜索结果不包含已被预约的座位"""
+        user = self._create_user('search_booked', login=True)
+        
+        # 预约明天10点到12点的1号座位
+        seat = Seat.query.filter_by(room_id=self.room_id, seat_number='1').first()
+        tomorrow = (datetime.now() + timedelta(days=1)).date()
+        start_time = datetime.combine(tomorrow, datetime.min.time().replace(hour=10))
+        booking = Booking(
+            user_id=user.id,
+            seat_id=seat.id,
+            start_time=start_time,
+            end_time=start_time + timedelta(hours=2)
+        )
+        db.session.add(booking)
+        db.session.commit()
+        
+        from app.utils.availability import find_available_seats
+        
+        # 重叠时间段内1号座位不可用，其余9个座位可用
+        seats = find_available_seats([self.room_id], start_time + timedelta(hours=1), start_time + timedelta(hours=3))
+        seat_ids = [s['id'] for s in seats[self.room_id]]
+        self.assertNotIn(seat.id, seat_ids)
+        self.assertEqual(len(seat_ids), 9)
+        
+        # 不重叠的时间段内所有座位都可用
+        seats = find_available_seats([self.room_id], start_time + timedelta(hours=2), start_time + timedelta(hours=3))
+        self.assertEqual(len(seats[self.room_id]), 10)
+        
+        response = self.client.get(f'/student/search?date={tomorrow.isoformat()}&start_hour=11&duration=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('9个可用座位', response.get_data(as_text=True))
+
+    def test_10_occupancy_index(self):
+        """测试座位占用索引随预约和取消增量更新"""
+        from app.utils.occupancy import occupancy_index
+        
+        user = self._create_user('occupancy', login=True)
+        seat = Seat.query.filter_by(room_id=self.room_id, seat_number='2').first()
+        tomorrow = (datetime.now() + timedelta(days=1)).date()
+        start_time = datetime.combine(tomorrow, datetime.min.time().replace(hour=21))
+        
+        # 首次读取时从数据库构建索引
+        self.assertTrue(seat.is_available(start_time, start_time + timedelta(hours=4)))
+        
+        # 跨越午夜的预约同时占用两天的时间槽
+        self.client.post('/student/book', data={
+            'seat_id': seat.id,
+            'date': tomorrow.isoformat(),
+            'start_hour': 22,
+            'duration': 3
+        })
+        booking = Booking.query.filter_by(user_id=user.id).first()
+        self.assertIsNotNone(booking)
+        self.assertFalse(occupancy_index.is_free(seat.id, start_time, start_time + timedelta(hours=2)))
+        self.assertFalse(occupancy_index.is_free(seat.id, booking.end_time - timedelta(minutes=30), booking.end_time))
+        self.assertTrue(occupancy_index.is_free(seat.id, start_time, start_time + timedelta(hours=1)))
+        self.assertTrue(occupancy_index.is_free(seat.id, booking.end_time, booking.end_time + timedelta(hours=1)))
+        self.assertGreater(occupancy_index.memory_bytes(), 0)
+        
+        # 取消后座位重新可用
+        self.client.post(f'/student/cancel/{booking.id}')
+        self.assertTrue(seat.is_available(booking.start_time, booking.end_time))
+        
+        # 增量刷新不会用跨越午夜预约的部分位图覆盖昨天的完整位图
+        yesterday = datetime.combine(datetime.now().date() - timedelta(days=1), datetime.min.time())
+        other = Seat.query.filter_by(room_id=self.room_id, seat_number='5').first()
+        db.session.add_all([
+            Booking(user_id=user.id, seat_id=seat.id, start_time=yesterday.replace(hour=10),
+                    end_time=yesterday.replace(hour=12)),
+            Booking(user_id=user.id, seat_id=other.id, start_time=yesterday.replace(hour=23),
+                    end_time=yesterday + timedelta(hours=25))
+        ])
+        db.session.commit()
+        occupancy_index.rebuild()
+        occupancy_index.refresh()
+        self.assertFalse(occupancy_index.is_free(seat.id, yesterday.replace(hour=10), yesterday.replace(hour=12)))
+        self.assertFalse(occupancy_index.is_free(other.id, yesterday.replace(hour=23), yesterday + timedelta(hours=24)))
+        
+        # 其他进程的写入：只重新加载水位线之后有变化的座位
+        from sqlalchemy import update
+        db.session.execute(update(Booking).values(updated_at=datetime.now() - timedelta(hours=1)))
+        remote = Booking(user_id=user.id, seat_id=other.id, start_time=start_time, end_time=start_time + timedelta(hours=2))
+        db.session.add(remote)
+        db.session.commit()
+        occupancy_index._refreshed_at -= occupancy_index.refresh_seconds + 1
+        statements = []
+        listener = lambda *args: statements.append((args[2], args[3]))
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            self.assertFalse(occupancy_index.is_free(other.id, start_time, start_time + timedelta(hours=1)))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        loads = [params for sql, params in statements if 'bookings.start_time' in sql]
+        self.assertEqual(len(loads), 1)
+        self.assertIn(other.id, loads[0])
+        self.assertNotIn(seat.id, loads[0])
+        self.assertFalse(occupancy_index.is_free(other.id, yesterday.replace(hour=23), yesterday + timedelta(hours=24)))
+        
+        db.session.execute(update(Booking).where(Booking.id == remote.id).values(status='cancelled'))
+        db.session.commit()
+        occupancy_index._refreshed_at -= occupancy_index.refresh_seconds + 1
+        self.assertTrue(occupancy_index.is_free(other.id, start_time, start_time + timedelta(hours=1)))
+        
+        # 同步进行中时读取者不等待，直接使用现有的索引
+        occupancy_index._refreshed_at -= occupancy_index.refresh_seconds + 1
+        with occupancy_index._load_lock:
+            self.assertTrue(occupancy_index.is_free(other.id, start_time, start_time + timedelta(hours=1)))
+
+    def test_11_index_seat_counters(self):
+        """测试首页空闲座位计数器随预约变化更新"""
+        from app.utils.seat_counters import seat_counters
+        
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('10/10', response.get_data(as_text=True))
+        
+        # 预约当前时段的座位后计数立即减少
+        user = self._create_user('counter', login=True)
+        now = datetime.now()
+        self.client.post('/student/book', data={
+            'seat_id': Seat.query.filter_by(room_id=self.room_id).first().id,
+            'date': now.date().isoformat(),
+            'start_hour': now.hour,
+            'duration': 1
+        })
+        self.assertEqual(seat_counters.snapshot()[self.room_id], (9, 10))
+        self.assertIn('9/10', self.client.get('/').get_data(as_text=True))
+
+    def test_12_room_grid_api(self):
+        """测试全天座位占用矩阵API"""
+        user = self._create_user('grid')
+        seat = Seat.query.filter_by(room_id=self.room_id, seat_number='3').first()
+        tomorrow = (datetime.now() + timedelta(days=1)).date()
+        start_time = datetime.combine(tomorrow, datetime.min.time().replace(hour=10))
+        db.session.add(Booking(
+            user_id=user.id,
+            seat_id=seat.id,
+            start_time=start_time,
+            end_time=start_time + timedelta(hours=2)
+        ))
+        db.session.commit()
+        
+        response = self.client.get(f'/api/room/{self.room_id}/grid?date={tomorrow.isoformat()}')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['slots'], 96)
+        self.assertEqual(len(data['seats']), 10)
+        
+        # 10:00-12:00 对应第40到47个时间槽
+        rows = {s['id']: int.from_bytes(bytes.fromhex(s['booked']), 'little') for s in data['seats']}
+        self.assertEqual(rows[seat.id], ((1 << 8) - 1) << 40)
+        self.assertEqual(sum(1 for value in rows.values() if value), 1)
+        
+        # 日期格式错误时返回400
+        response = self.client.get(f'/api/room/{self.room_id}/grid?date=tomorrow')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.get_json())
+
+    def _create_users_bulk(self, prefix, count):
+        """批量创建测试用户（共用同一密码哈希以节省时间），返回用户ID列表"""
+        password_hash = User.query.get(self.admin_id).password_hash
+        random_suffix = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
+        db.session.execute(insert(User), [{
+            'student_id': f'{prefix}{i}_{random_suffix}',
+            'username': f'{prefix}{i}',
+            'email': f'{prefix}{i}_{random_suffix}@fudan.edu.cn',
+            'password_hash': password_hash,
+            'is_admin': False,
+            'violation_count': 0
+        } for i in range(count)])
+        db.session.commit()
+        return [user_id for (user_id,) in db.session.query(User.id).filter(
+            User.student_id.like(f'{prefix}%_{random_suffix}')
+        ).order_by(User.id)]
+    
+    def _run_concurrently(self, targets):
+        """在多个线程中同时执行 targets，返回各自的结果"""
+        from app.utils.booking_service import create_booking
+        
+        barrier = threading.Barrier(len(targets))
+        results = [None] * len(targets)
+        
+        def worker(index, user_id, seat_id, start_time, end_time):
+            with self.app.app_context():
+                barrier.wait()
+                booking, error = create_booking(user_id, seat_id, start_time, end_time)
+                results[index] = booking.id if booking else error
+                db.session.remove()
+        
+        threads = [threading.Thread(target=worker, args=(i,) + target) for i, target in enumerate(targets)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+    
+    def test_13_concurrent_booking_single_winner(self):
+        """并发压力测试：数百个请求同时预约同一座位，只有一个成功"""
+        seat = Seat.query.filter_by(room_id=self.room_id, seat_number='4').first()
+        tomorrow = (datetime.now() + timedelta(days=1)).date()
+        start_time = datetime.combine(tomorrow, datetime.min.time().replace(hour=8))
+        
+        user_ids = self._create_users_bulk('race', 200)
+        # 时间段部分重叠的请求也必须互斥
+        targets = [(user_id, seat.id, start_time + timedelta(hours=i % 2), start_time + timedelta(hours=2 + i % 2))
+                   for i, user_id in enumerate(user_ids)]
+        results = self._run_concurrently(targets)
+        
+        winners = [result for result in results if isinstance(result, int)]
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(Booking.query.filter_by(seat_id=seat.id).count(), 1)
+        
+        # 同一用户同时预约多个座位，也只有一个成功
+        seats = Seat.query.filter(Seat.room_id == self.room_id, Seat.id != seat.id).all()
+        user_id = user_ids[0]
+        other_start = start_time + timedelta(hours=6)
+        results = self._run_concurrently([(user_id, s.id, other_start, other_start + timedelta(hours=1)) for s in seats])
+        self.assertEqual(len([result for result in results if isinstance(result, int)]), 1)
+        self.assertEqual(Booking.query.filter_by(user_id=user_id, start_time=other_start).count(), 1)
+
+    def test_14_batch_expire_overdue_bookings(self):
+        """测试批量标记超时未签到的预约并记录违约"""
+        from app.utils.booking_service import create_booking
+        from app.utils.scheduler import expire_overdue_bookings
+        
+        first = self._create_user('expire_a')
+        second = self._create_user('expire_b')
+        seats = Seat.query.filter_by(room_id=self.room_id).limit(3).all()
+        start_time = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+        
+        create_booking(first.id, seats[0].id, start_time, start_time + timedelta(hours=2))
+        create_booking(first.id, seats[1].id, start_time - timedelta(hours=2), start_time - timedelta(hours=1))
+        create_booking(second.id, seats[2].id, start_time, start_time + timedelta(hours=2))
+        # 已签到和尚未开始的预约不受影响
+        checked_in, _ = create_booking(second.id, seats[0].id, start_time - timedelta(hours=3), start_time - timedelta(hours=2))
+        checked_in.check_in()
+        upcoming, _ = create_booking(second.id, seats[1].id, start_time + timedelta(hours=3), start_time + timedelta(hours=4))
+        
+        notifications = expire_overdue_bookings()
+        
+        self.assertEqual(len(notifications), 3)
+        self.assertTrue(all(booking.status == 'expired' for booking in notifications))
+        self.assertEqual(User.query.get(first.id).violation_count, 2)
+        self.assertEqual(User.query.get(second.id).violation_count, 1)
+        self.assertEqual(Booking.query.get(checked_in.id).status, 'checked_in')
+        self.assertEqual(Booking.query.get(upcoming.id).status, 'confirmed')
+        
+        # 过期预约释放时间槽，座位可以重新预约
+        self.assertTrue(seats[2].is_available(start_time, start_time + timedelta(hours=2)))
+        booking, error = create_booking(first.id, seats[2].id, start_time + timedelta(hours=1), start_time + timedelta(hours=2))
+        self.assertIsNone(error)
+        self.assertEqual(expire_overdue_bookings(start_time), [])
+
+    def test_15_deadline_scheduler_events(self):
+        """测试截止事件调度器按到期时间触发各类事件"""
+        from app.utils.booking_service import create_booking
+        from app.utils.deadlines import DeadlineScheduler, REMINDER, LATE_WARNING, EXPIRY, COMPLETION
+        
+        fired = []
+        record = lambda kind: lambda booking_ids, now: fired.append((kind, sorted(booking_ids)))
+        deadlines = DeadlineScheduler({kind: record(kind) for kind in (REMINDER, LATE_WARNING, EXPIRY, COMPLETION)})
+        
+        user = self._create_user('deadline')
+        seat = Seat.query.filter_by(room_id=self.room_id).first()
+        start_time = (datetime.now() + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+        first, _ = create_booking(user.id, seat.id, start_time, start_time + timedelta(hours=2))
+        deadlines.rebuild()
+        
+        # 重建后由其他进程创建的预约按ID水位线加载
+        second, _ = create_booking(user.id, seat.id, start_time + timedelta(hours=2), start_time + timedelta(hours=3))
+        self.assertEqual(deadlines.run_pending(start_time - timedelta(hours=1)), {})
+        self.assertEqual(deadlines.next_due(), start_time - timedelta(minutes=15))
+        
+        deadlines.run_pending(start_time - timedelta(minutes=15))
+        self.assertEqual(fired, [(REMINDER, [first.id])])
+        
+        # 同一时刻到期的同类事件合并处理
+        deadlines.run_pending(start_time + timedelta(hours=2, minutes=5))
+        self.assertEqual(fired[1:], [
+            (REMINDER, [second.id]),
+            (LATE_WARNING, [first.id]),
+            (EXPIRY, [first.id]),
+            (COMPLETION, [first.id])
+        ])
+        self.assertEqual(deadlines.next_due(), start_time + timedelta(hours=2, minutes=10))
+        
+        # 其他进程提交的预约ID小于本进程直接入堆的预约时仍会被轮询加载，且不会重复入堆
+        from unittest import mock
+        fired.clear()
+        deadlines = DeadlineScheduler({kind: record(kind) for kind in (REMINDER, LATE_WARNING, EXPIRY, COMPLETION)})
+        deadlines.rebuild()
+        later = start_time + timedelta(days=1)
+        remote, _ = create_booking(user.id, seat.id, later, later + timedelta(hours=1))
+        local, _ = create_booking(user.id, seat.id, later + timedelta(hours=1), later + timedelta(hours=2))
+        self.assertLess(remote.id, local.id)
+        with mock.patch.object(DeadlineScheduler, 'running', True):
+            deadlines.schedule_booking(local)
+        deadlines.run_pending(later + timedelta(hours=1, minutes=45))
+        events = {kind: [booking_id for booking_id in booking_ids if booking_id in (remote.id, local.id)]
+                  for kind, booking_ids in fired}
+        self.assertEqual(events, {
+            REMINDER: [remote.id, local.id],
+            LATE_WARNING: [remote.id, local.id],
+            EXPIRY: [remote.id, local.id],
+            COMPLETION: [remote.id]
+        })
+
+    def test_16_outbox_batches_and_retries(self):
+        """测试发件箱复用SMTP连接批量发送，失败邮件退避重试"""
+        from app import mail
+        from app.models import OutboxEmail
+        from app.utils.outbox import OutboxSender
+        
+        smtp = SMTPStandIn()
+        self.app.config.update(
+            MAIL_SERVER='127.0.0.1',
+            MAIL_PORT=smtp.server_address[1],
+            MAIL_USE_TLS=False,
+            MAIL_USERNAME=None,
+            MAIL_SUPPRESS_SEND=False
+        )
+        mail.init_app(self.app)
+        
+        sender = OutboxSender()
+        sender.init_app(self.app)
+        for recipient in ('a@fudan.edu.cn', 'reject@fudan.edu.cn', 'b@fudan.edu.cn'):
+            sender.enqueue(recipient, '测试', '<p>测试</p>')
+        
+        # 三封邮件共用一个连接，被拒收的邮件稍后重试
+        self.assertEqual(sender.flush(), 2)
+        self.assertEqual(smtp.connections, 1)
+        self.assertEqual(smtp.messages, ['a@fudan.edu.cn', 'b@fudan.edu.cn'])
+        rejected = OutboxEmail.query.filter_by(recipient='reject@fudan.edu.cn').first()
+        self.assertEqual(rejected.status, 'pending')
+        self.assertEqual(rejected.attempts, 1)
+        self.assertGreater(rejected.next_attempt_at, datetime.now())
+        
+        # 统计来自数据库，未运行发送线程的其他进程也能得到发送延迟
+        stats = OutboxSender().stats()
+        self.assertEqual(stats['pending'], 1)
+        self.assertEqual(stats['sent'], 2)
+        self.assertIsNotNone(stats['avg_send_seconds'])
+        self.assertIsNotNone(stats['avg_queue_seconds'])
+        
+        # 未到重试时间不发送，超过最大次数后标记为失败
+        self.assertEqual(sender.flush(), 0)
+        for attempt in range(sender.max_attempts - 1):
+            sender.flush(now=datetime.now() + timedelta(days=attempt + 1))
+        self.assertEqual(OutboxEmail.query.get(rejected.id).status, 'failed')
+        
+        # SMTP服务器不可用时整批推迟
+        smtp.shutdown()
+        smtp.server_close()
+        sender.enqueue('c@fudan.edu.cn', '测试', '<p>测试</p>')
+        self.assertEqual(sender.flush(), 0)
+        self.assertEqual(OutboxEmail.query.filter_by(recipient='c@fudan.edu.cn').first().attempts, 1)
+
+    def test_17_reminders_sent_once(self):
+        """测试同一预约的每类提醒只发送一次"""
+        from app.models import OutboxEmail
+        from app.utils.booking_service import create_booking
+        from app.utils.scheduler import send_upcoming_reminders, send_late_warnings
+        
+        user = self._create_user('ledger')
+        seat = Seat.query.filter_by(room_id=self.room_id).first()
+        start_time = (datetime.now() + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+        booking, _ = create_booking(user.id, seat.id, start_time, start_time + timedelta(hours=1))
+        
+        # 重复触发（如调度器重启后重建事件）不会重复发送
+        for minutes in (-15, -10, -5):
+            send_upcoming_reminders([booking.id], start_time + timedelta(minutes=minutes))
+        for minutes in (10, 12):
+            send_late_warnings([booking.id], start_time + timedelta(minutes=minutes))
+        
+        subjects = [email.subject for email in OutboxEmail.query.filter_by(recipient=user.email)]
+        self.assertEqual(sorted(subjects), ['[复旦自习室] 签到提醒', '[复旦自习室] 预约即将开始'])
+
+    def test_18_scheduler_leader_election(self):
+        """测试多个进程中只有一个调度器主节点，主节点退出后由其他进程接管"""
+        context = multiprocessing.get_context('spawn')
+        events = context.Queue()
+        name = f'scheduler-{self.random_suffix}'
+        lease_seconds = 2
+        processes = [context.Process(target=run_leader_candidate, args=(name, lease_seconds, events), daemon=True)
+                     for _ in range(3)]
+        
+        def next_leader(timeout):
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                try:
+                    kind, pid = events.get(timeout=deadline - time.monotonic())
+                except queue.Empty:
+                    break
+                if kind == 'elected':
+                    return pid
+            return None
+        
+        try:
+            for process in processes:
+                process.start()
+            
+            leader = next_leader(30)
+            self.assertIsNotNone(leader)
+            # 租约有效期内不会出现第二个主节点
+            self.assertIsNone(next_leader(lease_seconds * 2))
+            
+            # 模拟主节点崩溃：直接终止进程，不释放租约
+            next(p for p in processes if p.pid == leader).terminate()
+            successor = next_leader(lease_seconds * 3)
+            self.assertIsNotNone(successor)
+            self.assertNotEqual(successor, leader)
+            self.assertIsNone(next_leader(lease_seconds))
+        finally:
+            for process in processes:
+                process.terminate()
+                process.join()
+
+    def test_19_admin_bookings_keyset_pagination(self):
+        """测试预约管理页按 (开始时间, ID) 分页且每页查询数固定"""
+        self.app.config['ADMIN_PAGE_SIZE'] = 3
+        user_ids = self._create_users_bulk('page', 7)
+        seat_ids = [seat.id for seat in Seat.query.filter_by(room_id=self.room_id).order_by(Seat.id)]
+        start_time = datetime(2030, 1, 1, 9)
+        # 部分预约开始时间相同，需要按ID区分先后
+        db.session.execute(insert(Booking), [{
+            'user_id': user_id,
+            'seat_id': seat_ids[i],
+            'start_time': start_time + timedelta(hours=i // 2),
+            'end_time': start_time + timedelta(hours=i // 2 + 1),
+            'status': 'confirmed'
+        } for i, user_id in enumerate(user_ids)])
+        db.session.commit()
+        expected = [booking.id for booking in Booking.query.order_by(Booking.start_time.desc(), Booking.id.desc())]
+        
+        self.client.post('/auth/login', data={'student_id': f'admin_{self.random_suffix}', 'password': 'adminpw'})
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            seen = []
+            url = '/admin/bookings'
+            while url:
+                statements.clear()
+                page = self.client.get(url).get_data(as_text=True)
+                # 用户、座位和自习室随预约一起加载，查询数与每页行数无关
+                self.assertLessEqual(len(statements), 6)
+                seen += [int(booking_id) for booking_id in re.findall(r'<tr>\s*<td>(\d+)</td>', page)]
+                older = re.search(r'href="([^"]*before=[^"]*)"', page)
+                url = html.unescape(older.group(1)) if older else None
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(seen, expected)
+        
+        # 从最后一页向前翻页
+        newer = re.search(r'href="([^"]*after=[^"]*)"', page)
+        page = self.client.get(html.unescape(newer.group(1))).get_data(as_text=True)
+        self.assertEqual([int(i) for i in re.findall(r'<tr>\s*<td>(\d+)</td>', page)], expected[3:6])
+
+    def test_20_usage_rollups(self):
+        """测试使用统计汇总表随预约状态变化增量刷新"""
+        from app.models import RoomUsageHourly
+        from app.utils.booking_service import create_booking
+        from app.utils.rollups import refresh_usage_rollups, usage_summary
+        from app.utils.scheduler import expire_overdue_bookings
+        
+        seats = Seat.query.filter_by(room_id=self.room_id).order_by(Seat.id).all()
+        users = [self._create_user(f'rollup{i}') for i in range(3)]
+        start_time = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+        bookings = [create_booking(user.id, seats[i].id, start_time, start_time + timedelta(hours=2))[0]
+                    for i, user in enumerate(users)]
+        
+        # 首次刷新时完整重建
+        refresh_usage_rollups()
+        status_data, room_usage = usage_summary(start_time)
+        self.assertEqual(status_data, {'confirmed': 3})
+        self.assertEqual(room_usage[0][1:], (3, 6.0, 0.0))
+        
+        # 签到、取消和批量过期都会被下一次刷新汇总
+        bookings[0].check_in()
+        bookings[1].cancel()
+        expire_overdue_bookings()
+        self.assertEqual(refresh_usage_rollups(), 1)
+        status_data, room_usage = usage_summary(start_time)
+        self.assertEqual(status_data, {'checked_in': 1, 'cancelled': 1, 'expired': 1})
+        self.assertEqual(room_usage[0][1], 3)
+        # 签到座位小时从签到时间算起
+        self.assertTrue(0 < room_usage[0][3] <= 1.0)
+        self.assertEqual(RoomUsageHourly.query.count(), 3)
+        
+        # 统计页面只读取汇总表
+        self.client.post('/auth/login', data={'student_id': f'admin_{self.random_suffix}', 'password': 'adminpw'})
+        response = self.client.get('/admin/statistics?period=month')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('签到座位小时', response.get_data(as_text=True))
+
+    def test_21_occupancy_heatmap(self):
+        """测试按星期和小时的占用率与爽约率热力图"""
+        from app.utils.analytics import occupancy_heatmap
+        
+        user_ids = self._create_users_bulk('heat', 3)
+        seat_ids = [seat.id for seat in Seat.query.filter_by(room_id=self.room_id).order_by(Seat.id)]
+        day = datetime(2030, 1, 7)
+        db.session.execute(insert(Booking), [
+            {'user_id': user_ids[0], 'seat_id': seat_ids[0], 'status': 'completed',
+             'start_time': day.replace(hour=9), 'end_time': day.replace(hour=11)},
+            {'user_id': user_ids[1], 'seat_id': seat_ids[1], 'status': 'expired',
+             'start_time': day.replace(hour=9), 'end_time': day.replace(hour=10)},
+            {'user_id': user_ids[2], 'seat_id': seat_ids[2], 'status': 'cancelled',
+             'start_time': day.replace(hour=10), 'end_time': day.replace(hour=11)},
+        ])
+        db.session.commit()
+        
+        # 区间为两周，该星期出现两次，占用率按两天的座位小时计算
+        heatmap = occupancy_heatmap(day.date(), day.date() + timedelta(days=13))
+        room = [room['id'] for room in heatmap['rooms']].index(self.room_id)
+        weekday = day.weekday()
+        occupancy = heatmap['occupancy'][room][weekday]
+        self.assertEqual(occupancy[9], 0.05)
+        self.assertEqual(occupancy[10], 0.05)
+        self.assertEqual(sum(occupancy), 0.1)
+        self.assertEqual(heatmap['no_show'][room][weekday][9], 0.5)
+        self.assertEqual(heatmap['bookings'][room][weekday][9], 2)
+        self.assertEqual(heatmap['bookings'][room][weekday][10], 0)
+        
+        self.client.post('/auth/login', data={'student_id': f'admin_{self.random_suffix}', 'password': 'adminpw'})
+        response = self.client.get('/admin/analytics?start=2030-01-07&end=2030-01-20')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('爽约率', response.get_data(as_text=True))
+
+    def test_22_export_bookings_streams_in_batches(self):
+        """测试按筛选条件分批流式导出预约"""
+        self.app.config['EXPORT_BATCH_SIZE'] = 10
+        user_ids = self._create_users_bulk('export', 25)
+        seat_ids = [seat.id for seat in Seat.query.filter_by(room_id=self.room_id).order_by(Seat.id)]
+        start_time = datetime(2030, 3, 1, 8)
+        db.session.execute(insert(Booking), [{
+            'user_id': user_id,
+            'seat_id': seat_ids[i % len(seat_ids)],
+            'start_time': start_time + timedelta(hours=i // len(seat_ids)),
+            'end_time': start_time + timedelta(hours=i // len(seat_ids) + 1),
+            'status': 'expired' if i % 5 == 0 else 'completed'
+        } for i, user_id in enumerate(user_ids)])
+        db.session.commit()
+        expected = [booking.id for booking in Booking.query.filter_by(status='completed').order_by(Booking.start_time, Booking.id)]
+        
+        self.client.post('/auth/login', data={'student_id': f'admin_{self.random_suffix}', 'password': 'adminpw'})
+        response = self.client.get(f'/admin/bookings/export?status=completed&room_id={self.room_id}&date=2030-03-01')
+        self.assertTrue(response.is_streamed)
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True).lstrip('\ufeff'))))
+        self.assertEqual([int(row['booking_id']) for row in rows], expected)
+        self.assertEqual(rows[0]['room'], '测试自习室')
+        self.assertTrue(rows[0]['student_id'].startswith('export'))
+        
+        if importlib.util.find_spec('pyarrow'):
+            import pyarrow.parquet as pq
+            response = self.client.get('/admin/bookings/export?format=parquet&status=completed')
+            parquet = pq.ParquetFile(io.BytesIO(response.get_data()))
+            # 每批写成一个行组
+            self.assertEqual(parquet.metadata.num_row_groups, 2)
+            self.assertEqual(parquet.read().column('booking_id').to_pylist(), expected)
+
+    def test_23_dashboard_counters_cached(self):
+        """测试控制面板计数器被缓存，座位写入后立即失效"""
+        from app.utils.booking_service import create_booking
+        
+        user = self._create_user('dash')
+        seat = Seat.query.filter_by(room_id=self.room_id).first()
+        start_time = (datetime.now() + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+        create_booking(user.id, seat.id, start_time, start_time + timedelta(hours=1))
+        self.client.post('/auth/login', data={'student_id': f'admin_{self.random_suffix}', 'password': 'adminpw'})
+        self.client.get('/admin/')
+        
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            page = self.client.get('/admin/').get_data(as_text=True)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        # 计数来自缓存，最近预约只需一次联表查询
+        self.assertFalse([sql for sql in statements if 'count(' in sql])
+        self.assertEqual(len([sql for sql in statements if 'FROM bookings' in sql]), 1)
+        self.assertIn('dash用户', page)
+        
+        self.client.post(f'/admin/room/{self.room_id}/add_seats', data={'start_num': 11, 'count': 5})
+        page = self.client.get('/admin/').get_data(as_text=True)
+        self.assertRegex(page, r'<h4 class="card-title">15</h4>')
+
+    def test_24_bulk_seat_import(self):
+        """测试座位批量导入：逐行报告错误，全部正确时一次性插入"""
+        from app.utils.seat_import import import_seat_rows
+        
+        self.client.post('/auth/login', data={'student_id': f'admin_{self.random_suffix}', 'password': 'adminpw'})
+        bad_csv = 'seat_number,has_power_outlet,pos_x,pos_y\nA1,是,1,1\nA1,否,2,1\nA3,maybe,3,1\nA4,1,x,1\n'
+        response = self.client.post(f'/admin/room/{self.room_id}/import_seats', data={
+            'file': (io.BytesIO(bad_csv.encode('utf-8')), 'seats.csv')
+        }, content_type='multipart/form-data')
+        page = response.get_data(as_text=True)
+        self.assertIn('座位号 A1 重复', page)
+        self.assertIn('无法识别的电源插座取值', page)
+        self.assertIn('pos_x 必须是整数', page)
+        self.assertEqual(Seat.query.filter_by(room_id=self.room_id).count(), 10)
+        
+        good_json = json.dumps([{'seat_number': 'A1', 'has_power_outlet': True, 'pos_x': 1, 'pos_y': 1},
+                                {'seat_number': 'A2', 'pos_x': 2, 'pos_y': 1}])
+        response = self.client.post(f'/admin/room/{self.room_id}/import_seats', data={
+            'file': (io.BytesIO(good_json.encode('utf-8')), 'seats.json')
+        }, content_type='multipart/form-data', follow_redirects=True)
+        self.assertIn('成功导入 2 个座位', response.get_data(as_text=True))
+        seat = Seat.query.filter_by(room_id=self.room_id, seat_number='A1').one()
+        self.assertTrue(seat.has_power_outlet)
+        self.assertEqual((seat.pos_x, seat.pos_y), (1, 1))
+        self.assertEqual(StudyRoom.query.get(self.room_id).capacity, 12)
+        
+        # 新馆区：按 room 列新建自习室并批量导入5万个座位
+        rows = [{'room': f'新馆{i // 10000}', 'building': '新馆', 'floor': str(i // 10000 + 1),
+                 'seat_number': str(i % 10000), 'has_power_outlet': '1' if i % 2 else '0',
+                 'pos_x': str(i % 100), 'pos_y': str(i % 10000 // 100)} for i in range(50000)]
+        started = time.monotonic()
+        created, errors = import_seat_rows(rows)
+        self.assertEqual((created, errors), (50000, []))
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual(StudyRoom.query.filter(StudyRoom.name.like('新馆%')).count(), 5)
+        self.assertEqual(StudyRoom.query.filter_by(name='新馆0').one().capacity, 10000)
+
+    def test_25_archive_old_bookings(self):
+        """测试旧预约分批归档后仍可在历史记录、统计和导出中查询"""
+        from app.models import ArchivedBooking, BookingNotification
+        from app.utils.archive import archive_bookings, booking_history
+        from app.utils.rollups import rebuild_usage_rollups, usage_summary
+        from app.utils.booking_service import create_booking
+        
+        user = self._create_user('archive')
+        seat_ids = [seat.id for seat in Seat.query.filter_by(room_id=self.room_id).order_by(Seat.id)]
+        now = datetime.now().replace(minute=0, second=0, microsecond=0)
+        old = now - timedelta(days=100)
+        statuses = ['completed', 'cancelled', 'expired', 'completed', 'confirmed']
+        db.session.execute(insert(Booking), [{
+            'user_id': user.id, 'seat_id': seat_ids[i], 'status': status,
+            'start_time': old + timedelta(hours=i), 'end_time': old + timedelta(hours=i + 1)
+        } for i, status in enumerate(statuses)])
+        # 最近的预约不归档
+        recent, _ = create_booking(user.id, seat_ids[0], now - timedelta(days=2), now - timedelta(days=2, hours=-1))
+        recent.complete()
+        old_ids = [booking.id for booking in Booking.query.filter(Booking.start_time < now - timedelta(days=50))]
+        db.session.add(BookingNotification(booking_id=old_ids[0], kind='reminder'))
+        db.session.commit()
+        
+        self.assertEqual(archive_bookings(now=now, batch_size=2), 4)
+        self.assertEqual(archive_bookings(now=now, batch_size=2), 0)
+        # 未结束的预约留在热表中
+        self.assertEqual({booking.status for booking in Booking.query.filter_by(user_id=user.id)}, {'confirmed', 'completed'})
+        self.assertEqual(ArchivedBooking.query.count(), 4)
+        self.assertEqual(BookingNotification.query.count(), 0)
+        
+        history = booking_history(user.id, old - timedelta(days=1), now)
+        self.assertEqual([booking.id for booking in history], [recent.id] + old_ids[::-1])
+        self.assertEqual(history[-1].seat.room.name, '测试自习室')
+        
+        rebuild_usage_rollups()
+        status_data, _ = usage_summary(old - timedelta(days=1))
+        self.assertEqual(status_data, {'completed': 3, 'cancelled': 1, 'expired': 1, 'confirmed': 1})
+        
+        self.client.post('/auth/login', data={'student_id': f'admin_{self.random_suffix}', 'password': 'adminpw'})
+        exported = self.client.get('/admin/bookings/export').get_data(as_text=True)
+        self.assertEqual(len(exported.strip().splitlines()), 1 + 6)
+        
+        # 删除旧预约后新预约的ID不会与归档表冲突
+        booking, _ = create_booking(user.id, seat_ids[1], now + timedelta(days=1), now + timedelta(days=1, hours=1))
+        self.assertGreater(booking.id, max(old_ids + [recent.id]))
+
+    def test_26_cached_user_loader(self):
+        """测试登录用户加载器命中缓存时不查询数据库，用户修改提交后缓存失效"""
+        from app.models.user import load_user
+        from app.utils.user_cache import user_cache
+        from app.utils.scheduler import expire_overdue_bookings
+        
+        user = self._create_user('cache')
+        user_id = user.id
+        load_user(str(user_id))
+        db.session.remove()
+        
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            hits = user_cache.stats()['hits']
+            user = load_user(str(user_id))
+            self.assertEqual(user.username, 'cache用户')
+            self.assertTrue(user.check_password('123456'))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(statements, [])
+        self.assertEqual(user_cache.stats()['hits'], hits + 1)
+        
+        # 修改资料和管理员标记，提交后下一次加载读到新值
+        user.username = '新名字'
+        user.is_admin = True
+        db.session.commit()
+        db.session.remove()
+        user = load_user(str(user_id))
+        self.assertEqual((user.username, user.is_admin), ('新名字', True))
+        
+        # 回滚的修改不使缓存失效
+        user.username = '回滚'
+        db.session.flush()
+        db.session.rollback()
+        db.session.remove()
+        hits = user_cache.stats()['hits']
+        self.assertEqual(load_user(str(user_id)).username, '新名字')
+        self.assertEqual(user_cache.stats()['hits'], hits + 1)
+        
+        # 批量UPDATE增加违约次数后显式失效
+        seat_id = Seat.query.filter_by(room_id=self.room_id).first().id
+        db.session.add(Booking(user_id=user_id, seat_id=seat_id,
+                               start_time=datetime.now() - timedelta(hours=1),
+                               end_time=datetime.now() + timedelta(hours=1)))
+        db.session.commit()
+        expire_overdue_bookings()
+        db.session.remove()
+        self.assertEqual(load_user(str(user_id)).violation_count, 1)
+        self.assertIsNone(load_user('999999'))
+
+    def test_27_password_hasher_busy_and_rehash(self):
+        """测试密码哈希队列满时返回繁忙，登录时旧强度的哈希被升级"""
+        from app.utils.passwords import password_hasher
+        
+        user = self._create_user('hash')
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:260000$'))
+        self.app.config.update(PASSWORD_HASH_METHOD='pbkdf2:sha256:1000',
+                               PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE_LIMIT=0)
+        password_hasher.init_app(self.app)
+        
+        # 占满唯一的哈希线程
+        started, release = threading.Event(), threading.Event()
+        blocker = threading.Thread(target=password_hasher._run, args=(lambda: (started.set(), release.wait()),))
+        blocker.start()
+        started.wait(5)
+        try:
+            response = self.client.post('/auth/login', data={'student_id': user.student_id, 'password': '123456'})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '1')
+            self.assertIn('请稍后重试', response.get_data(as_text=True))
+        finally:
+            release.set()
+            blocker.join()
+        self.assertEqual(password_hasher.stats()['rejected'], 1)
+        
+        response = self.client.post('/auth/login', data={'student_id': user.student_id, 'password': '123456'})
+        self.assertEqual(response.status_code, 302)
+        db.session.expire_all()
+        user = db.session.get(User, user.id)
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(user.check_password('123456'))
+        self.assertFalse(user.check_password('wrong'))
+        self.assertEqual(password_hasher.stats()['rehashed'], 1)
+
+    def test_28_bulk_roster_import(self):
+        """测试花名册批量导入：集合查询校验唯一性，进程池哈希密码，中断后可继续"""
+        from app.utils.roster_import import import_roster
+        from app.utils.file_rows import read_rows
+        
+        suffix = self.random_suffix
+        bad_csv = ('student_id,name,email\n'
+                   f'r1_{suffix},甲,r1_{suffix}@fudan.edu.cn\n'
+                   f'r1_{suffix},乙,r2_{suffix}@fudan.edu.cn\n'
+                   f'r3_{suffix},丙,r3@gmail.com\n'
+                   f'r4_{suffix},丁,admin_{suffix}@fudan.edu.cn\n')
+        rows = read_rows(io.StringIO(bad_csv), 'roster.csv')
+        created, skipped, errors = import_roster(rows, workers=2, credentials=io.StringIO())
+        self.assertEqual((created, skipped), (0, 0))
+        self.assertEqual([line for line, _ in errors], [2, 3, 4])
+        self.assertIn('已被学号', errors[-1][1])
+        
+        roster = [{'student_id': f'roster{i}_{suffix}', 'username': f'学生{i}',
+                   'email': f'roster{i}_{suffix}@fudan.edu.cn'} for i in range(50)]
+        roster[0]['password'] = 'given-password'
+        created, _, errors = import_roster(roster[:20], workers=2, credentials=None)
+        self.assertEqual(created, 0)
+        self.assertIn('输出文件', errors[0][1])
+        
+        # 先导入前20人模拟中断，再导入全部名单时跳过已导入的学生
+        credentials = io.StringIO()
+        self.assertEqual(import_roster(roster[:20], workers=2, batch_size=8, method='pbkdf2:sha256:1000',
+                                       credentials=credentials), (20, 0, []))
+        self.assertEqual(import_roster(roster, workers=2, batch_size=8, method='pbkdf2:sha256:1000',
+                                       credentials=credentials), (30, 20, []))
+        generated = dict(csv.reader(io.StringIO(credentials.getvalue())))
+        self.assertEqual(len(generated), 49)
+        self.assertNotIn(roster[0]['student_id'], generated)
+        
+        users = {user.student_id: user for user in User.query.filter(User.student_id.like(f'roster%_{suffix}'))}
+        self.assertEqual(len(users), 50)
+        self.assertTrue(users[roster[0]['student_id']].check_password('given-password'))
+        self.assertTrue(users[roster[49]['student_id']].check_password(generated[roster[49]['student_id']]))
+
+    def test_29_booking_admission_queue(self):
+        """测试预约准入队列：批量判断冲突并提交，票据可轮询，队列满时提示重试"""
+        from app.utils.admission import booking_admission
+        from app.models import BookingSlot
+        
+        user_ids = self._create_users_bulk('queue', 30)
+        seat_ids = [seat.id for seat in Seat.query.filter_by(room_id=self.room_id).order_by(Seat.id)]
+        start_time = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time().replace(hour=9))
+        end_time = start_time + timedelta(hours=2)
+        
+        # 30 个学生抢 10 个座位，另有一个学生重复预约
+        tickets = [booking_admission.submit(user_id, seat_ids[i % 10], start_time, end_time)
+                   for i, user_id in enumerate(user_ids)]
+        tickets.append(booking_admission.submit(user_ids[0], seat_ids[1], start_time + timedelta(hours=1), end_time))
+        for ticket in tickets:
+            self.assertTrue(ticket.wait(10))
+        confirmed = [ticket for ticket in tickets if ticket.status == 'confirmed']
+        self.assertEqual(len(confirmed), 10)
+        self.assertEqual({ticket.seat_id for ticket in confirmed}, set(seat_ids))
+        self.assertEqual(tickets[10].error, '该座位在选择的时间段已被预约')
+        self.assertEqual(tickets[-1].error, '该座位在选择的时间段已被预约')
+        db.session.expire_all()
+        self.assertEqual(Booking.query.filter(Booking.start_time == start_time).count(), 10)
+        self.assertEqual(BookingSlot.query.filter(BookingSlot.booking_id.in_([t.booking_id for t in confirmed])).count(), 20)
+        self.assertLess(booking_admission.stats()['batches'], 31)
+        
+        # 通过页面预约并轮询票据
+        user = self._create_user('ticket', login=True)
+        self.app.config['ADMISSION_WAIT_SECONDS'] = 0
+        response = self.client.post('/student/book', data={
+            'seat_id': seat_ids[0], 'date': start_time.date().isoformat(), 'start_hour': 15, 'duration': 1
+        })
+        ticket_id = response.headers['Location'].rsplit('/', 1)[-1]
+        ticket = booking_admission.get_ticket(ticket_id)
+        self.assertTrue(ticket.wait(10))
+        status = self.client.get(f'/student/api/tickets/{ticket_id}').get_json()
+        self.assertEqual(status['status'], 'confirmed')
+        page = self.client.get(f'/student/tickets/{ticket_id}', follow_redirects=True).get_data(as_text=True)
+        self.assertIn('座位预约成功', page)
+        self.assertEqual(self.client.get('/student/api/tickets/unknown').status_code, 404)
+        
+        # 轮询落到其他进程时从数据库读取处理结果
+        booking_admission._tickets.clear()
+        status = self.client.get(f'/student/api/tickets/{ticket_id}').get_json()
+        self.assertEqual((status['status'], status['booking_id']), ('confirmed', ticket.booking_id))
+        page = self.client.get(f'/student/tickets/{ticket_id}', follow_redirects=True).get_data(as_text=True)
+        self.assertIn('座位预约成功', page)
+        # 其他进程中尚未处理完的票据仍显示为排队中，过期后不再等待
+        from app.utils.admission import BookingTicket
+        queued = BookingTicket(user.id, seat_ids[3], start_time, end_time)
+        self.assertEqual(self.client.get(f'/student/api/tickets/{queued.id}').get_json()['status'], 'pending')
+        self.assertIn('预约正在排队处理', self.client.get(f'/student/tickets/{queued.id}').get_data(as_text=True))
+        self.assertFalse(booking_admission.may_be_pending(queued.id, now=datetime.now() + timedelta(hours=1)))
+        self.assertGreaterEqual(booking_admission.purge(now=datetime.now() + timedelta(hours=1)), 31)
+        
+        # 队列已满时不排队
+        full = queue.Queue(maxsize=1)
+        full.put(None)
+        original, booking_admission._queue = booking_admission._queue, full
+        try:
+            self.assertIsNone(booking_admission.submit(user.id, seat_ids[2], start_time, end_time))
+        finally:
+            booking_admission._queue = original
+
+    def test_30_lottery_allocation(self):
+        """测试抽签放号：窗口内提交志愿，截止后按违约加权顺序一次性分配"""
+        from app.models import LotteryEntry, BookingSlot
+        from app.utils.lottery import allocate_lottery, priority_order, lottery_day, booking_blocked
+        from app.utils.booking_service import create_booking
+        
+        self.app.config.update(LOTTERY_ENABLED=True, LOTTERY_OPEN_HOUR=0, LOTTERY_CLOSE_HOUR=24)
+        day = lottery_day()
+        start_time = datetime.combine(day, datetime.min.time().replace(hour=9))
+        end_time = start_time + timedelta(hours=2)
+        seats = Seat.query.filter_by(room_id=self.room_id).order_by(Seat.seat_number).all()
+        
+        # 窗口内不能直接预约放号日的座位，只能提交志愿
+        user = self._create_user('lottery', login=True)
+        response = self.client.post('/student/book', data={
+            'seat_id': seats[0].id, 'date': day.isoformat(), 'start_hour': 9, 'duration': 2
+        })
+        self.assertTrue(response.headers['Location'].endswith('/student/lottery'))
+        response = self.client.post('/student/lottery', data={
+            'start_hour': 9, 'duration': 2, 'room_0': self.room_id, 'seat_0': seats[3].seat_number,
+            'room_1': self.room_id
+        }, follow_redirects=True)
+        self.assertIn('志愿已提交', response.get_data(as_text=True))
+        entry = LotteryEntry.query.filter_by(user_id=user.id, day=day).one()
+        self.assertEqual(entry.preferences, [{'room_id': self.room_id, 'seat_id': seats[3].id},
+                                             {'room_id': self.room_id, 'seat_id': None}])
+        
+        # 另一个座位已被预约；其中一个学生自己已有同时段的预约
+        user_ids = self._create_users_bulk('lot', 15)
+        create_booking(user_ids[0], seats[0].id, start_time, end_time)
+        other_room = StudyRoom(name='其他自习室', building='测试楼', floor=2, capacity=1)
+        db.session.add(other_room)
+        db.session.flush()
+        extra = Seat(room_id=other_room.id, seat_number='1')
+        db.session.add(extra)
+        db.session.flush()
+        create_booking(user_ids[1], extra.id, start_time, end_time)
+        db.session.add_all([LotteryEntry(user_id=user_id, day=day, start_time=start_time, end_time=end_time,
+                                         preferences=[{'room_id': self.room_id, 'seat_id': None}])
+                            for user_id in user_ids[1:]])
+        db.session.commit()
+        
+        # 分配提交前放号日及之后的日期都不能直接预约，与提交窗口的时间点无关
+        self.app.config.update(LOTTERY_CLOSE_HOUR=0)
+        self.assertTrue(booking_blocked(start_time))
+        self.assertTrue(booking_blocked(start_time + timedelta(days=2)))
+        self.assertFalse(booking_blocked(start_time - timedelta(days=1)))
+        
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            allocated, unallocated = allocate_lottery(day, rng=random.Random(1))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual((allocated, unallocated), (9, 6))
+        self.assertLessEqual(len([sql for sql in statements if sql.startswith('INSERT')]), 4)
+        
+        entries = {entry.user_id: entry for entry in LotteryEntry.query.filter_by(day=day)}
+        self.assertEqual(entries[user_ids[1]].status, 'unallocated')
+        booked = [entry.booking.seat_id for entry in entries.values() if entry.status == 'allocated']
+        self.assertEqual(len(set(booked)), 9)
+        self.assertNotIn(seats[0].id, booked)
+        self.assertEqual(BookingSlot.query.filter(BookingSlot.slot_start == start_time).count(), 11)
+        if entries[user.id].status == 'allocated':
+            self.assertIn(entries[user.id].booking.seat_id, booked)
+        self.assertEqual(allocate_lottery(day), (0, 0))
+        self.assertFalse(booking_blocked(start_time))
+        self.assertTrue(booking_blocked(start_time + timedelta(days=1)))
+        response = self.client.post('/student/book', data={
+            'seat_id': seats[1].id, 'date': (day + timedelta(days=1)).isoformat(), 'start_hour': 9, 'duration': 2
+        })
+        self.assertTrue(response.headers['Location'].endswith('/student/lottery'))
+        
+        # 之前的日期还有待分配的志愿时（分配失败）也不能直接预约
+        earlier = start_time - timedelta(days=1)
+        db.session.add(LotteryEntry(user_id=user_ids[2], day=earlier.date(), start_time=earlier,
+                                    end_time=earlier + timedelta(hours=1), preferences=[]))
+        db.session.commit()
+        self.assertTrue(booking_blocked(earlier))
+        
+        # 分配期间座位被其他途径抢先预约时，按同一顺序重新分配，学生继续尝试后面的志愿
+        from unittest import mock
+        from app.utils import lottery
+        later = start_time + timedelta(days=1)
+        first, second, outsider, anywhere = self._create_users_bulk('relot', 4)
+        # 整个自习室的志愿按座位顺序分配，座位 1 已被预约时分到 2 而不是 10
+        create_booking(user_ids[3], seats[0].id, later + timedelta(hours=3), later + timedelta(hours=4))
+        db.session.add_all([
+            LotteryEntry(user_id=anywhere, day=later.date(), start_time=later + timedelta(hours=3),
+                         end_time=later + timedelta(hours=4), preferences=[{'room_id': self.room_id, 'seat_id': None}]),
+            LotteryEntry(user_id=first, day=later.date(), start_time=later, end_time=later + timedelta(hours=1),
+                         preferences=[{'room_id': self.room_id, 'seat_id': seats[5].id},
+                                      {'room_id': self.room_id, 'seat_id': seats[6].id}]),
+            LotteryEntry(user_id=second, day=later.date(), start_time=later, end_time=later + timedelta(hours=1),
+                         preferences=[{'room_id': self.room_id, 'seat_id': seats[7].id}])
+        ])
+        db.session.commit()
+        assign = lottery._assign
+        
+        def assign_then_race(*args):
+            assignments = assign(*args)
+            if not BookingSlot.query.filter_by(user_id=outsider).count():
+                create_booking(outsider, seats[5].id, later, later + timedelta(hours=1))
+            return assignments
+        
+        with mock.patch.object(lottery, '_assign', side_effect=assign_then_race):
+            self.assertEqual(allocate_lottery(later.date()), (3, 0))
+        entries = {entry.user_id: entry for entry in LotteryEntry.query.filter_by(day=later.date())}
+        self.assertEqual(entries[first].booking.seat_id, seats[6].id)
+        self.assertEqual(entries[second].booking.seat_id, seats[7].id)
+        self.assertEqual(entries[anywhere].booking.seat.seat_number, '2')
+        self.assertFalse(booking_blocked(later))
+        
+        # 违约次数为 3 的学生权重为 1/4，排在前面的概率约为 1/5
+        rng = random.Random(7)
+        clean = LotteryEntry(user_id=1, day=day, start_time=start_time, end_time=end_time, preferences=[])
+        clean.id = 1
+        late = LotteryEntry(user_id=2, day=day, start_time=start_time, end_time=end_time, preferences=[])
+        late.id = 2
+        first = [priority_order([clean, late], {1: 0, 2: 3}, rng)[0] is clean for _ in range(4000)]
+        self.assertAlmostEqual(sum(first) / len(first), 0.8, delta=0.03)
+
+    def test_31_idempotency_keys(self):
+        """测试预约和取消请求的幂等键：重放返回原结果且不再执行预约逻辑"""
+        from app.models import IdempotencyKey
+        from app.utils.idempotency import idempotency_store
+        
+        user = self._create_user('idem', login=True)
+        seat = Seat.query.filter_by(room_id=self.room_id).first()
+        tomorrow = (datetime.now() + timedelta(days=1)).date().isoformat()
+        data = {'seat_id': seat.id, 'date': tomorrow, 'start_hour': 10, 'duration': 2, 'idempotency_key': 'book-1'}
+        
+        first = self.client.post('/student/book', data=data)
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            replay = self.client.post('/student/book', data=data, follow_redirects=True)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertIn('座位预约成功', replay.get_data(as_text=True))
+        self.assertEqual(replay.history[0].headers['Location'], first.headers['Location'])
+        self.assertFalse([sql for sql in statements if 'bookings' in sql and not sql.startswith('SELECT')])
+        self.assertEqual(Booking.query.filter_by(user_id=user.id).count(), 1)
+        
+        # 其他进程的重放：缓存未命中时从表中读取结果
+        idempotency_store._cache.clear()
+        response = self.client.post('/student/book', headers={'Idempotency-Key': 'book-1'}, data=data)
+        self.assertEqual(response.headers['Location'], first.headers['Location'])
+        self.assertEqual(Booking.query.filter_by(user_id=user.id).count(), 1)
+        
+        # 新的键正常执行，冲突结果同样被记录
+        data['idempotency_key'] = 'book-2'
+        self.assertIn('已被预约', self.client.post('/student/book', data=data, follow_redirects=True).get_data(as_text=True))
+        self.assertIn('已被预约', self.client.post('/student/book', data=data, follow_redirects=True).get_data(as_text=True))
+        
+        booking = Booking.query.filter_by(user_id=user.id).one()
+        for _ in range(2):
+            page = self.client.post(f'/student/cancel/{booking.id}', data={'idempotency_key': 'cancel-1'},
+                                    follow_redirects=True).get_data(as_text=True)
+            self.assertIn('预约已取消', page)
+            self.assertNotIn('此预约无法被取消', page)
+        self.assertEqual(idempotency_store.stats()['replays'], 4)
+        
+        # 同一个键用于其他请求
+        self.assertEqual(self.client.post(f'/student/cancel/{booking.id}', data={'idempotency_key': 'book-1'}).status_code, 422)
+        
+        # 不排队时幂等键和结果随预约在同一事务中写入，不单独提交
+        from unittest import mock
+        from app.utils.admission import booking_admission
+        later = (datetime.now() + timedelta(days=2)).date().isoformat()
+        statements = []
+        commits = []
+        listener = lambda *args: statements.append(args[2])
+        commit_listener = lambda *args: commits.append(args)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        event.listen(db.engine, 'commit', commit_listener)
+        try:
+            with mock.patch.object(booking_admission, 'enabled', False):
+                page = self.client.post('/student/book', data=dict(data, date=later, idempotency_key='sync'),
+                                        follow_redirects=True).get_data(as_text=True)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+            event.remove(db.engine, 'commit', commit_listener)
+        self.assertIn('座位预约成功', page)
+        writes = [sql.split('(')[0].strip() for sql in statements if not sql.startswith('SELECT')]
+        self.assertEqual(writes, ['INSERT INTO bookings', 'INSERT INTO booking_slots', 'INSERT INTO idempotency_keys'])
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(db.session.get(IdempotencyKey, (user.id, 'sync')).location, first.headers['Location'])
+        
+        # 并发的重复请求已提交同一个键时，本次事务因唯一约束回滚，重放它的结果
+        db.session.add(IdempotencyKey(user_id=user.id, key='race', endpoint='student.book', status_code=302,
+                                      location='/student/bookings', flashes=[['success', '座位预约成功！']]))
+        db.session.commit()
+        lookup = idempotency_store._lookup
+        misses = iter([None])
+        third = (datetime.now() + timedelta(days=3)).date().isoformat()
+        with mock.patch.object(booking_admission, 'enabled', False), \
+                mock.patch.object(idempotency_store, '_lookup', side_effect=lambda *args: next(misses, None) or lookup(*args)):
+            page = self.client.post('/student/book', data=dict(data, date=third, idempotency_key='race'),
+                                    follow_redirects=True).get_data(as_text=True)
+        self.assertIn('座位预约成功', page)
+        self.assertNotIn('已有其他预约', page)
+        self.assertEqual(Booking.query.filter_by(user_id=user.id).count(), 2)
+        
+        # 视图出错时释放键，可以用同一个键重试
+        self.assertEqual(self.client.post('/student/cancel/999999', data={'idempotency_key': 'missing'}).status_code, 404)
+        self.assertIsNone(db.session.get(IdempotencyKey, (user.id, 'missing')))
+        
+        self.assertEqual(idempotency_store.purge(now=datetime.now() + timedelta(days=2)), 4)
+
+    def test_32_recurring_bookings(self):
+        """测试周期预约：一次查询检查所有日期，全部成功或跳过失败日期"""
+        from app.utils.booking_service import create_booking
+        from app.utils.recurring import create_recurring_bookings
+        
+        user = self._create_user('recurring', login=True)
+        other = self._create_user('recurring_other')
+        seat = Seat.query.filter_by(room_id=self.room_id).first()
+        start = (datetime.now() + timedelta(days=7)).date()
+        end = start + timedelta(days=13)
+        weekdays = [start.weekday(), (start + timedelta(days=2)).weekday()]
+        
+        # 第二周的第一天座位已被其他用户预约
+        taken = start + timedelta(days=7)
+        create_booking(other.id, seat.id, datetime.combine(taken, datetime.min.time()).replace(hour=10),
+                       datetime.combine(taken, datetime.min.time()).replace(hour=12))
+        
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            bookings, failures = create_recurring_bookings(user.id, seat.id, start, end, weekdays, 10, 2)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(bookings, [])
+        self.assertEqual(failures, [(taken, '该座位在选择的时间段已被预约')])
+        self.assertEqual(len([sql for sql in statements if 'FROM booking_slots' in sql]), 1)
+        self.assertEqual(Booking.query.filter_by(user_id=user.id).count(), 0)
+        
+        # 跳过失败日期
+        response = self.client.post('/student/api/bookings/recurring', json={
+            'seat_id': seat.id, 'start_date': start.isoformat(), 'end_date': end.isoformat(),
+            'weekdays': weekdays, 'start_hour': 10, 'duration': 2, 'all_or_nothing': False
+        })
+        self.assertEqual(response.status_code, 201)
+        data = response.get_json()
+        self.assertEqual(len(data['created']), 3)
+        self.assertEqual(data['failed'], [{'date': taken.isoformat(), 'error': '该座位在选择的时间段已被预约'}])
+        self.assertEqual(Booking.query.filter_by(user_id=user.id).count(), 3)
+        
+        # 同一用户的时间冲突同样按日期报告
+        other_seat = Seat.query.filter(Seat.room_id == self.room_id, Seat.id != seat.id).first()
+        bookings, failures = create_recurring_bookings(user.id, other_seat.id, start, end, weekdays, 11, 1,
+                                                       all_or_nothing=False)
+        self.assertEqual([day for day, _ in failures], [start, start + timedelta(days=2), start + timedelta(days=9)])
+        self.assertEqual([booking.start_time.date() for booking in bookings], [taken])
+        
+        # 每次预约都受 MAX_BOOKING_HOURS 限制
+        max_hours = self.app.config['MAX_BOOKING_HOURS']
+        response = self.client.post('/student/api/bookings/recurring', json={
+            'seat_id': seat.id, 'start_date': start.isoformat(), 'end_date': end.isoformat(),
+            'weekdays': weekdays, 'start_hour': 8, 'duration': max_hours + 1
+        })
+        self.assertEqual(response.status_code, 400)
+        
+        # 表单页面
+        self.assertEqual(self.client.get(f'/student/recurring?seat_id={seat.id}').status_code, 200)
+        page = self.client.post('/student/recurring', data={
+            'seat_id': seat.id, 'start_date': start.isoformat(), 'end_date': end.isoformat(),
+            'weekdays': [str(day) for day in weekdays], 'start_hour': 15, 'duration': 1, 'mode': 'all'
+        }, follow_redirects=True).get_data(as_text=True)
+        self.assertIn('周期预约成功，共 4 次', page)
+
+    def test_33_group_booking(self):
+        """测试小组预约：连续段最佳适配、电源偏好和原子性"""
+        from app.utils.booking_service import create_booking
+        from app.utils.group_booking import find_group_seats
+        
+        organizer = self._create_user('group', login=True)
+        members = [self._create_user(f'member{i}') for i in range(4)]
+        other = self._create_user('group_other')
+        seats = {seat.seat_number: seat for seat in Seat.query.filter_by(room_id=self.room_id)}
+        seats['9'].has_power_outlet = True
+        db.session.commit()
+        start = datetime.combine((datetime.now() + timedelta(days=2)).date(), datetime.min.time()).replace(hour=10)
+        end = start + timedelta(hours=2)
+        
+        # 占用 3 号和 6 号座位后空闲段为 [1, 2]、[4, 5]、[7, 8, 9, 10]
+        create_booking(other.id, seats['3'].id, start, end)
+        create_booking(self._create_user('group_other2').id, seats['6'].id, start, end)
+        
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            room_id, chosen = find_group_seats([self.room_id], start, end, 2)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(len([sql for sql in statements if 'FROM seats' in sql]), 1)
+        self.assertEqual([seat['seat_number'] for seat in chosen], ['1', '2'])
+        _, chosen = find_group_seats([self.room_id], start, end, 2, prefer_power=True)
+        self.assertEqual([seat['seat_number'] for seat in chosen], ['8', '9'])
+        _, chosen = find_group_seats([self.room_id], start, end, 3)
+        self.assertEqual([seat['seat_number'] for seat in chosen], ['7', '8', '9'])
+        
+        # 没有足够长的连续段时从最长的段开始拼凑
+        response = self.client.post('/student/api/bookings/group', json={
+            'student_ids': [member.student_id for member in members], 'date': start.date().isoformat(),
+            'start_hour': 10, 'duration': 2
+        })
+        self.assertEqual(response.status_code, 201)
+        data = response.get_json()
+        self.assertFalse(data['contiguous'])
+        self.assertEqual(sorted(int(booking['seat_number']) for booking in data['bookings']), [1, 7, 8, 9, 10])
+        self.assertEqual(data['bookings'][0]['student_id'], organizer.student_id)
+        
+        # 任一成员冲突时不创建任何预约
+        before = Booking.query.count()
+        response = self.client.post('/student/api/bookings/group', json={
+            'student_ids': [members[0].student_id, other.student_id], 'date': start.date().isoformat(),
+            'start_hour': 11, 'duration': 2
+        })
+        self.assertEqual(response.status_code, 409)
+        self.assertIn(members[0].student_id, response.get_json()['error'])
+        self.assertIn(other.student_id, response.get_json()['error'])
+        self.assertEqual(Booking.query.count(), before)
+        
+        response = self.client.post('/student/api/bookings/group', json={
+            'student_ids': ['nobody'], 'date': start.date().isoformat(), 'start_hour': 14, 'duration': 1
+        })
+        self.assertIn('学号不存在', response.get_json()['error'])
+        
+        # 表单页面
+        self.assertEqual(self.client.get('/student/group').status_code, 200)
+        page = self.client.post('/student/group', data={
+            'student_ids': f'{members[0].student_id}，{members[1].student_id}', 'date': start.date().isoformat(),
+            'start_hour': 15, 'duration': 1, 'room_id': self.room_id
+        }, follow_redirects=True).get_data(as_text=True)
+        self.assertIn('小组预约成功', page)
+        self.assertEqual(Booking.query.count(), before + 3)
+        
+        # 与单人预约相同，自习室未开放的时间段不能预约
+        from datetime import time
+        closed = StudyRoom(name='夜间关闭的自习室', building='测试楼', floor=3, capacity=2,
+                           open_time=time(7, 0), close_time=time(22, 0))
+        db.session.add(closed)
+        db.session.flush()
+        db.session.add_all([Seat(room_id=closed.id, seat_number=str(i)) for i in (1, 2)])
+        db.session.commit()
+        night = {'student_ids': [members[2].student_id], 'date': start.date().isoformat(), 'start_hour': 23, 'duration': 2}
+        response = self.client.post('/student/api/bookings/group', json=dict(night, room_id=closed.id))
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('未开放', response.get_json()['error'])
+        response = self.client.post('/student/api/bookings/group', json=night)
+        self.assertEqual(response.get_json()['room_id'], self.room_id)
+        page = self.client.post('/student/book', data={
+            'seat_id': closed.seats.first().id, 'date': start.date().isoformat(), 'start_hour': 23, 'duration': 1
+        }, follow_redirects=True).get_data(as_text=True)
+        self.assertIn('未开放', page)
+        
+        # student_ids 必须是列表，字符串不会被逐字拆分
+        response = self.client.post('/student/api/bookings/group', json=dict(night, student_ids=members[3].student_id))
+        self.assertEqual(response.status_code, 400)
+
+    def test_34_upgrade_existing_database(self):
+        """测试升级旧数据库：补建已有表上新增的列、索引和预约的时间槽，可重复执行"""
+        from sqlalchemy import inspect, text
+        from app.utils.schema import upgrade_schema
+        
+        # 模拟加入使用汇总之前的 bookings 表
+        db.session.execute(text('DROP INDEX ix_bookings_updated_at'))
+        db.session.execute(text('ALTER TABLE bookings DROP COLUMN updated_at'))
+        # 模拟加入平面图坐标之前的 seats 表
+        db.session.execute(text('ALTER TABLE seats DROP COLUMN pos_x'))
+        db.session.execute(text('ALTER TABLE seats DROP COLUMN pos_y'))
+        db.session.execute(text('ALTER TABLE email_outbox DROP COLUMN send_seconds'))
+        db.session.commit()
+        
+        changes = upgrade_schema()
+        self.assertIn('添加列 bookings.updated_at', changes)
+        self.assertIn('创建索引 ix_bookings_updated_at', changes)
+        self.assertIn('updated_at', [column['name'] for column in inspect(db.engine).get_columns('bookings')])
+        self.assertIn('添加列 seats.pos_x', changes)
+        self.assertIn('添加列 seats.pos_y', changes)
+        self.assertIn('添加列 email_outbox.send_seconds', changes)
+        self.assertEqual(Booking.query.count(), 0)
+        self.assertEqual(Seat.query.filter_by(room_id=self.room_id).count(), 10)
+        self.assertEqual(upgrade_schema(), [])
+        
+        # 模拟没有 AUTOINCREMENT 的旧 bookings 表：已归档的ID可能被新预约复用
+        from app.models import ArchivedBooking
+        from app.utils.booking_service import create_booking
+        sql = db.session.execute(text("SELECT sql FROM sqlite_master WHERE name = 'bookings'")).scalar()
+        db.session.execute(text('DROP TABLE bookings'))
+        db.session.execute(text(sql.replace('AUTOINCREMENT', '')))
+        user = self._create_user('upgrade')
+        seat = Seat.query.filter_by(room_id=self.room_id).first()
+        now = datetime.now().replace(minute=0, second=0, microsecond=0)
+        db.session.add(ArchivedBooking(id=10, user_id=user.id, seat_id=seat.id, start_time=now - timedelta(days=100),
+                                       end_time=now - timedelta(days=100, hours=-1), status='completed'))
+        db.session.execute(insert(Booking), [{'user_id': user.id, 'seat_id': seat.id, 'status': 'completed',
+                                              'start_time': now - timedelta(days=1), 'end_time': now - timedelta(hours=23)}])
+        db.session.commit()
+        
+        changes = upgrade_schema()
+        self.assertIn('重建表 bookings（AUTOINCREMENT）', changes)
+        self.assertIn('创建索引 ix_bookings_status_start_time', changes)
+        self.assertIn('AUTOINCREMENT', db.session.execute(text("SELECT sql FROM sqlite_master WHERE name = 'bookings'")).scalar())
+        self.assertEqual(Booking.query.filter_by(user_id=user.id).count(), 1)
+        booking, _ = create_booking(user.id, seat.id, now + timedelta(days=1), now + timedelta(days=1, hours=1))
+        self.assertEqual(booking.id, 11)
+        self.assertEqual(upgrade_schema(), [])
+        
+        # 加入时间槽之前的有效预约没有时间槽，升级时一并补建
+        from app.models import BookingSlot
+        db.session.execute(insert(Booking), [{'user_id': user.id, 'seat_id': seat.id, 'status': 'confirmed',
+                                              'start_time': now + timedelta(days=2),
+                                              'end_time': now + timedelta(days=2, hours=2)}])
+        db.session.commit()
+        self.assertIn('为 1 个预约补建时间槽', upgrade_schema())
+        self.assertEqual(BookingSlot.query.filter(BookingSlot.slot_start >= now + timedelta(days=2)).count(), 2)
+        self.assertIsNotNone(create_booking(self._create_user('upgrade2').id, seat.id, now + timedelta(days=2, hours=1),
+                                            now + timedelta(days=2, hours=3))[1])
+        self.assertEqual(upgrade_schema(), [])
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file